@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Benchmark of GeoIP lookups
+
+Looks up random IPv4 and IPv6 addresses with geoip2's Reader, with maxminddb's reader, and
+with the compiled range index one address at a time and in one batch, and reports lookups
+per second. The index is built into a temporary file if -i isn't given.'''
+
+import argparse
+import ipaddress
+import os
+import random
+import tempfile
+import time
+
+import geoip2.database
+import geoip2.errors
+import maxminddb
+
+from ndr_server.geoip_index import GeoIPRangeIndex, build_index
+from ndr_server.snort_columns import PackedAddresses
+
+def make_addresses(count, version):
+    '''Synthesizes random addresses; IPv6 ones are in 2000::/3 so most of them are routed'''
+    generator = random.Random(version)
+    if version == 4:
+        return [ipaddress.IPv4Address(generator.getrandbits(32)) for _ in range(count)]
+    return [ipaddress.IPv6Address((1 << 125) | generator.getrandbits(125))
+            for _ in range(count)]
+
+def geoip2_lookups(reader, addresses):
+    '''Looks up each address with geoip2'''
+    for address in addresses:
+        try:
+            reader.city(address.compressed)
+        except geoip2.errors.AddressNotFoundError:
+            pass
+
+def maxminddb_lookups(reader, addresses):
+    '''Looks up each address with maxminddb'''
+    for address in addresses:
+        reader.get(address.compressed)
+
+def index_lookups(index, addresses):
+    '''Looks up each address with the index'''
+    for address in addresses:
+        index.lookup(address)
+
+def index_batch_lookups(index, addresses):
+    '''Looks up all the addresses with the index in one call'''
+    packed = PackedAddresses(addresses)
+    for info_id in set(index.lookup_packed(packed.is_v4, packed.high, packed.low).tolist()):
+        if info_id >= 0:
+            index.info(info_id)
+
+def main():
+    '''Runs the benchmark'''
+    parser = argparse.ArgumentParser(description="Benchmark GeoIP lookups")
+    parser.add_argument('database', help='GeoIP2 City database')
+    parser.add_argument('-i', '--index', help='Compiled index of the database')
+    parser.add_argument('-n', '--lookups', type=int, default=100000,
+                        help='Number of addresses of each version to look up')
+    args = parser.parse_args()
+
+    index_file = args.index
+    if index_file is None:
+        file_descriptor, index_file = tempfile.mkstemp(suffix='.idx')
+        os.close(file_descriptor)
+        started = time.perf_counter()
+        build_index(args.database, index_file)
+        print("built index in %.1f seconds" % (time.perf_counter() - started))
+
+    try:
+        index = GeoIPRangeIndex(index_file)
+        methods = [
+            ('geoip2', geoip2_lookups, geoip2.database.Reader(args.database)),
+            ('maxminddb', maxminddb_lookups, maxminddb.open_database(args.database)),
+            ('index', index_lookups, index),
+            ('index batch', index_batch_lookups, index),
+        ]
+
+        for version in (4, 6):
+            addresses = make_addresses(args.lookups, version)
+            for name, lookups, reader in methods:
+                started = time.perf_counter()
+                lookups(reader, addresses)
+                elapsed = time.perf_counter() - started
+                print("IPv%d %-12s %12.0f lookups/s" % (version, name, len(addresses) / elapsed))
+    finally:
+        if args.index is None:
+            os.remove(index_file)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Micro-benchmark of deduplicating the internet host breakdown
+
+Compares the old list scan deduplication against the hashing generator, with and without
+a top-N limit. The old path is quadratic, so it's only run on the first --old-rows rows.
+No database is required; records are synthesized in memory.'''
+
+import argparse
+import ipaddress
+import random
+import timeit
+
+import ndr_server
+from ndr_server.traffic_report import InternetHostRecord
+
+def make_records(count, unique):
+    '''Synthesizes count records spread over unique hosts, in random order'''
+    generator = random.Random(0)
+    records = []
+    for _ in range(count):
+        host = generator.randrange(unique)
+        hostname = "host%d.example.com" % host if host % 3 != 0 else None
+        records.append(InternetHostRecord(
+            local_ip=ipaddress.ip_address("10.0.0.1"),
+            global_ip=ipaddress.ip_address(0xC6120000 + host),
+            global_hostname=hostname,
+            isp="ISP %d" % (host % 50),
+            total_rx_bytes=generator.randrange(1, 100000),
+            total_tx_bytes=generator.randrange(1, 10000)))
+    return records
+
+def old_dedup(traffic_report):
+    '''generate_table_internet_host_traffic's row building as it was'''
+    table_data = []
+    for record in traffic_report:
+        host_field = record.global_hostname if record.global_hostname is not None else record.global_ip
+        isp_field = record.isp if record.isp is not None else ""
+        table_data.append([host_field, isp_field])
+
+    deduped_table_data = []
+    for row in table_data:
+        if row not in deduped_table_data:
+            deduped_table_data.append(row)
+    return deduped_table_data
+
+def main():
+    '''Runs the benchmark'''
+    parser = argparse.ArgumentParser(description="Benchmark internet host deduplication")
+    parser.add_argument('-n', '--rows', type=int, default=100000,
+                        help='Number of records')
+    parser.add_argument('-u', '--unique', type=int, default=20000,
+                        help='Number of distinct hosts')
+    parser.add_argument('--old-rows', type=int, default=10000,
+                        help='Records to run the old quadratic path on')
+    parser.add_argument('--top', type=int, default=100,
+                        help='Top N limit to time')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of timing runs')
+    args = parser.parse_args()
+
+    records = make_records(args.rows, args.unique)
+    rows = ndr_server.TsharkTrafficReportManager.internet_host_rows
+
+    runs = (
+        ('list scan', records[:args.old_rows], old_dedup),
+        ('hash', records, lambda r: list(rows(r))),
+        ('hash top %d' % args.top, records, lambda r: list(rows(r, top=args.top))),
+    )
+
+    for name, data, dedup in runs:
+        best = min(timeit.repeat(lambda: dedup(data), number=1, repeat=args.repeat))
+        print("%-14s %8d rows  %8.1f ms  %8.1f rows/ms  %6d output rows" % (
+            name, len(data), best * 1000, len(data) / (best * 1000), len(dedup(data))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Micro-benchmark of building model objects from database rows
+
+Compares the old path (a DictRow-like mapping per row fed through from_dict() into a
+__dict__ backed object) against the row mapper path (a plain tuple fed into the slotted
+from_row() constructor). No database is required; rows are synthesized in memory.'''
+
+import argparse
+import timeit
+import tracemalloc
+
+import ndr_server
+
+class DictBaselineHost(object):
+    '''BaselineHost as it was laid out before __slots__, kept here for comparison'''
+    def __init__(self, config):
+        self.pg_id = None
+        self.site_id = None
+        self.config = config
+        self.human_name = None
+
+    def from_dict(self, bhost_dict):
+        '''Deserializes a bhost'''
+        self.pg_id = bhost_dict['id']
+        self.site_id = bhost_dict['site_id']
+        self.human_name = bhost_dict['human_name']
+        return self
+
+COLUMNS = ('id', 'site_id', 'host_id', 'scan_type', 'human_name')
+
+def make_rows(count):
+    '''Synthesizes rows shaped like flattened_baseline_hosts_with_attributes'''
+    return [(i, 1, i * 2, 'arp-discovery', 'Host %d' % i) for i in range(count)]
+
+def build_dict_path(rows):
+    '''DictCursor style, a dict per row then from_dict()'''
+    return [DictBaselineHost(None).from_dict(dict(zip(COLUMNS, row))) for row in rows]
+
+def build_mapped_path(rows):
+    '''RowMapperCursor style, reorder the tuple then from_row()'''
+    indexes = [COLUMNS.index(column) for column in ndr_server.BaselineHost.ROW_COLUMNS]
+    from_row = ndr_server.BaselineHost.from_row
+    return [from_row(None, tuple(row[i] for i in indexes)) for row in rows]
+
+def measure_memory(builder, rows):
+    '''Returns the peak bytes allocated while building and holding the objects'''
+    tracemalloc.start()
+    objects = builder(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return peak
+
+def main():
+    '''Runs the benchmark'''
+    parser = argparse.ArgumentParser(description="Benchmark model object construction")
+    parser.add_argument('-n', '--rows', type=int, default=100000,
+                        help='Number of rows to build')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of timing runs')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    for name, builder in (('dict', build_dict_path), ('slots', build_mapped_path)):
+        best = min(timeit.repeat(lambda: builder(rows), number=1, repeat=args.repeat))
+        peak = measure_memory(builder, rows)
+        print("%-6s %8d rows  %8.1f ms  %8.1f rows/ms  peak %8.1f KiB" % (
+            name, args.rows, best * 1000, args.rows / (best * 1000), peak / 1024))
+
+if __name__ == '__main__':
+    main()
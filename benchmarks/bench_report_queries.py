@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Benchmark of the site traffic report queries
+
+Generates a synthetic dataset (several sites, recorders and days of traffic reports)
+inside a transaction, then times the old msg_id array based GeoIP breakdown against the
+current (site_id, received_at) range scan. Everything is rolled back afterwards, so this
+can be pointed at the test database.'''
+
+import argparse
+import time
+
+from datetime import datetime, timedelta
+import logging
+import ndr_server
+
+# The report procedure as it was before site_id was carried on the traffic facts
+OLD_MESSAGE_IDS = '''
+CREATE FUNCTION pg_temp.old_message_ids(_recorder_id bigint, _start timestamp, _end timestamp)
+    RETURNS bigint[] LANGUAGE plpgsql AS $$
+DECLARE
+    recorder_message_id bigint;
+    message_id_array bigint[];
+BEGIN
+    FOR recorder_message_id IN SELECT s.id FROM public.recorder_messages AS s WHERE
+        s.recorder_id = _recorder_id AND s.received_at >= _start AND
+        s.received_at <= _end AND s.message_type='traffic_report'
+    LOOP
+        message_id_array := array_append(message_id_array, recorder_message_id);
+    END LOOP;
+    RETURN message_id_array;
+END
+$$'''
+
+OLD_GEOIP_BREAKDOWN = '''
+CREATE FUNCTION pg_temp.old_geoip_breakdown(_site_id bigint, _start timestamp, _end timestamp)
+    RETURNS TABLE (country_name text, region_name text, total_rx_bytes bigint, total_tx_bytes bigint)
+    LANGUAGE plpgsql AS $$
+DECLARE
+    recorder_id bigint;
+    msg_ids bigint[];
+BEGIN
+    FOREACH recorder_id IN ARRAY admin.get_all_recorders_ids_in_site(_site_id) LOOP
+        msg_ids := array_cat(msg_ids, pg_temp.old_message_ids(recorder_id, _start, _end));
+    END LOOP;
+
+    RETURN QUERY
+        SELECT COALESCE(fot.country_name, 'Unknown'), COALESCE(fot.region_name, 'Unknown'),
+            SUM(tr.rx_bytes), SUM(tr.tx_bytes)
+        FROM traffic_report.full_outbound_traffic AS fot
+        LEFT JOIN traffic_report.traffic_reports AS tr ON (tr.id=fot.traffic_report_id)
+        WHERE tr.msg_id = ANY(msg_ids)
+        GROUP BY (fot.country_name, fot.region_name);
+END
+$$'''
+
+def generate_dataset(nsc, db_conn, args):
+    '''Fills the database with traffic for args.sites sites, returns the first site'''
+    org = ndr_server.Organization.create(nsc, "Benchmark Org", db_conn=db_conn)
+    start = datetime.now() - timedelta(days=args.days)
+
+    cursor = db_conn.cursor()
+    cursor.execute("SELECT admin.create_time_partitions(%s)", [start])
+
+    cursor.execute('''SELECT network_scan.get_or_create_ip_address(('10.0.' || g / 256 || '.' || g %% 256)::inet)
+                      FROM generate_series(1, %s) AS g''', [args.hosts])
+    local_ids = [row[0] for row in cursor.fetchall()]
+    cursor.execute('''SELECT network_scan.get_or_create_ip_address(('198.18.' || g / 256 || '.' || g %% 256)::inet)
+                      FROM generate_series(1, %s) AS g''', [args.hosts])
+    global_ids = [row[0] for row in cursor.fetchall()]
+
+    sites = []
+    for site_number in range(args.sites):
+        site = ndr_server.Site.create(nsc, org, "Benchmark Site %d" % site_number, db_conn=db_conn)
+        sites.append(site)
+        for recorder_number in range(args.recorders):
+            recorder = ndr_server.Recorder.create(
+                nsc, site, "Benchmark Recorder", "bench-%d-%d" % (site_number, recorder_number),
+                db_conn=db_conn)
+
+            # One traffic report message per hour per recorder
+            cursor.execute('''INSERT INTO public.recorder_messages (recorder_id, site_id, message_type,
+                                                                    generated_at, received_at)
+                              SELECT %s, %s, 'traffic_report', ts, ts
+                              FROM generate_series(%s::timestamp, now()::timestamp, interval '1 hour') AS ts''',
+                           [recorder.pg_id, site.pg_id, start])
+
+    cursor.execute('''INSERT INTO traffic_report.traffic_reports (msg_id, protocol, src_ip_id, src_port,
+                          dst_ip_id, dst_port, rx_bytes, tx_bytes, start_timestamp, duration,
+                          received_at, site_id)
+                      SELECT rm.id, 'tcp', (%s::bigint[])[1 + (rm.id + g) %% %s], 40000 + g,
+                          (%s::bigint[])[1 + (rm.id * g) %% %s], 443, g * 100, g * 10,
+                          rm.received_at, 1.0, rm.received_at, rm.site_id
+                      FROM public.recorder_messages AS rm, generate_series(1, %s) AS g
+                      WHERE rm.site_id IN (SELECT s.id FROM public.sites AS s WHERE s.org_id=%s)''',
+                   [local_ids, len(local_ids), global_ids, len(global_ids), args.flows, org.pg_id])
+
+    cursor.execute('''INSERT INTO traffic_report.network_outbound_traffic (traffic_report_id, msg_id,
+                          local_ip_id, global_ip_id, geoip_database_version, country_code,
+                          country_name, region_name, received_at, site_id)
+                      SELECT tr.id, tr.msg_id, tr.src_ip_id, tr.dst_ip_id, 'benchmark', 'XX',
+                          'Country ' || tr.dst_ip_id %% 20, 'Region ' || tr.dst_ip_id %% 50,
+                          tr.received_at, tr.site_id
+                      FROM traffic_report.traffic_reports AS tr
+                      WHERE tr.site_id IN (SELECT s.id FROM public.sites AS s WHERE s.org_id=%s)''',
+                   [org.pg_id])
+    rows = cursor.rowcount
+
+    cursor.execute("ANALYZE public.recorder_messages")
+    cursor.execute("ANALYZE traffic_report.traffic_reports")
+    cursor.execute("ANALYZE traffic_report.network_outbound_traffic")
+
+    cursor.execute(OLD_MESSAGE_IDS)
+    cursor.execute(OLD_GEOIP_BREAKDOWN)
+    cursor.close()
+
+    return sites[0], rows
+
+def time_query(db_conn, query, params, repeat):
+    '''Returns the best wall time in milliseconds and the row count'''
+    cursor = db_conn.cursor()
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    cursor.close()
+    return best, len(rows)
+
+def main():
+    '''Runs the benchmark'''
+    parser = argparse.ArgumentParser(description="Benchmark the site report queries")
+    parser.add_argument('-s', '--server-config', default='/etc/ndr/ndr_server.yml',
+                        help='NDR Server Configuration File')
+    parser.add_argument('--sites', type=int, default=10, help='Sites to generate')
+    parser.add_argument('--recorders', type=int, default=3, help='Recorders per site')
+    parser.add_argument('--days', type=int, default=28, help='Days of history per recorder')
+    parser.add_argument('--flows', type=int, default=50, help='Flows per traffic report')
+    parser.add_argument('--hosts', type=int, default=500, help='Distinct local and global hosts')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Timing runs per query')
+    parser.add_argument('-o', '--output', help='Also append the results to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    nsc = ndr_server.Config(logging.getLogger(), args.server_config)
+    db_conn = nsc.database.get_connection()
+
+    try:
+        site, rows = generate_dataset(nsc, db_conn, args)
+        end = datetime.now()
+        start = end - timedelta(days=1)
+
+        results = []
+        for name, query in (
+                ('msg_id array', "SELECT * FROM pg_temp.old_geoip_breakdown(%s, %s, %s)"),
+                ('range scan', "SELECT * FROM traffic_report.report_geoip_breakdown_for_site(%s, %s, %s)")):
+            best, count = time_query(db_conn, query, [site.pg_id, start, end], args.repeat)
+            results.append("%-14s %9d fact rows  %8.1f ms  %4d result rows" % (
+                name, rows, best, count))
+    finally:
+        db_conn.rollback()
+        nsc.database.return_connection(db_conn)
+        nsc.database.close()
+
+    for line in results:
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, 'a') as output:
+            output.write("# %s sites=%d recorders=%d days=%d flows=%d\n" % (
+                datetime.now().isoformat(), args.sites, args.recorders, args.days, args.flows))
+            for line in results:
+                output.write(line + "\n")
+
+if __name__ == '__main__':
+    main()
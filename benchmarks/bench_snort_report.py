@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Benchmark of the SNORT traffic report aggregation
+
+Times each stage of SnortTrafficColumns (loading the rows, classifying and GeoIP lookups,
+the country statistics and the per machine breakdown) on synthesized consolidated traffic.
+Lookups go to the GeoIP database given with -g, or to a stand in that files every address
+under one of a handful of countries so only the aggregation is measured.'''
+
+import argparse
+import collections
+import random
+import time
+
+import geoip2.database
+
+from ndr_server.snort_columns import SnortTrafficColumns
+
+Named = collections.namedtuple('Named', ['name'])
+Subdivisions = collections.namedtuple('Subdivisions', ['most_specific'])
+CityRecord = collections.namedtuple('CityRecord', ['country', 'subdivisions', 'city'])
+
+class FixedGeoip(object):
+    '''Answers city() lookups without a database'''
+
+    def __init__(self):
+        self.records = []
+        for country in range(20):
+            for subdivision in range(5):
+                self.records.append(CityRecord(
+                    Named("Country %d" % country),
+                    Subdivisions(Named("Subdivision %d" % subdivision)),
+                    Named("City %d" % subdivision)))
+
+    def city(self, address):
+        '''Returns a record picked by the address'''
+        return self.records[hash(address) % len(self.records)]
+
+def make_rows(count, machines, destinations):
+    '''Synthesizes consolidated traffic rows between local machines and global hosts'''
+    generator = random.Random(0)
+    local = ["192.168.%d.%d" % (machine // 250, machine % 250 + 1) for machine in range(machines)]
+    remote = ["%d.%d.%d.%d" % (generator.randrange(1, 223), generator.randrange(256),
+                               generator.randrange(256), generator.randrange(1, 255))
+              for _ in range(destinations)]
+
+    rows = []
+    for _ in range(count):
+        src, dst = generator.choice(local), generator.choice(remote)
+        if generator.random() < 0.5:
+            src, dst = dst, src
+        rows.append({'src': src, 'dst': dst,
+                     'rxpackets': generator.randrange(10000),
+                     'txpackets': generator.randrange(10000)})
+    return rows
+
+def main():
+    '''Runs the benchmark'''
+    parser = argparse.ArgumentParser(description="Benchmark SNORT report aggregation")
+    parser.add_argument('-n', '--rows', type=int, default=1000000,
+                        help='Number of consolidated traffic rows')
+    parser.add_argument('-m', '--machines', type=int, default=500,
+                        help='Number of local machines')
+    parser.add_argument('-d', '--destinations', type=int, default=20000,
+                        help='Number of global destinations')
+    parser.add_argument('-g', '--geoip-db', help='GeoIP2 City database to look up against')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.machines, args.destinations)
+    geoip_db = FixedGeoip()
+    if args.geoip_db is not None:
+        geoip_db = geoip2.database.Reader(args.geoip_db)
+
+    timings = []
+    started = time.perf_counter()
+    columns = SnortTrafficColumns.from_dicts(rows)
+    timings.append(('load', time.perf_counter() - started))
+
+    started = time.perf_counter()
+    columns.process(geoip_db)
+    timings.append(('process', time.perf_counter() - started))
+
+    started = time.perf_counter()
+    columns.statistics()
+    timings.append(('statistics', time.perf_counter() - started))
+
+    started = time.perf_counter()
+    columns.breakdown_by_local_ip()
+    timings.append(('breakdown', time.perf_counter() - started))
+
+    for name, elapsed in timings:
+        print("%-10s %8d rows  %8.1f ms" % (name, args.rows, elapsed * 1000))
+    print("%-10s %8d rows  %8.1f ms" % ('total', args.rows, sum(t for _, t in timings) * 1000))
+
+if __name__ == '__main__':
+    main()
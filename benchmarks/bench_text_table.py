@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Micro-benchmark of rendering report tables
+
+Renders a set of GeoIP breakdown shaped tables (the per machine sections of an inline
+report) with TextTable, and with terminaltables' AsciiTable if it's installed, and reports
+rows rendered per millisecond. No database is required; rows are synthesized in memory.'''
+
+import argparse
+import random
+import timeit
+
+from ndr_server.text_table import TextTable
+
+try:
+    from terminaltables import AsciiTable
+except ImportError:
+    AsciiTable = None
+
+def make_tables(count, rows):
+    '''Synthesizes count tables of rows rows each'''
+    generator = random.Random(0)
+    tables = []
+    for _ in range(count):
+        table_data = [['Country', 'Subdivision', 'RX Bytes', 'TX Bytes', 'RX %', 'TX %']]
+        for row in range(rows):
+            table_data.append(["Country %d" % generator.randrange(200),
+                               "Region %d" % row,
+                               generator.randrange(1 << 30),
+                               generator.randrange(1 << 30),
+                               generator.random() * 100,
+                               generator.random() * 100])
+        tables.append(table_data)
+    return tables
+
+def main():
+    '''Runs the benchmark'''
+    parser = argparse.ArgumentParser(description="Benchmark report table rendering")
+    parser.add_argument('-t', '--tables', type=int, default=300,
+                        help='Number of tables, one per machine')
+    parser.add_argument('-n', '--rows', type=int, default=50,
+                        help='Rows per table')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of timing runs')
+    args = parser.parse_args()
+
+    tables = make_tables(args.tables, args.rows)
+    total_rows = args.tables * (args.rows + 1)
+
+    renderers = [('TextTable', lambda table_data: TextTable(table_data).table)]
+    if AsciiTable is not None:
+        renderers.append(('AsciiTable', lambda table_data: AsciiTable(table_data).table))
+
+    for name, render in renderers:
+        best = min(timeit.repeat(lambda: [render(table_data) for table_data in tables],
+                                 number=1, repeat=args.repeat))
+        print("%-10s %8d rows  %8.1f ms  %8.1f rows/ms" % (
+            name, total_rows, best * 1000, total_rows / (best * 1000)))
+
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,10 @@
 from ndr_server.config import Config
 from ndr_server.organizations import Organization
 from ndr_server.db import Database
+from ndr_server.local_networks import LocalNetworkIndex, LocalNetworkRegistry
+from ndr_server.dimensions import DimensionCache, DimensionCaches
+from ndr_server.report_cache import ReportSnapshotCache
+from ndr_server.sketches import HostTrafficSketch, HyperLogLog, SpaceSaving
 from ndr_server.contacts import Contact, ContactMethods, OutputFormats
 from ndr_server.sites import Site
 from ndr_server.recorder import Recorder
@@ -38,5 +42,8 @@ from ndr_server.snort import (
 )
 from ndr_server.traffic_report import (
     TsharkTrafficReport,
-    TsharkTrafficReportManager
+    TsharkTrafficReportManager,
+    TsharkTrafficReportSnapshot,
+    ConsolidatedFlow,
+    consolidate_traffic_entries
 )
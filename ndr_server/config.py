@@ -48,6 +48,68 @@ class Config:
         self.db_username = config_dict['postgresql']['user']
         self.db_password = config_dict['postgresql']['password']
         self.db_dbname = config_dict['postgresql']['dbname']
+        self.db_prepared_procedures = config_dict['postgresql'].get('prepared_procedures', None)
+
+        # Connection pool settings; timeouts are in seconds
+        self.db_pool_min_size = config_dict['postgresql'].get('pool_min_size', 1)
+        self.db_pool_max_size = config_dict['postgresql'].get('pool_max_size', 100)
+        self.db_pool_idle_timeout = config_dict['postgresql'].get('pool_idle_timeout', 300)
+        self.db_pool_checkout_timeout = config_dict['postgresql'].get('pool_checkout_timeout', 30)
+        self.db_pool_validate_interval = config_dict['postgresql'].get(
+            'pool_validate_interval', 30)
+
+        # Query tracing; thresholds are in milliseconds, and None disables them
+        self.db_trace_procedures = config_dict['postgresql'].get('trace_procedures', True)
+        self.db_slow_query_ms = config_dict['postgresql'].get('slow_query_ms', None)
+        self.db_explain_query_ms = config_dict['postgresql'].get('explain_query_ms', None)
+        self.db_stats_file = config_dict['postgresql'].get('stats_file', None)
+        self.db_stats_interval = config_dict['postgresql'].get('stats_interval', 60)
+
+        # Rows fetched per round trip when reading large result sets through a cursor
+        self.db_fetch_batch_size = config_dict['postgresql'].get('fetch_batch_size', 10000)
+
+        # Optional read replica for reports; missing connection settings fall back to the
+        # primary's. max_staleness and check_interval are in seconds
+        self.db_replica = config_dict['postgresql'].get('replica', None)
+        if self.db_replica is not None:
+            self.db_replica_max_staleness = self.db_replica.get('max_staleness', 300)
+            self.db_replica_check_interval = self.db_replica.get('check_interval', 5)
+
+        # Days of data to keep per partitioned table (e.g. traffic_report.traffic_reports: 90);
+        # tables that aren't listed are kept forever
+        self.partition_retention_days = config_dict.get('partitions', {}).get('retention_days', {})
+
+        # Only list this many internet hosts per machine in reports (biggest by bytes first);
+        # None lists them all
+        self.report_internet_host_limit = config_dict.get('reports', {}).get('internet_host_limit', None)
+
+        # Cut off longer cells (hostnames mostly) in inline report tables; None doesn't
+        self.report_table_max_cell_width = config_dict.get('reports', {}).get('table_max_cell_width', None)
+
+        # Keep the aggregated report data of each site and period in this directory, so
+        # re-sending a period's reports doesn't redo the aggregations; None doesn't
+        self.report_snapshot_dir = config_dict.get('reports', {}).get('snapshot_dir', None)
+
+        # ndr-run-daily removes snapshots older than this many seconds
+        self.report_snapshot_max_age = config_dict.get('reports', {}).get('snapshot_max_age', 7 * 86400)
+
+        # Store the flows of a traffic report message that only differ by source port and
+        # start time as one row; with a bucket (in seconds), only flows starting in the same
+        # bucket are merged
+        self.traffic_consolidate_flows = config_dict.get('traffic_reports', {}).get('consolidate_flows', False)
+        self.traffic_consolidation_bucket = config_dict.get('traffic_reports', {}).get('consolidation_bucket', None)
+
+        # Keep each machine's daily top talkers and distinct destination sketches up to date
+        # as traffic reports are ingested
+        self.traffic_sketches_enabled = config_dict.get('traffic_sketches', {}).get('enabled', True)
+
+        # IDs of addresses, hostnames and syslog programs are cached in process by ingest,
+        # this many of each; with warm set the most recent ones are loaded at startup
+        self.dimension_cache_size = config_dict.get('dimension_cache', {}).get('max_size', 100000)
+        self.dimension_cache_warm = config_dict.get('dimension_cache', {}).get('warm', True)
+
+        # Each site's internal networks are cached in process for this many seconds
+        self.local_networks_max_age = config_dict.get('local_networks', {}).get('max_age', 300)
 
         # Mail server settings
         self.smtp_disabled = False
@@ -65,8 +127,15 @@ class Config:
 
         self.geoip_db = config_dict.get('geoip_database', '/etc/ndr/geoip.mmdb')
 
-        # Initialize the database connection with this config so it's obtainable down the pipe
+        # Range index compiled from geoip_database by ndr-build-geoip-index; reports look up
+        # against it instead of the database if it's set
+        self.geoip_index = config_dict.get('geoip_index', None)
+
+        # Make the database obtainable down the pipe; no connections are opened until one is
+        # actually requested
         self.database = ndr_server.Database(self)
+        self.local_networks = ndr_server.LocalNetworkRegistry(self, self.local_networks_max_age)
+        self.dimensions = ndr_server.DimensionCaches(self, self.dimension_cache_size)
 
     @property
     def accepted_directory(self):
@@ -97,6 +166,14 @@ class Config:
         '''Returns the connection string required for pyschopg2'''
         return "host='%s' dbname='%s' user='%s' password='%s'" % (self.db_hostname, self.db_dbname, self.db_username, self.db_password)
 
+    def get_pg_replica_connect_string(self):
+        '''Returns the connection string for the read replica'''
+        return "host='%s' dbname='%s' user='%s' password='%s'" % (
+            self.db_replica.get('host', self.db_hostname),
+            self.db_replica.get('dbname', self.db_dbname),
+            self.db_replica.get('user', self.db_username),
+            self.db_replica.get('password', self.db_password))
+
     def update_uucp_sys_file(self, db_conn=None):
         '''Updates the UUCP sys configuration file
 
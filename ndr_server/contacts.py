@@ -19,22 +19,40 @@
 
 from enum import Enum
 
+import base64
+import shutil
 import smtplib
 import tempfile
 import os
 import subprocess
 import sys
+import uuid
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+# Messages bigger than this are spooled to disk while they're built
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Base64 turns every 57 bytes into one 76 character line, so chunks of a multiple of 57
+# encode to whole lines
+ATTACHMENT_CHUNK_SIZE = 57 * 1024
+ATTACHMENT_TOKEN = "NDR-STREAMED-ATTACHMENT-%s-%d"
+
+SMTP_SEND_SIZE = 64 * 1024
+
 class Contact(object):
     '''Contacts represent people we reach when shit hits the fan. Contacts are currently attached
        on an organization level so a person can be presented in multiple organizations by each orgs
        security officer. We might add additional abilities to localize contacts to a site level in
        future'''
 
+    __slots__ = ('config', 'method', 'value', 'output_format', 'pg_id', 'org_id')
+
+    # Columns consumed by from_row(), in order
+    ROW_COLUMNS = ('id', 'org_id', 'method', 'value', 'output_format')
+
     def __init__(self, config, method, value, output_format='csv'):
         self.config = config
         self.method = ContactMethods(method)
@@ -44,7 +62,8 @@ class Contact(object):
         self.org_id = None
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        # Slots don't give us a __dict__, so compare the fields directly
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
 
     @classmethod
     def create(cls, config, organization, method, value, output_format='csv', db_conn=None):
@@ -56,7 +75,7 @@ class Contact(object):
         contact.pg_id = config.database.run_procedure_fetchone(
             "admin.insert_contact",
             [organization.pg_id, method, value, output_format],
-            existing_db_conn=db_conn)[0]
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
 
         return contact
 
@@ -69,11 +88,22 @@ class Contact(object):
 
         return contact
 
+    @classmethod
+    def from_row(cls, config, row):
+        '''Builds a contact straight from a ROW_COLUMNS ordered tuple'''
+        contact = cls.__new__(cls)
+        contact.config = config
+        contact.pg_id, contact.org_id, method, contact.value, output_format = row
+        contact.method = ContactMethods(method)
+        contact.output_format = OutputFormats(output_format)
+
+        return contact
+
     @classmethod
     def get_by_id(cls, config, contact_id, db_conn=None):
         '''Gets a contact by email'''
-        return Contact.from_dict(config, config.database.run_procedure_fetchone(
-            "admin.select_contact_by_id", [contact_id], existing_db_conn=db_conn))
+        return config.database.run_procedure_fetchone_mapped(
+            "admin.select_contact_by_id", [contact_id], cls, existing_db_conn=db_conn)
 
     def sign_email(self, subject, message):
         '''Signs an email with an S/MIME certificate'''
@@ -106,7 +136,8 @@ class Contact(object):
         return signed_message
 
     def send_message(self, subject, message, attachments=None):
-        '''Sends an alert message'''
+        '''Sends an alert message. Attachments are (payload, filename, binary) tuples, where the
+        payload is bytes or a binary file, which is streamed instead of read into memory'''
 
         # We need to generate the message headers
         mime_msg = MIMEMultipart()
@@ -116,22 +147,44 @@ class Contact(object):
         body = message
         mime_msg.attach(MIMEText(body, 'plain'))
 
+        message_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
         if attachments is not None:
-            for attachment in attachments:
+            file_attachments = []
+            token_prefix = uuid.uuid4().hex
+            for index, attachment in enumerate(attachments):
                 part = MIMEBase('application', "octet-stream")
-                part.set_payload(attachment[0])
-                encoders.encode_base64(part)
+                if hasattr(attachment[0], 'read'):
+                    # Stands in for the payload until write_mime_message() streams it in
+                    token = ATTACHMENT_TOKEN % (token_prefix, index)
+                    file_attachments.append((token, attachment[0]))
+                    part.set_payload(token)
+                    part['Content-Transfer-Encoding'] = 'base64'
+                else:
+                    part.set_payload(attachment[0])
+                    encoders.encode_base64(part)
 
                 # Add attachment header to this MIME part
                 part['Content-Disposition'] = 'attachment; filename="%s"' % attachment[1]
                 mime_msg.attach(part)
 
-            message = mime_msg.__str__() # Required to get UTF-8 email
+            write_mime_message(mime_msg, file_attachments, message_file)
+        else:
+            message_file.write(bytes(message, 'utf-8'))
 
         if self.config.smime_enabled is True:
-            # OpenSSL will generate the message headers
-            message = self.sign_email(subject, message)
-
+            # OpenSSL will generate the message headers, and needs the whole message to sign
+            message_file.seek(0)
+            signed_message = self.sign_email(subject, str(message_file.read(), 'utf-8'))
+            message_file.close()
+            message_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            message_file.write(bytes(signed_message, 'utf-8'))
+
+        message_file.seek(0)
+        with message_file:
+            self.deliver(message_file)
+
+    def deliver(self, message_file):
+        '''Sends a finished message, read from a binary file, on its way'''
         if self.method == ContactMethods.EMAIL:
             if self.config.smtp_disabled:
                 self.config.logger.info("Would send message to %s", self.value)
@@ -145,7 +198,7 @@ class Contact(object):
                 smtp_server.starttls()
                 if self.config.smtp_username is not None:
                     smtp_server.login(self.config.smtp_username, self.config.smtp_password)
-                smtp_server.sendmail(self.config.mail_from, self.value, bytes(message, 'utf-8'))
+                send_streamed(smtp_server, self.config.mail_from, self.value, message_file)
             except(smtplib.SMTPException, ConnectionError):
                 self.config.logger.error("Unable to send email to %s due to %s",
                                          self.value, sys.exc_info()[0])
@@ -153,11 +206,74 @@ class Contact(object):
                 smtp_server.quit()
 
         elif self.method == ContactMethods.FILE:
-            with open(self.value, 'w') as contact_file:
-                contact_file.write(message)
+            with open(self.value, 'wb') as contact_file:
+                shutil.copyfileobj(message_file, contact_file)
         else:
             raise ValueError('Unknown contact method!')
 
+def write_mime_message(mime_msg, file_attachments, output):
+    '''Writes mime_msg to the binary file output, replacing the tokens of the (token, file)
+    list file_attachments with the base64 encoding of their file, read a chunk at a time.
+    Each token must appear in the message exactly once'''
+    text = mime_msg.as_string()
+    for token, attachment_file in file_attachments:
+        if text.count(token) != 1:
+            raise ValueError("attachment token %s isn't unique in the message" % token)
+        before, text = text.split(token, 1)
+        output.write(bytes(before, 'utf-8'))
+
+        attachment_file.seek(0)
+        for chunk in iter(lambda: attachment_file.read(ATTACHMENT_CHUNK_SIZE), b''):
+            output.write(base64.encodebytes(chunk))
+
+    output.write(bytes(text, 'utf-8'))
+
+def send_streamed(smtp_server, mail_from, mail_to, message_file):
+    '''Like SMTP.sendmail(), but sends the DATA from a binary file in chunks'''
+    smtp_server.ehlo_or_helo_if_needed()
+
+    code, response = smtp_server.mail(mail_from)
+    if code != 250:
+        smtp_server.rset()
+        raise smtplib.SMTPSenderRefused(code, response, mail_from)
+
+    code, response = smtp_server.rcpt(mail_to)
+    if code not in (250, 251):
+        smtp_server.rset()
+        raise smtplib.SMTPRecipientsRefused({mail_to: (code, response)})
+
+    code, response = smtp_server.docmd("data")
+    if code != 354:
+        smtp_server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
+    # Normalize line endings and escape leading dots as SMTP.data() does. Only the line's own
+    # ending is replaced, any other CR in it is left alone
+    buffered = []
+    buffered_size = 0
+    for line in message_file:
+        if line.endswith(b'\r\n'):
+            line = line[:-2]
+        elif line.endswith(b'\n'):
+            line = line[:-1]
+        if line.startswith(b'.'):
+            line = b'.' + line
+        buffered.append(line + b'\r\n')
+        buffered_size += len(line) + 2
+
+        if buffered_size >= SMTP_SEND_SIZE:
+            smtp_server.send(b''.join(buffered))
+            buffered = []
+            buffered_size = 0
+
+    buffered.append(b'.\r\n')
+    smtp_server.send(b''.join(buffered))
+
+    code, response = smtp_server.getreply()
+    if code != 250:
+        smtp_server.rset()
+        raise smtplib.SMTPDataError(code, response)
+
 class ContactMethods(Enum):
     '''Known methods to contact folks'''
     EMAIL = "email"
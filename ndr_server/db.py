@@ -17,55 +17,706 @@
 
 '''NDR Server Database Helper'''
 
+import collections
+import functools
+import hashlib
+import itertools
+import json
+import operator
+import os
+import tempfile
+import threading
+import time
+import weakref
+
 import psycopg2
 import psycopg2.pool
 import psycopg2.extras
 import psycopg2.extensions
+from psycopg2 import sql
+
+from ndr_server.query_trace import QueryTracer
+
+# Procedures on the ingest hot path; these are run through PREPARE/EXECUTE so they're only
+# parsed and planned once per connection. Can be overriden with postgresql.prepared_procedures
+DEFAULT_PREPARED_PROCEDURES = frozenset([
+    'ingest.create_upload_log',
+    'ingest.select_recorder_by_hostname',
+    'ingest.insert_syslog_entry_by_program_id',
+    'traffic_report.insert_traffic_report',
+    'snort.insert_traffic_report',
+    'admin.set_recorder_sw_revision',
+])
+
+class RowMapperCursor(psycopg2.extensions.cursor):
+    '''Cursor that builds model objects straight from the result tuples
+
+    The model class must define ROW_COLUMNS, the names of the columns it wants in the order
+    its from_row() classmethod expects them. Column positions are resolved once from the
+    cursor description so no per-row dictionary is ever built'''
+
+    def __init__(self, *args, **kwargs):
+        self.model = kwargs.pop('model')
+        self.config = kwargs.pop('config')
+        super().__init__(*args, **kwargs)
+        self._row_getter = None
+
+    def _map_row(self, row):
+        if row is None:
+            return None
+
+        if self._row_getter is None:
+            column_names = [column[0] for column in self.description]
+            self._row_getter = operator.itemgetter(
+                *[column_names.index(column) for column in self.model.ROW_COLUMNS])
+
+        return self.model.from_row(self.config, self._row_getter(row))
+
+    def fetchone(self):
+        return self._map_row(super().fetchone())
+
+    def fetchmany(self, size=None):
+        if size is None:
+            rows = super().fetchmany()
+        else:
+            rows = super().fetchmany(size)
+        return [self._map_row(row) for row in rows]
+
+    def fetchall(self):
+        return [self._map_row(row) for row in super().fetchall()]
+
+    def __iter__(self):
+        # Step the base iterator by hand; looping over it would re-enter this method
+        base_iter = super().__iter__()
+        while True:
+            try:
+                row = next(base_iter)
+            except StopIteration:
+                return
+            yield self._map_row(row)
+
+class PreparedStatementRegistry(object):
+    '''Tracks which procedures have been PREPAREd on each connection
+
+    Prepared statements live as long as the server session does, so the registry is keyed
+    on the connection object and the backend PID. A reconnect (either a new connection
+    object, or the same one talking to a new backend) starts with an empty set and the
+    statements are transparently prepared again on first use'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prepared = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def statement_name(proc, arity):
+        '''Returns the server side name of the statement for proc called with arity args'''
+        name = "ndr_%s_%d" % (proc.replace('.', '__'), arity)
+
+        # PostgreSQL truncates identifiers at 63 bytes, so hash anything that won't fit
+        if len(name) > 63:
+            name = "ndr_%s_%d" % (hashlib.sha1(proc.encode('utf-8')).hexdigest(), arity)
+        return name
+
+    def _statements_for(self, cursor):
+        db_conn = cursor.connection
+        backend_pid = db_conn.get_backend_pid()
+        with self._lock:
+            entry = self._prepared.get(db_conn)
+            if entry is not None and entry[0] == backend_pid:
+                return entry[1]
+
+        # First time we've seen this session; it may already have statements if we were
+        # told to forget it, so ask the server what's there rather than guess
+        cursor.execute("SELECT name FROM pg_prepared_statements")
+        statements = set([row[0] for row in cursor.fetchall()])
+        with self._lock:
+            self._prepared[db_conn] = (backend_pid, statements)
+        return statements
+
+    def execute(self, cursor, proc, list_args):
+        '''Executes proc on cursor, preparing it on the connection first if needed'''
+        arity = len(list_args)
+        name = self.statement_name(proc, arity)
+        statements = self._statements_for(cursor)
+
+        if name not in statements:
+            placeholders = sql.SQL(', ').join(
+                [sql.SQL('$%d' % (i + 1)) for i in range(arity)])
+            cursor.execute(sql.SQL("PREPARE {} AS SELECT * FROM {}({})").format(
+                sql.Identifier(name), sql.SQL(proc), placeholders))
+            statements.add(name)
+
+        if arity == 0:
+            cursor.execute(sql.SQL("EXECUTE {}").format(sql.Identifier(name)))
+        else:
+            cursor.execute(sql.SQL("EXECUTE {} ({})").format(
+                sql.Identifier(name), sql.SQL(', ').join([sql.Placeholder()] * arity)),
+                list_args)
+
+    def forget(self, db_conn):
+        '''Drops everything known about a connection, i.e. after DEALLOCATE ALL'''
+        with self._lock:
+            self._prepared.pop(db_conn, None)
+
+class ConnectionPool(object):
+    '''Thread-safe PostgreSQL connection pool
+
+    Unlike psycopg2's ThreadedConnectionPool this validates connections on checkout (so a
+    PostgreSQL restart doesn't leave us handing out dead sockets), closes connections that
+    have sat idle too long, waits for a connection when saturated instead of failing right
+    away, and keeps statistics on how long checkouts take'''
+
+    def __init__(self, dsn, min_size=1, max_size=100, idle_timeout=300,
+                 checkout_timeout=30, validate_interval=30, logger=None):
+        if min_size > max_size:
+            raise ValueError("pool minimum size is larger than the maximum")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.validate_interval = validate_interval
+        self.logger = logger
+
+        self._cond = threading.Condition()
+        self._idle = collections.deque()
+        self._in_use = set()
+        self._opening = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._reconnects = 0
+        self._recycled = 0
+        self._peak_in_use = 0
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn)
+
+    def _is_usable(self, conn, idle_since):
+        '''Makes sure a connection we're about to hand out is still alive'''
+        if conn.closed:
+            return False
+
+        # Skip the round trip if the connection was used recently
+        if time.monotonic() - idle_since < self.validate_interval:
+            return True
+
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+        return True
+
+    def _recycle_idle(self, now):
+        '''Closes connections that have been idle too long; must hold the lock'''
+        # The oldest connections are at the left as we always reuse from the right
+        while (len(self._idle) + len(self._in_use) + self._opening > self.min_size and
+               self._idle and now - self._idle[0][1] > self.idle_timeout):
+            conn, _ = self._idle.popleft()
+            conn.close()
+            self._recycled += 1
+
+    def getconn(self):
+        '''Checks a connection out of the pool, waiting if all are in use'''
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        conn = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.pool.PoolError("connection pool is closed")
+
+                now = time.monotonic()
+                self._recycle_idle(now)
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    self._in_use.add(conn)
+                    break
+
+                if len(self._in_use) + self._opening < self.max_size:
+                    self._opening += 1
+                    break
+
+                if waited is False:
+                    waited = True
+                    self._waits += 1
+
+                if now >= deadline:
+                    self._timeouts += 1
+                    raise psycopg2.pool.PoolError(
+                        "timed out waiting for a connection (%d in use)" % len(self._in_use))
+                self._cond.wait(deadline - now)
+
+        # Connecting and validating happen outside the lock so they don't stall other threads
+        try:
+            if conn is None:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        if conn is not None:
+                            self._in_use.add(conn)
+                        else:
+                            self._cond.notify()
+            elif self._is_usable(conn, idle_since) is False:
+                if self.logger is not None:
+                    self.logger.warning("discarding dead database connection, reconnecting")
+                conn.close()
+                fresh_conn = self._connect()
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._in_use.add(fresh_conn)
+                    self._reconnects += 1
+                conn = fresh_conn
+        except Exception:
+            if conn is not None:
+                with self._cond:
+                    self._in_use.discard(conn)
+                    self._cond.notify()
+            raise
+
+        wait_time = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._total_wait += wait_time
+            self._max_wait = max(self._max_wait, wait_time)
+            self._peak_in_use = max(self._peak_in_use, len(self._in_use))
+
+        return conn
+
+    def putconn(self, conn):
+        '''Returns a connection to the pool, rolling back anything left open'''
+        if not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    conn.close()
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                conn.close()
+
+        with self._cond:
+            self._in_use.discard(conn)
+            if conn.closed or self._closed:
+                conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        '''Closes every connection, in use or not'''
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+            for conn in self._in_use:
+                conn.close()
+            self._idle.clear()
+            self._in_use.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        '''Returns a dictionary of pool statistics'''
+        with self._cond:
+            in_use = len(self._in_use)
+            size = in_use + len(self._idle)
+            return {
+                'size': size,
+                'idle': len(self._idle),
+                'in_use': in_use,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'peak_in_use': self._peak_in_use,
+                'saturation': in_use / self.max_size,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'total_wait': self._total_wait,
+                'max_wait': self._max_wait,
+                'avg_wait': self._total_wait / self._checkouts if self._checkouts else 0.0,
+                'reconnects': self._reconnects,
+                'recycled': self._recycled,
+            }
 
 class Database(object):
     def __init__(self, config):
         self.config = config
-        self.connection = psycopg2.pool.ThreadedConnectionPool(
-            10, 100, self.config.get_pg_connect_string())
 
-    def get_connection(self):
-        '''Opens a connection for doing a transaction on'''
-        connection = self.connection.getconn()
-        connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
+        # The pool is only created (and connections opened) when something needs one
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        # Read-only procedure calls can be routed to a replica if one is configured. Each
+        # primary connection borrows at most one replica connection which is handed back
+        # along with it
+        self._replica_pool = None
+        self._replica_conns = weakref.WeakKeyDictionary()
+        self._replica_lock = threading.Lock()
+        self._replica_checked_at = None
+        self._replica_usable = False
+
+        self.prepared_statements = PreparedStatementRegistry()
+        self._cursor_names = itertools.count()
+        if config.db_prepared_procedures is not None:
+            self.prepared_procedures = frozenset(config.db_prepared_procedures)
+        else:
+            self.prepared_procedures = DEFAULT_PREPARED_PROCEDURES
+
+        self.tracer = None
+        if config.db_trace_procedures is True:
+            self.tracer = QueryTracer(logger=config.logger,
+                                      slow_query_ms=config.db_slow_query_ms,
+                                      explain_ms=config.db_explain_query_ms)
+
+    @property
+    def pool(self):
+        '''The connection pool, created on first use'''
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        self.config.get_pg_connect_string(),
+                        min_size=self.config.db_pool_min_size,
+                        max_size=self.config.db_pool_max_size,
+                        idle_timeout=self.config.db_pool_idle_timeout,
+                        checkout_timeout=self.config.db_pool_checkout_timeout,
+                        validate_interval=self.config.db_pool_validate_interval,
+                        logger=self.config.logger)
+        return self._pool
+
+    @property
+    def replica_pool(self):
+        '''The replica connection pool, created on first use. None if not configured'''
+        if self.config.db_replica is None:
+            return None
+
+        if self._replica_pool is None:
+            with self._replica_lock:
+                if self._replica_pool is None:
+                    self._replica_pool = ConnectionPool(
+                        self.config.get_pg_replica_connect_string(),
+                        min_size=0,
+                        max_size=self.config.db_pool_max_size,
+                        idle_timeout=self.config.db_pool_idle_timeout,
+                        checkout_timeout=self.config.db_pool_checkout_timeout,
+                        validate_interval=self.config.db_pool_validate_interval,
+                        logger=self.config.logger)
+        return self._replica_pool
+
+    def get_connection(self, read_only=False):
+        '''Opens a connection for doing a transaction on
+
+        A read_only connection runs SERIALIZABLE READ ONLY DEFERRABLE, which never fails
+        with a serialization error, and lets all read-only procedure calls made on it go
+        to the replica'''
+        connection = self.pool.getconn()
+        if read_only is True:
+            connection.set_session(
+                isolation_level=psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE,
+                readonly=True, deferrable=True)
+        else:
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE)
         return connection
 
     def return_connection(self, connection):
         '''Returns the connection to the pool'''
-        self.connection.putconn(connection)
+        with self._replica_lock:
+            replica_conn = self._replica_conns.pop(connection, None)
+        if replica_conn is not None:
+            self.replica_pool.putconn(replica_conn)
+
+        if not connection.closed and connection.readonly:
+            # Drop the read only flags so the next user gets a normal session
+            connection.rollback()
+            connection.set_session(readonly=False, deferrable=False)
+
+        self.pool.putconn(connection)
+
+    def _replica_is_fresh(self, replica_conn):
+        '''Checks (at most every replica_check_interval seconds) the replica's lag
+
+        The replay timestamp is that of the last replayed transaction, so a quiet primary
+        looks like it has lag; pick max_staleness with that in mind'''
+        now = time.monotonic()
+        with self._replica_lock:
+            if (self._replica_checked_at is not None and
+                    now - self._replica_checked_at < self.config.db_replica_check_interval):
+                return self._replica_usable
+
+        # The query runs outside the lock; threads racing here both check, which is harmless
+        cursor = replica_conn.cursor()
+        cursor.execute('''SELECT CASE WHEN pg_is_in_recovery()
+                              THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                              ELSE 0 END''')
+        lag = cursor.fetchone()[0]
+        cursor.close()
+
+        usable = lag is not None and lag <= self.config.db_replica_max_staleness
+        if usable is False:
+            self.config.logger.warning("replica lag is %s seconds, reading from the primary",
+                                       lag)
+
+        with self._replica_lock:
+            self._replica_checked_at = now
+            self._replica_usable = usable
+        return usable
+
+    def _route_read_only(self, db_conn):
+        '''Returns the connection a read-only procedure call on db_conn should run on'''
+        if self.config.db_replica is None:
+            return db_conn
 
-    def run_procedure_fetchone(self, proc, list_args, existing_db_conn):
+        # A transaction may have written something the replica can't see yet, so only
+        # leave the primary if there is no transaction, or it can't have written anything
+        if (db_conn.readonly is not True and
+                db_conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+            return db_conn
+
+        with self._replica_lock:
+            # Don't keep hammering a replica we already know is lagging or down
+            if (self._replica_checked_at is not None and self._replica_usable is False and
+                    time.monotonic() - self._replica_checked_at <
+                    self.config.db_replica_check_interval):
+                return db_conn
+
+            replica_conn = self._replica_conns.get(db_conn)
+
+        try:
+            if replica_conn is None:
+                replica_conn = self.replica_pool.getconn()
+                replica_conn.set_session(readonly=True, autocommit=True)
+                with self._replica_lock:
+                    self._replica_conns[db_conn] = replica_conn
+
+            if self._replica_is_fresh(replica_conn) is False:
+                return db_conn
+        except (psycopg2.OperationalError, psycopg2.pool.PoolError) as exception:
+            self.config.logger.warning("replica unavailable, reading from the primary: %s",
+                                       exception)
+            with self._replica_lock:
+                self._replica_checked_at = time.monotonic()
+                self._replica_usable = False
+            return db_conn
+
+        return replica_conn
+
+    def pool_stats(self):
+        '''Returns connection pool statistics, or None if the pool was never used'''
+        if self._pool is None:
+            return None
+        return self._pool.stats()
+
+    def export_stats(self):
+        '''Returns per procedure query statistics and pool statistics'''
+        procedures = None
+        if self.tracer is not None:
+            procedures = self.tracer.snapshot()
+
+        return {
+            'exported_at': time.time(),
+            'procedures': procedures,
+            'pool': self.pool_stats()
+        }
+
+    def write_stats(self, filename):
+        '''Writes export_stats() as JSON, replacing the file atomically'''
+        directory = os.path.dirname(os.path.abspath(filename))
+        stats_fd, temp_filename = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(stats_fd, 'w') as stats_file:
+                json.dump(self.export_stats(), stats_file, indent=2, sort_keys=True)
+            os.rename(temp_filename, filename)
+        except Exception:
+            os.remove(temp_filename)
+            raise
+
+    def run_procedure_fetchone(self, proc, list_args, existing_db_conn, tuple_cursor=False,
+                               read_only=False):
         '''Runs a stored procedure, returns one item, then closes the cursor'''
 
-        cursor = self.run_procedure(proc, list_args, existing_db_conn)
+        cursor = self.run_procedure(proc, list_args, existing_db_conn, tuple_cursor=tuple_cursor,
+                                    read_only=read_only)
         result = cursor.fetchone()
         cursor.close()
         return result
 
-    def run_procedure_fetchall(self, proc, list_args, existing_db_conn):
+    def run_procedure_fetchall(self, proc, list_args, existing_db_conn, tuple_cursor=False,
+                               read_only=False):
         '''Runs a stored procedure, returns all, then closes the cursor'''
 
-        cursor = self.run_procedure(proc, list_args, existing_db_conn)
+        cursor = self.run_procedure(proc, list_args, existing_db_conn, tuple_cursor=tuple_cursor,
+                                    read_only=read_only)
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+
+    def run_procedure_fetchone_mapped(self, proc, list_args, model, existing_db_conn,
+                                      read_only=False):
+        '''Runs a stored procedure, and returns one row mapped to a model object. Raises
+        ValueError if the procedure returned no row'''
+
+        cursor = self.run_procedure(proc, list_args, existing_db_conn,
+                                    cursor_factory=self.row_mapper(model), read_only=read_only)
+        result = cursor.fetchone()
+        cursor.close()
+
+        if result is None:
+            raise ValueError("%s found no %s for %s" % (proc, model.__name__, list_args))
+        return result
+
+    def run_procedure_fetchall_mapped(self, proc, list_args, model, existing_db_conn,
+                                      read_only=False):
+        '''Runs a stored procedure, and returns all rows mapped to model objects'''
+
+        cursor = self.run_procedure(proc, list_args, existing_db_conn,
+                                    cursor_factory=self.row_mapper(model), read_only=read_only)
         result = cursor.fetchall()
         cursor.close()
         return result
 
-    def run_procedure(self, proc, list_args, existing_db_conn):
-        '''Runs a stored procedure and returns a cursor to the result set'''
+    def run_procedure_batches(self, proc, list_args, existing_db_conn, batch_size=None,
+                              tuple_cursor=False, read_only=False):
+        '''Runs a set returning stored procedure through a named (server side) cursor, and
+        yields its rows in lists of up to batch_size; only one batch is in memory at a time.
+        The cursor is closed when the generator is exhausted or closed'''
         if existing_db_conn is None:
             raise ValueError("Must pass in connection")
+        if batch_size is None:
+            batch_size = self.config.db_fetch_batch_size
 
         db_conn = existing_db_conn
+        if read_only is True:
+            db_conn = self._route_read_only(existing_db_conn)
+
+        cursor_factory = psycopg2.extras.DictCursor
+        if tuple_cursor is True:
+            cursor_factory = psycopg2.extensions.cursor
+
+        # Named cursors only live as long as their transaction. Replica connections are
+        # autocommit, and a WITH HOLD cursor would materialize the whole result on commit, so
+        # the cursor gets a read-only transaction of its own instead
+        own_transaction = db_conn.autocommit
+        if own_transaction is True:
+            readonly = db_conn.readonly
+            db_conn.set_session(readonly=True, autocommit=False)
+
+        cursor = db_conn.cursor("ndr_batches_%d" % next(self._cursor_names),
+                                cursor_factory=cursor_factory)
+
+        start = time.perf_counter()
+        rows = 0
+        try:
+            cursor.execute(sql.SQL("SELECT * FROM {}({})").format(
+                sql.SQL(proc), sql.SQL(', ').join([sql.Placeholder()] * len(list_args))),
+                           list_args)
+
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if len(batch) == 0:
+                    break
+                rows += len(batch)
+                yield batch
+        except psycopg2.Error:
+            if self.tracer is not None:
+                self.tracer.record_error(proc, (time.perf_counter() - start) * 1000)
+            raise
+        finally:
+            # An aborted transaction has already dropped the cursor server side
+            if (db_conn.closed == 0 and db_conn.get_transaction_status() !=
+                    psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+                cursor.close()
+
+            # Nothing was written, so ending the transaction is just a rollback
+            if own_transaction is True and db_conn.closed == 0:
+                db_conn.rollback()
+                db_conn.set_session(readonly=readonly, autocommit=True)
 
-        cursor = db_conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.callproc(proc, list_args)
+        if self.tracer is not None:
+            self.tracer.record(proc, (time.perf_counter() - start) * 1000, rows)
+
+    def run_procedure_iter(self, proc, list_args, existing_db_conn, itersize=None,
+                           tuple_cursor=False, read_only=False):
+        '''Runs a set returning stored procedure through a named (server side) cursor, and
+        yields its rows one at a time, fetching itersize rows per round trip (the configured
+        fetch_batch_size by default). Closing the generator closes the cursor'''
+        batches = self.run_procedure_batches(proc, list_args, existing_db_conn,
+                                             batch_size=itersize, tuple_cursor=tuple_cursor,
+                                             read_only=read_only)
+        try:
+            for batch in batches:
+                for row in batch:
+                    yield row
+        finally:
+            batches.close()
+
+    def row_mapper(self, model):
+        '''Returns a cursor factory that builds instances of model from each row'''
+        return functools.partial(RowMapperCursor, model=model, config=self.config)
+
+    def run_procedure(self, proc, list_args, existing_db_conn,
+                      cursor_factory=psycopg2.extras.DictCursor, tuple_cursor=False,
+                      read_only=False):
+        '''Runs a stored procedure and returns a cursor to the result set
+
+        Rows come back as DictRows unless tuple_cursor is set, in which case they're plain
+        tuples; that's cheaper for callers that only ever read [0]. Procedures that don't
+        write can set read_only so they may be served by the replica'''
+        if existing_db_conn is None:
+            raise ValueError("Must pass in connection")
+
+        db_conn = existing_db_conn
+        if read_only is True:
+            db_conn = self._route_read_only(existing_db_conn)
+
+        if tuple_cursor is True:
+            cursor_factory = psycopg2.extensions.cursor
+
+        cursor = db_conn.cursor(cursor_factory=cursor_factory)
+
+        start = time.perf_counter()
+        try:
+            if proc in self.prepared_procedures:
+                self.prepared_statements.execute(cursor, proc, list_args)
+            else:
+                cursor.callproc(proc, list_args)
+        except psycopg2.Error:
+            if self.tracer is not None:
+                self.tracer.record_error(proc, (time.perf_counter() - start) * 1000)
+            raise
+
+        if self.tracer is not None:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.tracer.record(proc, elapsed_ms, cursor.rowcount)
+            self.tracer.check_slow(db_conn, proc, list_args, elapsed_ms)
 
         return cursor
 
     def close(self):
         '''Cleans up and closes the database connection'''
-        self.connection.closeall()
+        with self._replica_lock:
+            self._replica_conns = weakref.WeakKeyDictionary()
+            if self._replica_pool is not None:
+                self._replica_pool.closeall()
+                self._replica_pool = None
+
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
@@ -0,0 +1,161 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''In process caches of the IDs of dimension values (addresses, hostnames, programs) so
+ingest doesn't look each one up in the database'''
+
+import collections
+import ipaddress
+import threading
+
+class LRUCache(object):
+    '''Thread-safe mapping holding at most max_size entries, dropping the least recently used
+    ones first'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Returns the value for key, or None'''
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        '''Adds or refreshes key'''
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        '''Drops every entry'''
+        with self._lock:
+            self._entries.clear()
+
+def normalize_ip_address(value):
+    '''Addresses are cached by their compressed form'''
+    return ipaddress.ip_address(value).compressed
+
+def normalize_mac_address(value):
+    '''MAC addresses are cached in PostgreSQL's xx:xx:xx:xx:xx:xx form'''
+    digits = ''.join(c for c in str(value).lower() if c in '0123456789abcdef')
+    return ':'.join(digits[i:i+2] for i in range(0, len(digits), 2))
+
+class DimensionCache(object):
+    '''Caches the IDs of one dimension table's values. Misses are resolved (and created) in a
+    single call to the table's bulk get-or-create procedure.
+
+    IDs of rows created by the caller's own transaction aren't cached, as they're gone if it
+    rolls back; they're cached the next time they're looked up after it commits'''
+
+    def __init__(self, config, procedure, recent_procedure, max_size, normalize=str):
+        self.config = config
+        self.procedure = procedure
+        self.recent_procedure = recent_procedure
+        self.normalize = normalize
+        self.cache = LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, values, db_conn):
+        '''Returns a dictionary of each (normalized) value to its ID, creating what's missing.
+        None resolves to None'''
+        ids = {None: None}
+        missing = []
+        for value in values:
+            if value is None:
+                continue
+            key = self.normalize(value)
+            if key in ids:
+                continue
+
+            value_id = self.cache.get(key)
+            ids[key] = value_id
+            if value_id is None:
+                missing.append(key)
+
+        self.misses += len(missing)
+        self.hits += len(ids) - 1 - len(missing)
+        if len(missing) == 0:
+            return ids
+
+        rows = self.config.database.run_procedure_fetchall(
+            self.procedure, [missing], existing_db_conn=db_conn, tuple_cursor=True)
+        for ordinal, value_id, committed in rows:
+            key = missing[ordinal - 1]
+            ids[key] = value_id
+            if committed:
+                self.cache.put(key, value_id)
+
+        return ids
+
+    def lookup(self, ids, value):
+        '''Returns the ID of value from a dictionary returned by resolve()'''
+        if value is None:
+            return None
+        return ids[self.normalize(value)]
+
+    def warm(self, db_conn):
+        '''Loads the most recently added values into the cache'''
+        rows = self.config.database.run_procedure_fetchall(
+            self.recent_procedure, [self.cache.max_size],
+            existing_db_conn=db_conn, tuple_cursor=True, read_only=True)
+
+        # Oldest first, so the newest end up as the most recently used
+        for value, value_id in reversed(rows):
+            self.cache.put(self.normalize(value), value_id)
+
+class DimensionCaches(object):
+    '''The dimension caches shared by every message handler'''
+
+    def __init__(self, config, max_size=100000):
+        self.ip_addresses = DimensionCache(
+            config, "network_scan.get_or_create_ip_addresses",
+            "network_scan.get_recent_ip_addresses", max_size, normalize_ip_address)
+        self.mac_addresses = DimensionCache(
+            config, "network_scan.get_or_create_mac_addresses",
+            "network_scan.get_recent_mac_addresses", max_size, normalize_mac_address)
+        self.hostnames = DimensionCache(
+            config, "traffic_report.get_or_create_tr_hostnames",
+            "traffic_report.get_recent_tr_hostnames", max_size)
+        self.syslog_programs = DimensionCache(
+            config, "ingest.insert_or_select_program_ids",
+            "ingest.get_recent_program_ids", max_size)
+
+    def all(self):
+        '''Returns every cache by name'''
+        return [("ip_addresses", self.ip_addresses),
+                ("mac_addresses", self.mac_addresses),
+                ("hostnames", self.hostnames),
+                ("syslog_programs", self.syslog_programs)]
+
+    def warm(self, db_conn):
+        '''Loads the most recently added values of every dimension'''
+        for _, cache in self.all():
+            cache.warm(db_conn)
+
+    def clear(self):
+        '''Empties every cache, i.e. after dimension rows were merged or removed'''
+        for _, cache in self.all():
+            cache.cache.clear()
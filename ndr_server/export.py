@@ -0,0 +1,256 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Exports a site's traffic reports and syslog entries to columnar files for offline
+analysis. Rows are streamed from a server side cursor a batch at a time and written out as
+they come, as Parquet if pyarrow is installed and as compressed NumPy chunks otherwise.
+
+Streams of report records (namedtuples) can also be written out as NDJSON or CSV'''
+
+import collections
+import csv
+import datetime
+import json
+import os
+import tempfile
+
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ExportDataset = collections.namedtuple('ExportDataset', 'procedure columns')
+
+# Column types: int, float, str and timestamp. Every dataset starts with id and received_at;
+# received_at is what the watermark follows
+EXPORT_DATASETS = {
+    'traffic': ExportDataset(
+        "traffic_report.export_traffic_for_site",
+        [('id', 'int'), ('received_at', 'timestamp'), ('msg_id', 'int'), ('protocol', 'str'),
+         ('src_ip', 'str'), ('src_hostname', 'str'), ('src_port', 'int'),
+         ('dst_ip', 'str'), ('dst_hostname', 'str'), ('dst_port', 'int'),
+         ('rx_bytes', 'int'), ('tx_bytes', 'int'), ('start_timestamp', 'timestamp'),
+         ('duration', 'float'), ('flow_count', 'int')]),
+    'syslog': ExportDataset(
+        "admin.export_syslog_for_site",
+        [('id', 'int'), ('received_at', 'timestamp'), ('recorder_message_id', 'int'),
+         ('recorder_id', 'int'), ('logged_at', 'timestamp'), ('host', 'str'),
+         ('program', 'str'), ('pid', 'int'), ('facility', 'str'), ('priority', 'str'),
+         ('message', 'str')]),
+}
+
+def dictionary_encode(values):
+    '''Returns int32 codes into an array of the distinct strings; None is -1'''
+    positions = {}
+    codes = numpy.empty(len(values), dtype=numpy.int32)
+    for row, value in enumerate(values):
+        if value is None:
+            codes[row] = -1
+            continue
+        code = positions.get(value)
+        if code is None:
+            code = positions[value] = len(positions)
+        codes[row] = code
+
+    dictionary = [None] * len(positions)
+    for value, code in positions.items():
+        dictionary[code] = value
+    return codes, numpy.array(dictionary, dtype=numpy.str_)
+
+def column_arrays(name, kind, values):
+    '''Returns the .npz arrays holding a column. Strings are dictionary encoded; columns
+    with NULLs get a .valid mask'''
+    if kind == 'str':
+        codes, dictionary = dictionary_encode(values)
+        return {name + '.codes': codes, name + '.dictionary': dictionary}
+
+    valid = numpy.array([value is not None for value in values], dtype=bool)
+    if kind == 'int':
+        array = numpy.array([0 if value is None else value for value in values], dtype=numpy.int64)
+    elif kind == 'float':
+        array = numpy.array([numpy.nan if value is None else value for value in values],
+                            dtype=numpy.float64)
+    else:
+        array = numpy.array([value if value is not None else 'NaT' for value in values],
+                            dtype='datetime64[us]')
+
+    arrays = {name: array}
+    if not valid.all():
+        arrays[name + '.valid'] = valid
+    return arrays
+
+class NpzChunkWriter(object):
+    '''Writes each batch as its own compressed .npz file, numbered from prefix'''
+
+    def __init__(self, directory, prefix, columns):
+        self.directory = directory
+        self.prefix = prefix
+        self.columns = columns
+        self.chunks = 0
+        self.files = []
+
+    def write(self, rows):
+        '''Writes a batch of rows out'''
+        arrays = {}
+        for position, (name, kind) in enumerate(self.columns):
+            arrays.update(column_arrays(name, kind, [row[position] for row in rows]))
+
+        self.chunks += 1
+        filename = os.path.join(self.directory, "%s-%05d.npz" % (self.prefix, self.chunks))
+        numpy.savez_compressed(filename, **arrays)
+        self.files.append(filename)
+
+    def close(self):
+        '''Nothing is held open between batches'''
+        pass
+
+class ParquetChunkWriter(object):
+    '''Writes the batches as row groups of a single zstd compressed Parquet file. Strings are
+    dictionary encoded by Parquet itself'''
+
+    ARROW_TYPES = {
+        'int': 'int64',
+        'float': 'float64',
+        'str': 'string',
+        'timestamp': 'timestamp[us]',
+    }
+
+    def __init__(self, directory, prefix, columns):
+        self.columns = columns
+        self.schema = pyarrow.schema([
+            (name, pyarrow.type_for_alias(self.ARROW_TYPES[kind])) for name, kind in columns])
+        self.filename = os.path.join(directory, prefix + ".parquet")
+        self.files = [self.filename]
+        self._writer = pyarrow.parquet.ParquetWriter(self.filename, self.schema,
+                                                     compression='zstd')
+
+    def write(self, rows):
+        '''Writes a batch of rows out as a row group'''
+        arrays = []
+        for position, field in enumerate(self.schema):
+            arrays.append(pyarrow.array([row[position] for row in rows], type=field.type))
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        '''Finishes the file'''
+        self._writer.close()
+
+def open_chunk_writer(output_format, directory, prefix, columns):
+    '''Returns a writer for output_format: parquet, npz, or auto (parquet if pyarrow is
+    installed)'''
+    if output_format == 'auto':
+        output_format = 'parquet' if pyarrow is not None else 'npz'
+
+    if output_format == 'parquet':
+        if pyarrow is None:
+            raise ValueError("Parquet output needs pyarrow")
+        return ParquetChunkWriter(directory, prefix, columns)
+    if output_format == 'npz':
+        return NpzChunkWriter(directory, prefix, columns)
+    raise ValueError("unknown export format %s" % output_format)
+
+class ExportWatermark(object):
+    '''Remembers, per site and dataset, the received_at of the newest row exported so the
+    next export starts after it'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.watermarks = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as watermark_file:
+                self.watermarks = json.load(watermark_file)
+
+    @staticmethod
+    def _key(site_id, dataset):
+        return "%d/%s" % (site_id, dataset)
+
+    def get(self, site_id, dataset):
+        '''Returns the watermark as a datetime, or None if nothing was exported yet'''
+        value = self.watermarks.get(self._key(site_id, dataset))
+        if value is None:
+            return None
+        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f")
+
+    def set(self, site_id, dataset, received_at):
+        '''Moves the watermark and atomically saves the file'''
+        self.watermarks[self._key(site_id, dataset)] = received_at.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        file_descriptor, temp_name = tempfile.mkstemp(dir=directory, prefix=".watermark")
+        with os.fdopen(file_descriptor, 'w') as watermark_file:
+            json.dump(self.watermarks, watermark_file, indent=2, sort_keys=True)
+        os.rename(temp_name, self.filename)
+
+ExportResult = collections.namedtuple('ExportResult', 'rows files last_received_at')
+
+def export_dataset(config, site, dataset, directory, db_conn, after=None, before=None,
+                   output_format='auto', settle_seconds=300, batch_size=None):
+    '''Exports a site's rows of dataset received after after (and before before) into
+    directory. Only one batch of rows is held in memory at a time.
+
+    Returns an ExportResult; last_received_at is None if there was nothing new'''
+
+    export = EXPORT_DATASETS[dataset]
+    prefix = "%s-site%d-%s" % (dataset, site.pg_id,
+                               datetime.datetime.now().strftime("%Y%m%dT%H%M%S"))
+
+    writer = None
+    rows = 0
+    last_received_at = None
+    batches = config.database.run_procedure_batches(
+        export.procedure, [site.pg_id, after, before, settle_seconds],
+        existing_db_conn=db_conn, batch_size=batch_size, tuple_cursor=True, read_only=True)
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = open_chunk_writer(output_format, directory, prefix, export.columns)
+            writer.write(batch)
+            rows += len(batch)
+            last_received_at = batch[-1][1]
+    finally:
+        batches.close()
+        if writer is not None:
+            writer.close()
+
+    files = writer.files if writer is not None else []
+    return ExportResult(rows, files, last_received_at)
+
+def write_ndjson(records, output):
+    '''Writes namedtuple records to the text file output as one JSON object per line,
+    consuming them as it goes. Addresses, timestamps and the like are written as strings.
+    Returns the number of records written'''
+    count = 0
+    for record in records:
+        output.write(json.dumps(collections.OrderedDict(zip(record._fields, record)),
+                                default=str))
+        output.write('\n')
+        count += 1
+    return count
+
+def write_csv(records, output, fields, header=True):
+    '''Writes records to the text file output as CSV under a header of fields, consuming
+    them as it goes. Returns the number of records written'''
+    writer = csv.writer(output)
+    if header is True:
+        writer.writerow(fields)
+
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
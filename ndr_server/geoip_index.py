@@ -0,0 +1,373 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Memory mapped GeoIP range index
+
+A GeoIP2 City database is compiled into sorted, non-overlapping (start, end, info) address
+ranges per IP version, and a table of (country, subdivision, city) infos whose strings are
+stored once each. The index file is a JSON header followed by aligned arrays, which are
+used straight from the mapping, so opening an index is cheap and every process that has it
+open shares the same pages.'''
+
+import ipaddress
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+import maxminddb
+import numpy
+
+INDEX_MAGIC = b'NDRGEOIX'
+INDEX_FORMAT = 1
+
+# Infos use this for a missing string
+NO_STRING = 0xFFFFFFFF
+
+IPV6_DTYPE = numpy.dtype([('high', '<u8'), ('low', '<u8')])
+
+MASK_64 = (1 << 64) - 1
+
+def _info_strings(record):
+    '''Returns the (country, subdivision, city) English names of a City record, as
+    geoip2's model would'''
+    country = record.get('country', {}).get('names', {}).get('en')
+    subdivisions = record.get('subdivisions', [])
+    subdivision = None
+    if len(subdivisions) != 0:
+        subdivision = subdivisions[-1].get('names', {}).get('en')
+    city = record.get('city', {}).get('names', {}).get('en')
+    return (country, subdivision, city)
+
+def iterate_mmdb_ranges(filename):
+    '''Walks the search tree of a MaxMind DB in address order, yielding (version, start,
+    end, record) for each range that has data. In IPv6 databases IPv4 is read from ::/96.
+    Other subtrees aliased to it, i.e. 6to4 (2002::/16) and Teredo (2001::/32), are walked
+    as IPv6 ranges so they resolve to the IPv4 records as with the MaxMind readers; only
+    ::ffff:0:0/96 is skipped, as mapped addresses are looked up as IPv4'''
+
+    reader = maxminddb.open_database(filename)
+    metadata = reader.metadata()
+    node_count = metadata.node_count
+    record_size = metadata.record_size
+    node_bytes = record_size // 4
+    bits = 128 if metadata.ip_version == 6 else 32
+
+    with open(filename, 'rb') as database_file:
+        buffer = database_file.read()
+
+    def read_node(node):
+        offset = node * node_bytes
+        node_data = buffer[offset:offset + node_bytes]
+        if record_size == 24:
+            return (int.from_bytes(node_data[0:3], 'big'),
+                    int.from_bytes(node_data[3:6], 'big'))
+        if record_size == 28:
+            return (((node_data[3] & 0xF0) << 20) | int.from_bytes(node_data[0:3], 'big'),
+                    ((node_data[3] & 0x0F) << 24) | int.from_bytes(node_data[4:7], 'big'))
+        return (int.from_bytes(node_data[0:4], 'big'), int.from_bytes(node_data[4:8], 'big'))
+
+    # IPv4 lives under ::/96
+    ipv4_start = 0
+    if bits == 128:
+        for _ in range(96):
+            if ipv4_start >= node_count:
+                break
+            ipv4_start = read_node(ipv4_start)[0]
+
+    # Records are decoded through the reader, by the first address of a range pointing to
+    # them, and shared between the ranges that do
+    records = {}
+    def decode(pointer, start):
+        record = records.get(pointer)
+        if record is None:
+            address = (ipaddress.IPv6Address(start) if bits == 128
+                       else ipaddress.IPv4Address(start))
+            record = records[pointer] = reader.get(address)
+        return record
+
+    # Entries are (pointer, depth, prefix); leaves go through the stack too, so they come
+    # out in address order
+    stack = [(0, 0, 0)]
+    try:
+        while len(stack) != 0:
+            pointer, depth, prefix = stack.pop()
+
+            if pointer < node_count:
+                left, right = read_node(pointer)
+                for bit, child in ((1, right), (0, left)):
+                    child_prefix = (prefix << 1) | bit
+                    if (bits == 128 and child == ipv4_start and depth + 1 == 96 and
+                            child_prefix == 0xFFFF):
+                        continue
+                    stack.append((child, depth + 1, child_prefix))
+                continue
+
+            # Equal to the node count is "no data"
+            if pointer == node_count:
+                continue
+
+            start = prefix << (bits - depth)
+            end = start + (1 << (bits - depth)) - 1
+            record = decode(pointer, start)
+            if bits == 32:
+                yield 4, start, end, record
+                continue
+
+            if start <= 0xFFFFFFFF:
+                yield 4, start, min(end, 0xFFFFFFFF), record
+            if end > 0xFFFFFFFF:
+                yield 6, max(start, 0x100000000), end, record
+    finally:
+        reader.close()
+
+def build_index(mmdb_filename, index_filename):
+    '''Compiles a GeoIP2 City database into an index file. The file is written to the side
+    and renamed over index_filename, so processes with the old index open are unaffected.
+    Returns the number of IPv4 and IPv6 ranges'''
+
+    strings = {}
+    infos = {}
+    ranges = {4: ([], [], []), 6: ([], [], [])}
+
+    def string_id(text):
+        if text is None:
+            return NO_STRING
+        return strings.setdefault(text, len(strings))
+
+    record_infos = {}
+    for version, start, end, record in iterate_mmdb_ranges(mmdb_filename):
+        info_id = record_infos.get(id(record))
+        if info_id is None:
+            info = tuple(string_id(text) for text in _info_strings(record))
+            info_id = infos.setdefault(info, len(infos))
+            record_infos[id(record)] = info_id
+
+        starts, ends, info_ids = ranges[version]
+
+        # Neighbouring ranges with the same info are merged
+        if len(ends) != 0 and ends[-1] + 1 == start and info_ids[-1] == info_id:
+            ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+            info_ids.append(info_id)
+
+    string_list = [None] * len(strings)
+    for text, position in strings.items():
+        string_list[position] = text.encode('utf-8')
+    info_list = [None] * len(infos)
+    for info, position in infos.items():
+        info_list[position] = info
+
+    string_offsets = numpy.zeros(len(string_list) + 1, dtype='<u4')
+    numpy.cumsum([len(text) for text in string_list], out=string_offsets[1:])
+
+    v4_starts, v4_ends, v4_infos = ranges[4]
+    v6_starts, v6_ends, v6_infos = ranges[6]
+    arrays = [
+        ('v4_start', numpy.array(v4_starts, dtype='<u4')),
+        ('v4_end', numpy.array(v4_ends, dtype='<u4')),
+        ('v4_info', numpy.array(v4_infos, dtype='<u4')),
+        ('v6_start', numpy.array([(start >> 64, start & MASK_64) for start in v6_starts],
+                                 dtype=IPV6_DTYPE)),
+        ('v6_end', numpy.array([(end >> 64, end & MASK_64) for end in v6_ends],
+                               dtype=IPV6_DTYPE)),
+        ('v6_info', numpy.array(v6_infos, dtype='<u4')),
+        ('info', numpy.array(info_list, dtype='<u4').reshape(len(info_list), 3)),
+        ('string_offset', string_offsets),
+        ('string_data', numpy.frombuffer(b''.join(string_list), dtype='u1')),
+    ]
+
+    metadata = maxminddb.open_database(mmdb_filename).metadata()
+    header = {
+        'format': INDEX_FORMAT,
+        'source': os.path.basename(mmdb_filename),
+        'database_type': metadata.database_type,
+        'build_epoch': metadata.build_epoch,
+        'arrays': {}
+    }
+
+    # Arrays are laid out after the header, each 8 byte aligned; the header is sized on a
+    # first pass with placeholder offsets, and padded so the real one fits the same space
+    offset = 0
+    for name, array in arrays:
+        header['arrays'][name] = [offset, array.dtype.descr, list(array.shape)]
+        offset += (array.nbytes + 7) & ~7
+    header_length = len(json.dumps(header).encode('utf-8')) + 64
+    data_start = (len(INDEX_MAGIC) + 4 + header_length + 7) & ~7
+    for name in header['arrays']:
+        header['arrays'][name][0] += data_start
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_length)
+
+    directory = os.path.dirname(os.path.abspath(index_filename))
+    file_descriptor, temp_name = tempfile.mkstemp(dir=directory, prefix=".geoip_index")
+    try:
+        with os.fdopen(file_descriptor, 'wb') as index_file:
+            index_file.write(INDEX_MAGIC)
+            index_file.write(struct.pack('<I', header_length))
+            index_file.write(header_bytes)
+            for name, array in arrays:
+                index_file.seek(header['arrays'][name][0])
+                index_file.write(array.tobytes())
+            index_file.truncate(data_start + offset)
+        os.rename(temp_name, index_filename)
+    except Exception:
+        os.remove(temp_name)
+        raise
+
+    return len(v4_starts), len(v6_starts)
+
+class GeoIPRangeIndex(object):
+    '''A compiled GeoIP range index, mapped read only. lookup() takes one address;
+    lookup_packed() takes arrays of them (as snort_columns.PackedAddresses holds) and
+    returns info IDs, -1 where an address isn't covered. IPv4 mapped and compatible IPv6
+    addresses are looked up as IPv4, as the MaxMind readers do'''
+
+    _open_indexes = {}
+    _open_lock = threading.Lock()
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as index_file:
+            self._mmap = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError("%s is not a GeoIP index" % filename)
+        header_length = struct.unpack_from('<I', self._mmap, len(INDEX_MAGIC))[0]
+        header_start = len(INDEX_MAGIC) + 4
+        self.header = json.loads(
+            self._mmap[header_start:header_start + header_length].decode('utf-8'))
+        if self.header['format'] != INDEX_FORMAT:
+            raise ValueError("%s is an unsupported GeoIP index format" % filename)
+
+        arrays = {}
+        for name, (offset, descr, shape) in self.header['arrays'].items():
+            dtype = numpy.dtype([tuple(field) for field in descr]
+                                if len(descr) > 1 else descr[0][1])
+            count = 1
+            for dimension in shape:
+                count *= dimension
+            arrays[name] = numpy.frombuffer(self._mmap, dtype=dtype, count=count,
+                                            offset=offset).reshape(shape)
+
+        self.v4_start = arrays['v4_start']
+        self.v4_end = arrays['v4_end']
+        self.v4_info = arrays['v4_info']
+        self.v6_start = arrays['v6_start']
+        self.v6_end = arrays['v6_end']
+        self.v6_info = arrays['v6_info']
+        self.infos = arrays['info']
+        self._string_offsets = arrays['string_offset']
+        self._string_data = arrays['string_data']
+        self._strings = {}
+        self._infos = {}
+
+    @classmethod
+    def open(cls, filename):
+        '''Returns the index for filename, opening it once per process; a rebuilt index is
+        picked up when the file changes'''
+        stat = os.stat(filename)
+        key = (filename, stat.st_ino, stat.st_mtime)
+        with cls._open_lock:
+            index = cls._open_indexes.get(filename)
+            if index is None or index[0] != key:
+                index = (key, cls(filename))
+                cls._open_indexes[filename] = index
+        return index[1]
+
+    @property
+    def database_version(self):
+        '''The source database's type and build, i.e. for recording with lookups'''
+        return "%s %d" % (self.header['database_type'], self.header['build_epoch'])
+
+    def _string(self, string_id):
+        if string_id == NO_STRING:
+            return None
+
+        text = self._strings.get(string_id)
+        if text is None:
+            start, end = self._string_offsets[string_id:string_id + 2].tolist()
+            text = self._string_data[start:end].tobytes().decode('utf-8')
+            self._strings[string_id] = text
+        return text
+
+    def info(self, info_id):
+        '''Returns the (country, subdivision, city) of an info ID'''
+        info = self._infos.get(info_id)
+        if info is None:
+            info = tuple(self._string(string_id) for string_id in self.infos[info_id].tolist())
+            self._infos[info_id] = info
+        return info
+
+    def lookup_packed(self, is_v4, high, low):
+        '''Looks up arrays of addresses, split as in PackedAddresses. Returns an int64 array
+        of info IDs, -1 for addresses no range covers'''
+        info_ids = numpy.full(len(is_v4), -1, dtype=numpy.int64)
+
+        as_v4 = is_v4 | ((high == 0) & (low <= numpy.uint64(0xFFFFFFFF)))
+        v4_positions = numpy.flatnonzero(as_v4)
+        if len(v4_positions) != 0 and len(self.v4_start) != 0:
+            addresses = low[v4_positions].astype(numpy.uint32)
+            ranges = numpy.searchsorted(self.v4_start, addresses, side='right') - 1
+            found = ranges >= 0
+            found[found] = addresses[found] <= self.v4_end[ranges[found]]
+            info_ids[v4_positions[found]] = self.v4_info[ranges[found]]
+
+        v6_positions = numpy.flatnonzero(~as_v4)
+        if len(v6_positions) != 0 and len(self.v6_start) != 0:
+            addresses = numpy.empty(len(v6_positions), dtype=IPV6_DTYPE)
+            addresses['high'] = high[v6_positions]
+            addresses['low'] = low[v6_positions]
+            ranges = numpy.searchsorted(self.v6_start, addresses, side='right') - 1
+            found = ranges >= 0
+            ends = self.v6_end[ranges[found]]
+            found[found] = ((addresses['high'][found] < ends['high']) |
+                            ((addresses['high'][found] == ends['high']) &
+                             (addresses['low'][found] <= ends['low'])))
+            info_ids[v6_positions[found]] = self.v6_info[ranges[found]]
+
+        return info_ids
+
+    def lookup(self, address):
+        '''Returns the (country, subdivision, city) of an ipaddress address, None if the
+        database has nothing for it'''
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        integer = int(address)
+
+        if integer <= 0xFFFFFFFF:
+            position = int(self.v4_start.searchsorted(integer, side='right')) - 1
+            if position < 0 or integer > int(self.v4_end[position]):
+                return None
+            return self.info(int(self.v4_info[position]))
+
+        key = numpy.array((integer >> 64, integer & MASK_64), dtype=IPV6_DTYPE)
+        position = int(self.v6_start.searchsorted(key, side='right')) - 1
+        if position < 0:
+            return None
+        end = self.v6_end[position]
+        if integer > (int(end['high']) << 64) | int(end['low']):
+            return None
+        return self.info(int(self.v6_info[position]))
+
+    def close(self):
+        '''Releases the mapping; arrays taken from the index must be dropped first'''
+        self.v4_start = self.v4_end = self.v4_info = None
+        self.v6_start = self.v6_end = self.v6_info = None
+        self.infos = self._string_offsets = self._string_data = None
+        self._mmap.close()
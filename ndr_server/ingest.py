@@ -74,7 +74,7 @@ class IngestServer():
     def process_ingest_message(self, db_connection, recorder, decoded_message):
         '''Processes an ingest message as per the main processing loop'''
 
-        cursor = db_connection.cursor()
+        database = self.config.database
 
         # Attempt to deserialize the YAML file into its base
         # format
@@ -85,10 +85,12 @@ class IngestServer():
             "message generated at %s", message.generated_at)
 
         # Create the upload log
-        cursor.callproc("ingest.create_upload_log", [recorder.pg_id,
-                                                     message.message_type.value,
-                                                     message.generated_at])
-        log_id = cursor.fetchone()[0]
+        log_id = database.run_procedure_fetchone("ingest.create_upload_log",
+                                                 [recorder.pg_id,
+                                                  message.message_type.value,
+                                                  message.generated_at],
+                                                 existing_db_conn=db_connection,
+                                                 tuple_cursor=True)[0]
 
         # Alert messages
         if message.message_type == ndr.IngestMessageTypes.TEST_ALERT:
@@ -121,10 +123,12 @@ class IngestServer():
             )
 
             # Record the message for history reasons
-            cursor.callproc("alert.record_alert_msg",
-                            [log_id,
-                             alert_msg.raised_by,
-                             alert_msg.contents])
+            database.run_procedure("alert.record_alert_msg",
+                                   [log_id,
+                                    alert_msg.raised_by,
+                                    alert_msg.contents],
+                                   existing_db_conn=db_connection,
+                                   tuple_cursor=True).close()
 
             for contact in alert_contacts:
                 contact.send_message(
@@ -141,19 +145,24 @@ class IngestServer():
 
         # Syslog Upload
         elif message.message_type == ndr.IngestMessageTypes.SYSLOG_UPLOAD:
-            syslog = ndr.SyslogUploadMessage().from_message(
-                message)
+            syslog = list(ndr.SyslogUploadMessage().from_message(
+                message))
+            programs = self.config.dimensions.syslog_programs
+            program_ids = programs.resolve([log_entry.program for log_entry in syslog],
+                                           db_connection)
             for log_entry in syslog:
-                cursor.callproc("ingest.insert_syslog_entry",
-                                [log_id,
-                                 recorder.pg_id,
-                                 log_entry.timestamp,
-                                 log_entry.program,
-                                 log_entry.priority.value,
-                                 log_entry.pid,
-                                 log_entry.host,
-                                 log_entry.facility.value,
-                                 log_entry.message])
+                database.run_procedure("ingest.insert_syslog_entry_by_program_id",
+                                       [log_id,
+                                        recorder.pg_id,
+                                        log_entry.timestamp,
+                                        programs.lookup(program_ids, log_entry.program),
+                                        log_entry.priority.value,
+                                        log_entry.pid,
+                                        log_entry.host,
+                                        log_entry.facility.value,
+                                        log_entry.message],
+                                       existing_db_conn=db_connection,
+                                       tuple_cursor=True).close()
 
         # SNORT Traffic
         elif message.message_type == ndr.IngestMessageTypes.SNORT_TRAFFIC:
@@ -258,7 +267,11 @@ class IngestServer():
             except psycopg2.Error as exception:
                 self.logger.error(
                     "PostgreSQL error: %s", exception.pgerror)
-                db_connection.rollback()
+
+                # If the server went away there's nothing to roll back; the pool will
+                # discard the connection when it's returned
+                if not db_connection.closed:
+                    db_connection.rollback()
 
                 self.logger.error(
                     "error %s: %s", file, sys.exc_info()[0])
@@ -277,8 +290,43 @@ class IngestServer():
         self.logger.info("=== ingest %s starting up ===", INGEST_VERSION)
         self.prep_ingest_directories()
 
+        if self.config.dimension_cache_warm:
+            self.warm_dimension_caches()
+
         # Main event loop
+        last_stats_export = time.monotonic()
 
         while True:
             self.message_processing_loop()
+
+            if (self.config.db_stats_file is not None and
+                    time.monotonic() - last_stats_export >= self.config.db_stats_interval):
+                self.export_database_stats()
+                last_stats_export = time.monotonic()
+
             time.sleep(5)
+
+    def warm_dimension_caches(self):
+        '''Preloads the IDs of recently seen addresses, hostnames and programs'''
+        db_connection = self.config.database.get_connection(read_only=True)
+        try:
+            self.config.dimensions.warm(db_connection)
+            db_connection.commit()
+        except psycopg2.Error as exception:
+            # Only costs some lookups, so don't refuse to start over it
+            self.logger.warning("unable to warm dimension caches: %s", exception)
+            if not db_connection.closed:
+                db_connection.rollback()
+        finally:
+            self.config.database.return_connection(db_connection)
+
+        for name, cache in self.config.dimensions.all():
+            self.logger.info("%s cache: %d entries", name, len(cache.cache))
+
+    def export_database_stats(self):
+        '''Writes the query and pool statistics out for whoever is watching'''
+        try:
+            self.config.database.write_stats(self.config.db_stats_file)
+        except OSError as exception:
+            self.logger.warning("unable to write database statistics to %s: %s",
+                                self.config.db_stats_file, exception)
@@ -0,0 +1,91 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Registry of the networks internal to each site'''
+
+import bisect
+import ipaddress
+import threading
+import time
+
+class LocalNetworkIndex(object):
+    '''A site's internal prefixes merged into sorted, non-overlapping address ranges per IP
+    version; contains() is a binary search. IPv4 mapped IPv6 addresses are looked up by their
+    IPv4 address'''
+
+    __slots__ = ('networks', '_starts', '_ends')
+
+    def __init__(self, networks):
+        self.networks = [ipaddress.ip_network(network) for network in networks]
+        self._starts = {4: [], 6: []}
+        self._ends = {4: [], 6: []}
+
+        ranges = sorted((network.version, int(network.network_address),
+                         int(network.broadcast_address)) for network in self.networks)
+        for version, start, end in ranges:
+            starts = self._starts[version]
+            ends = self._ends[version]
+            if len(ends) != 0 and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+
+    def __len__(self):
+        return len(self.networks)
+
+    def contains(self, address):
+        '''Returns True if the address is within one of the site's networks'''
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+
+        integer = int(address)
+        position = bisect.bisect_right(self._starts[address.version], integer) - 1
+        return position >= 0 and integer <= self._ends[address.version][position]
+
+class LocalNetworkRegistry(object):
+    '''Caches each site's LocalNetworkIndex in process, reloading it once it's older than
+    max_age seconds. Networks learned from scans show up on the next reload; changes made
+    through Site are seen right away'''
+
+    def __init__(self, config, max_age=300):
+        self.config = config
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def for_site(self, site_id, db_conn):
+        '''Returns the LocalNetworkIndex of a site'''
+        with self._lock:
+            entry = self._indexes.get(site_id)
+        if entry is not None and time.monotonic() - entry[0] < self.max_age:
+            return entry[1]
+
+        rows = self.config.database.run_procedure_fetchall(
+            "admin.get_local_networks_for_site", [site_id],
+            existing_db_conn=db_conn, tuple_cursor=True, read_only=True)
+        index = LocalNetworkIndex([row[0] for row in rows])
+
+        with self._lock:
+            self._indexes[site_id] = (time.monotonic(), index)
+        return index
+
+    def invalidate(self, site_id=None):
+        '''Forgets the cached index of a site, or of every site'''
+        with self._lock:
+            if site_id is None:
+                self._indexes = {}
+            else:
+                self._indexes.pop(site_id, None)
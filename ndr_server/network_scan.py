@@ -16,6 +16,7 @@
 
 '''Handle network scan management and importation'''
 
+import ipaddress
 import json
 
 import ndr
@@ -30,6 +31,8 @@ DISCOVERY_SCAN_TYPES = [
 class NetworkScan(object):
     '''Network Scans represent data in the database, and handling of scan differences'''
 
+    __slots__ = ('pg_id', 'config', 'recorder', 'nmap_scan', 'message')
+
     def __init__(self, config):
         self.pg_id = None
         self.config = config
@@ -51,7 +54,7 @@ class NetworkScan(object):
         scan_json = json.dumps(storable_scan.to_dict())
         net_scan.pg_id = config.database.run_procedure_fetchone(
             "network_scan.import_scan", [log_id, scan_json],
-            existing_db_conn=db_conn)[0]
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
 
         return net_scan
 
@@ -87,7 +90,7 @@ class NetworkScan(object):
 
         unknown_host_ids = self.config.database.run_procedure_fetchone(
             "network_scan.return_hosts_not_in_baseline", [self.pg_id],
-            existing_db_conn=db_conn)[0]
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
 
         # See if we have anything unknown in the scan
         if unknown_host_ids is None:
@@ -101,7 +104,7 @@ class NetworkScan(object):
         for host_id in unknown_host_ids:
             host_dict = self.config.database.run_procedure_fetchone(
                 "network_scan.export_host", [host_id],
-                existing_db_conn=db_conn)[0]
+                existing_db_conn=db_conn, tuple_cursor=True)[0]
 
             # Convert the JSON to a host dict
             host_obj = ndr.NmapHost.from_dict(host_dict)
@@ -119,6 +122,12 @@ class NetworkScan(object):
 
 class BaselineHost(object):
     '''Represents a baseline host object in the schema'''
+
+    __slots__ = ('pg_id', 'site_id', 'config', 'human_name')
+
+    # Columns consumed by from_row(), in order
+    ROW_COLUMNS = ('id', 'site_id', 'human_name')
+
     def __init__(self, config):
         self.pg_id = None
         self.site_id = None
@@ -129,12 +138,9 @@ class BaselineHost(object):
     def read_by_id(cls, config, pg_id, db_conn):
         '''Reads a baseline host'''
 
-        bhost_dict = config.database.config.database.run_procedure_fetchone(
-            "network_scan.get_baseline_host_by_id", [pg_id],
-            existing_db_conn=db_conn)
-
-        bhost = BaselineHost(config).from_dict(bhost_dict)
-        return bhost
+        return config.database.run_procedure_fetchone_mapped(
+            "network_scan.get_baseline_host_by_id", [pg_id], cls,
+            existing_db_conn=db_conn, read_only=True)
 
     def from_dict(self, bhost_dict):
         '''Deserializes a bhost'''
@@ -144,6 +150,15 @@ class BaselineHost(object):
 
         return self
 
+    @classmethod
+    def from_row(cls, config, row):
+        '''Builds a bhost straight from a ROW_COLUMNS ordered tuple'''
+        bhost = cls.__new__(cls)
+        bhost.config = config
+        bhost.pg_id, bhost.site_id, bhost.human_name = row
+
+        return bhost
+
     def set_human_name(self, human_name, db_conn=None):
         '''Sets the human name in the database'''
 
@@ -155,38 +170,33 @@ class BaselineHost(object):
         self.human_name = human_name
 
     @classmethod
-    def find_all_by_most_recent_ip(self, config, site, ip_address, db_conn):
+    def find_all_by_most_recent_ip(cls, config, site, ip_address, db_conn):
         '''Reads a baseline host'''
 
         # This may return multiple entries so ...
-        cursor = config.database.config.database.run_procedure(
+        return config.database.run_procedure_fetchall_mapped(
             "network_scan.get_baseline_host_by_most_recent_ip_address", [site.pg_id, ip_address],
-            existing_db_conn=db_conn)
+            cls, existing_db_conn=db_conn, read_only=True)
 
-        bhost_dicts = cursor.fetchall()
-        cursor.close()
+    @staticmethod
+    def human_names_by_ip(config, site, ip_addresses, db_conn):
+        '''Returns a dict of ipaddress objects to the human name of the baseline host they
+        were most recently seen as. IPs without a named host are left out'''
 
-        bhosts = []
-        for bhost_dict in bhost_dicts:
-            bhost = BaselineHost(config).from_dict(bhost_dict)
-            bhosts.append(bhost)
+        if len(ip_addresses) == 0:
+            return {}
 
-        return bhosts
+        rows = config.database.run_procedure_fetchall(
+            "network_scan.get_baseline_host_names_for_site",
+            [site.pg_id, [ip.compressed for ip in ip_addresses]],
+            existing_db_conn=db_conn, read_only=True)
 
-    @staticmethod
-    def read_all_for_site(config, site, db_conn):
+        return {ipaddress.ip_address(row['ip_address']): row['human_name'] for row in rows}
+
+    @classmethod
+    def read_all_for_site(cls, config, site, db_conn):
         '''Reads all baseline hosts per site'''
 
-        cursor = config.database.config.database.run_procedure(
+        return config.database.run_procedure_fetchall_mapped(
             "network_scan.get_all_baseline_hosts_for_site", [site.pg_id],
-            existing_db_conn=db_conn)
-
-        bhost_dicts = cursor.fetchall()
-        cursor.close()
-
-        bhosts = []
-        for bhost_dict in bhost_dicts:
-            bhost = BaselineHost(config).from_dict(bhost_dict)
-            bhosts.append(bhost)
-
-        return bhosts
+            cls, existing_db_conn=db_conn, read_only=True)
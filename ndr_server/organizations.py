@@ -25,6 +25,11 @@ import ndr_server
 class Organization(object):
     '''Organizations represent a paying customer. They can have multiple sites'''
 
+    __slots__ = ('config', 'pg_id', 'name')
+
+    # Columns consumed by from_row(), in order
+    ROW_COLUMNS = ('id', 'name')
+
     def __init__(self, config):
         self.config = config
         self.pg_id = None
@@ -45,6 +50,14 @@ class Organization(object):
 
         return self
 
+    @classmethod
+    def from_row(cls, config, row):
+        '''Builds an organization straight from a ROW_COLUMNS ordered tuple'''
+        org = cls.__new__(cls)
+        org.config = config
+        org.pg_id, org.name = row
+        return org
+
     @classmethod
     def create(cls, config, name, db_conn=None):
         '''Creates the organization within the database'''
@@ -52,36 +65,28 @@ class Organization(object):
         org.name = name
 
         org.pg_id = config.database.run_procedure_fetchone(
-            "admin.insert_organization", [name], existing_db_conn=db_conn)[0]
+            "admin.insert_organization", [name], existing_db_conn=db_conn, tuple_cursor=True)[0]
 
         return org
 
     @classmethod
     def read_by_id(cls, config, org_id, db_conn=None):
         '''Loads an organization by ID number'''
-        org_dict = config.database.run_procedure_fetchone("admin.select_organization_by_id",
-                                                          [org_id],
-                                                          existing_db_conn=db_conn)
-        org = cls(config)
-        return org.from_dict(org_dict)
+        return config.database.run_procedure_fetchone_mapped("admin.select_organization_by_id",
+                                                             [org_id],
+                                                             cls,
+                                                             existing_db_conn=db_conn)
 
     @classmethod
     def read_by_name(cls, config, org_name, db_conn=None):
         '''Loads an organization by name'''
-        org_dict = config.database.run_procedure_fetchone("admin.select_organization_by_name",
-                                                          [org_name],
-                                                          existing_db_conn=db_conn)
-
-        org = cls(config)
-        return org.from_dict(org_dict)
+        return config.database.run_procedure_fetchone_mapped("admin.select_organization_by_name",
+                                                             [org_name],
+                                                             cls,
+                                                             existing_db_conn=db_conn)
 
     def get_contacts(self, db_conn=None):
         '''Gets alert contacts for an organization'''
-        cursor = self.config.database.run_procedure("admin.get_contacts_for_organization",
-                                                    [self.pg_id], existing_db_conn=db_conn)
-
-        contacts = []
-        for record in cursor.fetchall():
-            contacts.append(ndr_server.Contact.from_dict(self.config, record))
-
-        return contacts
+        return self.config.database.run_procedure_fetchall_mapped(
+            "admin.get_contacts_for_organization", [self.pg_id], ndr_server.Contact,
+            existing_db_conn=db_conn)
@@ -0,0 +1,184 @@
+# Copyright (C) 2017  Secured By THEM
+# Original Author: Michael Casadevall <mcasadevall@them.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Per stored procedure latency tracing for the database helper'''
+
+import bisect
+import collections
+import threading
+
+import psycopg2
+from psycopg2 import sql
+
+# Upper bounds of the latency histogram buckets in milliseconds; anything slower lands in
+# the final overflow bucket
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# How many EXPLAIN plans we hold on to per procedure
+MAX_PLANS_PER_PROCEDURE = 5
+
+class ProcedureStats(object):
+    '''Running statistics for a single stored procedure'''
+
+    __slots__ = ('calls', 'errors', 'rows', 'total_ms', 'max_ms', 'histogram', 'plans')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.plans = collections.deque(maxlen=MAX_PLANS_PER_PROCEDURE)
+
+    def to_dict(self):
+        '''Serializes the statistics to something JSON friendly'''
+        buckets = collections.OrderedDict()
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram):
+            buckets['<=%dms' % bound] = count
+        buckets['>%dms' % LATENCY_BUCKETS_MS[-1]] = self.histogram[-1]
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': self.total_ms,
+            'avg_ms': self.total_ms / self.calls if self.calls else 0.0,
+            'max_ms': self.max_ms,
+            'histogram': buckets,
+            'plans': list(self.plans),
+        }
+
+def redact_args(list_args):
+    '''Replaces procedure arguments with their types so nothing sensitive hits the log'''
+    redacted = []
+    for arg in list_args:
+        if arg is None:
+            redacted.append('NULL')
+        elif isinstance(arg, (str, bytes)):
+            redacted.append('<%s len=%d>' % (type(arg).__name__, len(arg)))
+        else:
+            redacted.append('<%s>' % type(arg).__name__)
+    return redacted
+
+class QueryTracer(object):
+    '''Records call counts, latency histograms and rows returned per stored procedure
+
+    Optionally logs calls slower than slow_query_ms (with the arguments redacted) and captures
+    EXPLAIN (ANALYZE, BUFFERS) output for calls slower than explain_ms. The EXPLAIN re-runs
+    the procedure inside a savepoint that is always rolled back so writes aren't repeated.
+    For PL/pgSQL procedures the plan only shows the function scan unless auto_explain is
+    loaded with log_nested_statements'''
+
+    def __init__(self, logger=None, slow_query_ms=None, explain_ms=None):
+        self.logger = logger
+        self.slow_query_ms = slow_query_ms
+        self.explain_ms = explain_ms
+        self._lock = threading.Lock()
+        self._procedures = {}
+
+    def _stats_for(self, proc):
+        stats = self._procedures.get(proc)
+        if stats is None:
+            stats = ProcedureStats()
+            self._procedures[proc] = stats
+        return stats
+
+    def record(self, proc, elapsed_ms, rows):
+        '''Records a successful procedure call'''
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)
+        with self._lock:
+            stats = self._stats_for(proc)
+            stats.calls += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.histogram[bucket] += 1
+            if rows is not None and rows > 0:
+                stats.rows += rows
+
+    def record_error(self, proc, elapsed_ms):
+        '''Records a procedure call that raised'''
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)
+        with self._lock:
+            stats = self._stats_for(proc)
+            stats.calls += 1
+            stats.errors += 1
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.histogram[bucket] += 1
+
+    def check_slow(self, db_conn, proc, list_args, elapsed_ms):
+        '''Logs and optionally EXPLAINs a call if it crossed the configured thresholds'''
+        if self.slow_query_ms is not None and elapsed_ms >= self.slow_query_ms:
+            if self.logger is not None:
+                self.logger.warning("slow procedure %s(%s) took %.1f ms",
+                                    proc, ", ".join(redact_args(list_args)), elapsed_ms)
+
+        if self.explain_ms is not None and elapsed_ms >= self.explain_ms:
+            plan = self.explain(db_conn, proc, list_args)
+            if plan is not None:
+                with self._lock:
+                    self._stats_for(proc).plans.append({
+                        'elapsed_ms': elapsed_ms,
+                        'plan': plan
+                    })
+
+    def explain(self, db_conn, proc, list_args):
+        '''Runs EXPLAIN (ANALYZE, BUFFERS) on a procedure call, and returns the plan text'''
+        placeholders = sql.SQL(', ').join([sql.Placeholder()] * len(list_args))
+        query = sql.SQL("EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM {}({})").format(
+            sql.SQL(proc), placeholders)
+
+        cursor = db_conn.cursor()
+        try:
+            cursor.execute("SAVEPOINT ndr_query_trace_explain")
+            try:
+                cursor.execute(query, list_args)
+                plan = "\n".join([row[0] for row in cursor.fetchall()])
+            finally:
+                cursor.execute("ROLLBACK TO SAVEPOINT ndr_query_trace_explain")
+                cursor.execute("RELEASE SAVEPOINT ndr_query_trace_explain")
+        except psycopg2.Error as exception:
+            if self.logger is not None:
+                self.logger.warning("unable to EXPLAIN %s: %s", proc, exception)
+            return None
+        finally:
+            cursor.close()
+
+        return plan
+
+    def snapshot(self):
+        '''Returns all statistics, keyed by procedure name'''
+        with self._lock:
+            return {proc: stats.to_dict() for proc, stats in self._procedures.items()}
+
+    def top_procedures(self, count=10):
+        '''Returns (procedure, stats) tuples for the procedures with the most total time'''
+        snapshot = self.snapshot()
+        return sorted(snapshot.items(), key=lambda item: item[1]['total_ms'],
+                      reverse=True)[:count]
+
+    def log_summary(self, logger, count=10):
+        '''Writes the most expensive procedures to logger'''
+        for proc, stats in self.top_procedures(count):
+            logger.info("%s: %d calls, %.1f ms total, %.2f ms avg, %.1f ms max, %d rows",
+                        proc, stats['calls'], stats['total_ms'], stats['avg_ms'],
+                        stats['max_ms'], stats['rows'])
+
+    def reset(self):
+        '''Throws away everything recorded so far'''
+        with self._lock:
+            self._procedures = {}
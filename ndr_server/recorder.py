@@ -27,6 +27,12 @@ class Recorder(object):
 
     '''Recorders are a system running the NDR package, and represent a source of data'''
 
+    __slots__ = ('config', 'pg_id', 'site_id', 'human_name', 'hostname', 'enlisted_at',
+                 'last_seen', 'image_build_date', 'image_type')
+
+    # Columns consumed by from_row(), in order
+    ROW_COLUMNS = ('id', 'site_id', 'human_name', 'hostname', 'image_build_date', 'image_type')
+
     def __init__(self, config):
         self.config = config
         self.pg_id = None
@@ -59,7 +65,7 @@ class Recorder(object):
 
         recorder.pg_id = config.database.run_procedure_fetchone(
             "admin.insert_recorder", [site.pg_id, human_name, hostname],
-            existing_db_conn=db_conn)[0]
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
 
         return recorder
 
@@ -74,6 +80,18 @@ class Recorder(object):
 
         return self
 
+    @classmethod
+    def from_row(cls, config, row):
+        '''Builds a recorder straight from a ROW_COLUMNS ordered tuple'''
+        recorder = cls.__new__(cls)
+        recorder.config = config
+        (recorder.pg_id, recorder.site_id, recorder.human_name, recorder.hostname,
+         recorder.image_build_date, recorder.image_type) = row
+        recorder.enlisted_at = None
+        recorder.last_seen = None
+
+        return recorder
+
     def get_site(self, db_conn=None):
         '''Gets the site object for this recorder'''
         return ndr_server.Site.read_by_id(self.config, self.site_id, db_conn)
@@ -86,7 +104,8 @@ class Recorder(object):
         image_build_date = int(image_build_date)
         self.config.database.run_procedure("admin.set_recorder_sw_revision",
                                            [self.pg_id, image_build_date, image_type],
-                                           existing_db_conn=db_conn)
+                                           existing_db_conn=db_conn,
+                                           tuple_cursor=True).close()
         self.image_build_date = image_build_date
         self.image_type = image_type
 
@@ -103,23 +122,20 @@ class Recorder(object):
              message_type.value,
              start_period,
              end_period],
-            existing_db_conn=db_conn)[0]
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
         return message_ids
 
     @classmethod
     def read_by_id(cls, config, recorder_id, db_conn=None):
         '''Loads an recorder by ID number'''
-        rec = cls(config)
-        return rec.from_dict(config.database.run_procedure_fetchone(
-            "ingest.select_recorder_by_id", [recorder_id], existing_db_conn=db_conn))
+        return config.database.run_procedure_fetchone_mapped(
+            "ingest.select_recorder_by_id", [recorder_id], cls, existing_db_conn=db_conn)
 
     @classmethod
     def read_by_hostname(cls, config, hostname, db_conn=None):
         '''Loads a recorder based of it's hostname in the database'''
-        rec = cls(config)
-
-        return rec.from_dict(config.database.run_procedure_fetchone(
-            "ingest.select_recorder_by_hostname", [hostname], existing_db_conn=db_conn))
+        return config.database.run_procedure_fetchone_mapped(
+            "ingest.select_recorder_by_hostname", [hostname], cls, existing_db_conn=db_conn)
 
     @staticmethod
     def get_all_recorder_names(config, db_conn=None):
@@ -0,0 +1,136 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''On disk cache of the aggregated datasets behind a site's traffic reports for a period,
+so reports can be re-rendered and re-sent without redoing the aggregations.
+
+Entries are keyed by site, period and REPORT_SNAPSHOT_VERSION. Each also records how many
+traffic report messages the site had received in the period and the newest one's ID, and
+how many times the GeoIP backfill had re-enriched flows of the period's hours, when it was
+taken. Once a late message or the backfill changes any of that, the entry is stale.
+
+Nothing reads entries of old periods again, so prune() removes them after a while'''
+
+import gzip
+import hashlib
+import ipaddress
+import json
+import os
+import tempfile
+import time
+
+# Bump when the cached datasets or their records change
+REPORT_SNAPSHOT_VERSION = 1
+
+# Record fields holding ipaddress objects
+ADDRESS_FIELDS = ('local_ip', 'global_ip')
+
+def serialize_records(records):
+    '''Returns namedtuple records as JSON friendly lists'''
+    return [[str(value) if field in ADDRESS_FIELDS else value
+             for field, value in zip(record._fields, record)]
+            for record in records]
+
+def deserialize_records(record_type, rows):
+    '''Rebuilds the records serialize_records() returned'''
+    return [record_type._make(ipaddress.ip_address(value) if field in ADDRESS_FIELDS else value
+                              for field, value in zip(record_type._fields, row))
+            for row in rows]
+
+class ReportSnapshotCache(object):
+    '''Report datasets stored as gzipped JSON files in a directory'''
+
+    def __init__(self, config, directory):
+        self.config = config
+        self.directory = directory
+
+    def key(self, site, start_period, end_period, db_conn):
+        '''Returns what the report data of the period depends on, as of now. Taken before
+        the datasets are fetched, so messages arriving meanwhile only make the entry stale'''
+        message_count, last_message_id, geoip_reenrichments = \
+            self.config.database.run_procedure_fetchone(
+                "traffic_report.get_report_window_state",
+                [site.pg_id, start_period, end_period],
+                existing_db_conn=db_conn, tuple_cursor=True, read_only=True)
+
+        return {
+            'version': REPORT_SNAPSHOT_VERSION,
+            'site_id': site.pg_id,
+            'start_period': start_period.isoformat(),
+            'end_period': end_period.isoformat(),
+            'message_count': message_count,
+            'last_message_id': last_message_id,
+            'geoip_reenrichments': geoip_reenrichments
+        }
+
+    def filename(self, key):
+        '''Entries are named after the parts of the key that don't change with late
+        messages or GeoIP backfills, so a stale entry is replaced rather than kept alongside'''
+        name = json.dumps([key['version'], key['site_id'], key['start_period'],
+                           key['end_period']])
+        return os.path.join(self.directory,
+                            "report-%d-%s.json.gz" % (
+                                key['site_id'], hashlib.sha1(name.encode('utf-8')).hexdigest()))
+
+    def load(self, key):
+        '''Returns the datasets stored under key, or None if there are none or they're stale'''
+        try:
+            with gzip.open(self.filename(key), 'rt', encoding='utf-8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exception:
+            self.config.logger.warning("ignoring unreadable report snapshot: %s", exception)
+            return None
+
+        if snapshot['key'] != key:
+            return None
+        return snapshot['datasets']
+
+    def store(self, key, datasets):
+        '''Atomically stores datasets (lists of JSON friendly rows by name) under key'''
+        os.makedirs(self.directory, exist_ok=True)
+        file_descriptor, temp_name = tempfile.mkstemp(dir=self.directory, prefix=".report")
+        try:
+            with os.fdopen(file_descriptor, 'wb') as raw_file, \
+                    gzip.open(raw_file, 'wt', encoding='utf-8') as snapshot_file:
+                json.dump({'key': key, 'datasets': datasets}, snapshot_file)
+            os.rename(temp_name, self.filename(key))
+        except Exception:
+            os.remove(temp_name)
+            raise
+
+    def prune(self, max_age):
+        '''Removes the entries, and temporary files left behind, not written in the last
+        max_age seconds. Returns how many files were removed'''
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+
+        cutoff = time.time() - max_age
+        removed = 0
+        for name in names:
+            if not (name.startswith("report-") or name.startswith(".report")):
+                continue
+            try:
+                path = os.path.join(self.directory, name)
+                if os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                # Another run replaced or pruned it meanwhile
+                pass
+        return removed
@@ -14,11 +14,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import ipaddress
+
 import ndr_server
 
 class Site(object):
     '''Sites represent a physical location. Recorders exist within sites'''
 
+    __slots__ = ('config', 'org_id', 'pg_id', 'name')
+
+    # Columns consumed by from_row(), in order
+    ROW_COLUMNS = ('id', 'org_id', 'name')
+
     def __init__(self, config):
         self.config = config
         self.org_id = None
@@ -41,7 +48,7 @@ class Site(object):
         site.org_id = organization.pg_id
         site.pg_id = config.database.run_procedure_fetchone(
             "admin.insert_site", [organization.pg_id, name],
-            existing_db_conn=db_conn)[0]
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
 
         return site
 
@@ -52,36 +59,64 @@ class Site(object):
         self.org_id = site_dict['org_id']
         return self
 
+    @classmethod
+    def from_row(cls, config, row):
+        '''Builds a site straight from a ROW_COLUMNS ordered tuple'''
+        site = cls.__new__(cls)
+        site.config = config
+        site.pg_id, site.org_id, site.name = row
+        return site
+
     def get_organization(self, db_conn=None):
         '''Returns parent organization'''
         return ndr_server.Organization.read_by_id(self.config, self.org_id, db_conn=db_conn)
 
+    def get_local_networks(self, db_conn=None):
+        '''Returns the LocalNetworkIndex of the networks internal to this site'''
+        return self.config.local_networks.for_site(self.pg_id, db_conn)
+
+    def add_local_network(self, network, db_conn=None):
+        '''Marks a network (i.e. a public or IPv6 range) as internal to this site'''
+        self.config.database.run_procedure(
+            "admin.add_site_local_network",
+            [self.pg_id, str(ipaddress.ip_network(network)), 'admin'],
+            existing_db_conn=db_conn, tuple_cursor=True).close()
+        self.config.local_networks.invalidate(self.pg_id)
+
+    def remove_local_network(self, network, db_conn=None):
+        '''Removes a network from this site, returns True if it was there'''
+        removed = self.config.database.run_procedure_fetchone(
+            "admin.remove_site_local_network", [self.pg_id, str(ipaddress.ip_network(network))],
+            existing_db_conn=db_conn, tuple_cursor=True)[0]
+        self.config.local_networks.invalidate(self.pg_id)
+        return removed != 0
+
     @classmethod
     def read_by_id(cls, config, site_id, db_conn=None):
         '''Loads an site by ID number'''
 
-        site = cls(config)
-        return site.from_dict(config.database.run_procedure_fetchone(
-            "admin.select_site_by_id", [site_id], existing_db_conn=db_conn))
+        return config.database.run_procedure_fetchone_mapped(
+            "admin.select_site_by_id", [site_id], cls, existing_db_conn=db_conn)
 
     @classmethod
     def read_by_name(cls, config, site_name, db_conn=None):
         '''Loads an site by name'''
 
-        site = cls(config)
-        return site.from_dict(config.database.run_procedure_fetchone(
-            "admin.select_site_by_name", [site_name], existing_db_conn=db_conn))
+        return config.database.run_procedure_fetchone_mapped(
+            "admin.select_site_by_name", [site_name], cls, existing_db_conn=db_conn)
 
     @classmethod
     def retrieve_all(cls, config, db_conn):
         '''Retrieves all sites in the database'''
 
         cursor = config.database.run_procedure(
-            "admin.get_all_site_ids", [], existing_db_conn=db_conn)
+            "admin.get_all_site_ids", [], existing_db_conn=db_conn, read_only=True)
 
         sites = []
         for site_id in cursor.fetchall():
-            site = cls.read_by_id(config, site_id[0], db_conn)
+            site = config.database.run_procedure_fetchone_mapped(
+                "admin.select_site_by_id", [site_id[0]], cls,
+                existing_db_conn=db_conn, read_only=True)
             sites.append(site)
 
         cursor.close()
@@ -0,0 +1,253 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Compact summaries of each machine's outbound traffic per day, kept up to date at ingest:
+the remote hosts it sent the most bytes to (Space-Saving) and how many distinct remote hosts
+it talked to (HyperLogLog). Both merge across days with bounded error'''
+
+import collections
+import hashlib
+import ipaddress
+import math
+import struct
+
+SKETCH_FORMAT_VERSION = 1
+
+HeavyHitter = collections.namedtuple('HeavyHitter', 'address estimate error')
+
+class SpaceSaving(object):
+    '''Space-Saving heavy hitters over remote addresses, weighted by bytes.
+
+    At most capacity addresses are tracked. An address's estimate is never below its true
+    total and overestimates it by at most its error, which is at most total/capacity. Any
+    address with more than total/capacity bytes is guaranteed to be tracked'''
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.total = 0
+        self.counters = {}
+
+    def __len__(self):
+        return len(self.counters)
+
+    def _minimum(self):
+        '''Estimate an untracked address may have; 0 until the sketch is full'''
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def offer(self, address, weight=1):
+        '''Counts weight bytes for address'''
+        self.total += weight
+        key = ipaddress.ip_address(address).packed
+        entry = self.counters.get(key)
+        if entry is not None:
+            self.counters[key] = (entry[0] + weight, entry[1])
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[key] = (weight, 0)
+            return
+
+        # Take over the smallest counter, inheriting its count as our error
+        victim = min(self.counters, key=lambda k: (self.counters[k][0], k))
+        minimum = self.counters.pop(victim)[0]
+        self.counters[key] = (minimum + weight, minimum)
+
+    def merge(self, other):
+        '''Returns a sketch summarizing both sketches' traffic. Error bounds add up'''
+        merged = SpaceSaving(max(self.capacity, other.capacity))
+        merged.total = self.total + other.total
+
+        self_minimum = self._minimum()
+        other_minimum = other._minimum()
+        counters = {}
+        for key in set(self.counters) | set(other.counters):
+            count_a, error_a = self.counters.get(key, (self_minimum, self_minimum))
+            count_b, error_b = other.counters.get(key, (other_minimum, other_minimum))
+            counters[key] = (count_a + count_b, error_a + error_b)
+
+        kept = sorted(counters.items(), key=lambda item: (-item[1][0], item[0]))
+        merged.counters = dict(kept[:merged.capacity])
+        return merged
+
+    def top(self, count=20):
+        '''Returns up to count HeavyHitters, biggest first'''
+        kept = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [HeavyHitter(ipaddress.ip_address(key), estimate, error)
+                for key, (estimate, error) in kept[:count]]
+
+    def to_bytes(self):
+        '''Serializes the sketch'''
+        parts = [struct.pack('!BHQH', SKETCH_FORMAT_VERSION, self.capacity, self.total,
+                             len(self.counters))]
+        for key in sorted(self.counters):
+            estimate, error = self.counters[key]
+            parts.append(struct.pack('!B', len(key)) + key + struct.pack('!QQ', estimate, error))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Deserializes a sketch from to_bytes(); empty data is an empty sketch'''
+        if not data:
+            return cls()
+
+        data = bytes(data)
+        version, capacity, total, entries = struct.unpack_from('!BHQH', data)
+        if version != SKETCH_FORMAT_VERSION:
+            raise ValueError("unknown heavy hitter sketch version %d" % version)
+
+        sketch = cls(capacity)
+        sketch.total = total
+        offset = struct.calcsize('!BHQH')
+        for _ in range(entries):
+            key_length = data[offset]
+            key = data[offset + 1:offset + 1 + key_length]
+            offset += 1 + key_length
+            sketch.counters[key] = struct.unpack_from('!QQ', data, offset)
+            offset += 16
+        return sketch
+
+class HyperLogLog(object):
+    '''HyperLogLog distinct counter over remote addresses. With 2**precision registers the
+    relative standard error is about 1.04/sqrt(2**precision), 2.3% at the default'''
+
+    def __init__(self, precision=11):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @staticmethod
+    def _hash(address):
+        return struct.unpack('!Q', hashlib.sha1(ipaddress.ip_address(address).packed).digest()[:8])[0]
+
+    def add(self, address):
+        '''Counts address'''
+        hashed = self._hash(address)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        '''Returns a counter of both counters' addresses'''
+        if other.precision != self.precision:
+            raise ValueError("can't merge HyperLogLogs of different precisions")
+
+        merged = HyperLogLog(self.precision)
+        merged.registers = bytearray(map(max, self.registers, other.registers))
+        return merged
+
+    def count(self):
+        '''Returns the estimated number of distinct addresses'''
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers * registers / sum(2.0 ** -rank for rank in self.registers)
+
+        # Small cardinalities are better served by linear counting; with 64 bit hashes
+        # there's no need for a large range correction
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * registers and zeros != 0:
+            estimate = registers * math.log(registers / zeros)
+        return int(round(estimate))
+
+    @property
+    def relative_error(self):
+        '''Relative standard error of count()'''
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def to_bytes(self):
+        '''Serializes the counter'''
+        return struct.pack('!BB', SKETCH_FORMAT_VERSION, self.precision) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        '''Deserializes a counter from to_bytes(); empty data is an empty counter'''
+        if not data:
+            return cls()
+
+        data = bytes(data)
+        version, precision = struct.unpack_from('!BB', data)
+        if version != SKETCH_FORMAT_VERSION:
+            raise ValueError("unknown HyperLogLog version %d" % version)
+
+        counter = cls(precision)
+        counter.registers = bytearray(data[2:])
+        return counter
+
+class HostTrafficSketch(object):
+    '''A machine's heavy hitters and distinct destinations over a day or more'''
+
+    def __init__(self, top_talkers=None, destinations=None):
+        self.top_talkers = top_talkers if top_talkers is not None else SpaceSaving()
+        self.destinations = destinations if destinations is not None else HyperLogLog()
+
+    def add(self, address, total_bytes):
+        '''Counts traffic to a remote address'''
+        self.top_talkers.offer(address, total_bytes)
+        self.destinations.add(address)
+
+    def merge(self, other):
+        '''Returns the sketch of both sketches' traffic'''
+        return HostTrafficSketch(self.top_talkers.merge(other.top_talkers),
+                                 self.destinations.merge(other.destinations))
+
+    def top(self, count=20):
+        '''The count remote hosts the machine sent and received the most bytes with'''
+        return self.top_talkers.top(count)
+
+    def distinct_destinations(self):
+        '''Estimated number of remote hosts the machine talked to'''
+        return self.destinations.count()
+
+def update_host_sketches(config, message_id, db_conn):
+    '''Folds the outbound traffic of a traffic report message into the daily sketches of
+    the machines involved'''
+
+    rows = config.database.run_procedure_fetchall(
+        "traffic_report.get_outbound_traffic_for_message", [message_id],
+        existing_db_conn=db_conn, tuple_cursor=True)
+    if len(rows) == 0:
+        return
+
+    traffic = collections.defaultdict(list)
+    for site_id, local_ip_id, day, global_ip, total_bytes in rows:
+        traffic[(site_id, day)].append((local_ip_id, global_ip, total_bytes))
+
+    for (site_id, day), flows in sorted(traffic.items()):
+        local_ip_ids = sorted(set(flow[0] for flow in flows))
+
+        # Locks the rows (creating empty ones as needed) so concurrent ingests of the same
+        # machine and day don't lose each other's updates
+        sketches = {}
+        for local_ip_id, top_talkers, destinations in config.database.run_procedure_fetchall(
+                "traffic_report.lock_host_sketches", [site_id, day, local_ip_ids],
+                existing_db_conn=db_conn, tuple_cursor=True):
+            sketches[local_ip_id] = HostTrafficSketch(
+                SpaceSaving.from_bytes(top_talkers), HyperLogLog.from_bytes(destinations))
+
+        for local_ip_id, global_ip, total_bytes in flows:
+            sketches[local_ip_id].add(global_ip, total_bytes)
+
+        for local_ip_id in local_ip_ids:
+            sketch = sketches[local_ip_id]
+            config.database.run_procedure(
+                "traffic_report.store_host_sketch",
+                [site_id, local_ip_id, day,
+                 sketch.top_talkers.to_bytes(), sketch.destinations.to_bytes()],
+                existing_db_conn=db_conn, tuple_cursor=True).close()
@@ -16,7 +16,6 @@
 
 '''Classes relating to management of data coming from SNORT'''
 
-import ipaddress
 import geoip2.database
 
 import ndr
@@ -48,19 +47,31 @@ class SnortTrafficLog(object):
         traffic_log.pg_id = log_id
 
         # Uploaded logs only have consolated traffic, and not the full traffic entries
-        for _, traffic_entry in ingest_log.consolated_traffic.items():
+        traffic_entries = list(ingest_log.consolated_traffic.values())
+
+        ip_addresses = config.dimensions.ip_addresses
+        mac_addresses = config.dimensions.mac_addresses
+        ip_ids = ip_addresses.resolve(
+            [entry.src for entry in traffic_entries] + [entry.dst for entry in traffic_entries],
+            db_conn)
+        mac_ids = mac_addresses.resolve(
+            [entry.ethsrc for entry in traffic_entries] +
+            [entry.ethdst for entry in traffic_entries], db_conn)
+
+        for traffic_entry in traffic_entries:
             config.database.run_procedure(
-                "snort.create_traffic_report",
+                "snort.insert_traffic_report",
                 [log_id,
-                 traffic_entry.src.compressed,
-                 traffic_entry.dst.compressed,
-                 traffic_entry.ethsrc,
-                 traffic_entry.ethdst,
+                 ip_addresses.lookup(ip_ids, traffic_entry.src),
+                 ip_addresses.lookup(ip_ids, traffic_entry.dst),
+                 mac_addresses.lookup(mac_ids, traffic_entry.ethsrc),
+                 mac_addresses.lookup(mac_ids, traffic_entry.ethdst),
                  traffic_entry.proto.value,
                  traffic_entry.rxpackets,
                  traffic_entry.txpackets,
                  traffic_entry.firstseen],
-                existing_db_conn=db_conn)
+                existing_db_conn=db_conn,
+                tuple_cursor=True).close()
 
         return traffic_log
 
@@ -73,7 +84,9 @@ class SnortTrafficReport(object):
         self.config = config
         self.organization = None
         self.site = None
-        self.traffic_dicts = None
+        self._traffic_dicts = None
+        self.traffic_columns = None
+        self.local_networks = None
         self.statistics_dicts = {}
         self.total_rxpackets = 0
         self.total_txpackets = 0
@@ -81,200 +94,87 @@ class SnortTrafficReport(object):
     @classmethod
     def pull_report_for_time_interval(cls, config, site, seconds_since, db_conn=None):
         '''Pulls the report based on time from the database'''
-
-        traffic_dict = config.database.run_procedure_fetchone(
-            "snort.report_traffic_for_site_within_timeperiod",
-            [site.pg_id,
-             seconds_since],
-            existing_db_conn=db_conn)[0]
+        # Imported here so numpy is only loaded by the tools reporting on SNORT traffic,
+        # not by every command importing ndr_server
+        from ndr_server.snort_columns import SnortTrafficColumns
 
         t_report = SnortTrafficReport(config)
         t_report.site = site
         t_report.organization = site.get_organization(db_conn=db_conn)
-        t_report.traffic_dicts = traffic_dict['consolidated_traffic']
+        t_report.local_networks = site.get_local_networks(db_conn=db_conn)
+
+        # Read in batches through a server side cursor, and straight into columns
+        batches = config.database.run_procedure_batches(
+            "snort.report_traffic_for_site_within_timeperiod",
+            [site.pg_id,
+             seconds_since],
+            existing_db_conn=db_conn,
+            tuple_cursor=True)
+        t_report.traffic_columns = SnortTrafficColumns(
+            row for batch in batches for row in batch)
 
         return t_report
 
-    def process_dicts(self):
-        '''Goes through the traffic report, and deletes local network traffic'''
-
-        new_traffic_dicts = []
-        geoip_db = geoip2.database.Reader(self.config.geoip_db)
-
-        # The traffic_dict can be empty if there's no traffic records for a given period
-        if self.traffic_dicts is None:
-            return False
-
-        # We'll simply copy over the information we want, and discard what we don't
-        for traffic_dict in self.traffic_dicts:
-            # Simple things first, we need to convert src/dst to ipaddress objects
-            traffic_dict['src'] = ipaddress.ip_address(traffic_dict['src'])
-            traffic_dict['dst'] = ipaddress.ip_address(traffic_dict['dst'])
-
-            # Global IP is what we'll run the GeoIP report on
-            global_ip = None
-
-            # We only care about a network if one address is global, and one end isn't
-            if (traffic_dict['src'].is_global is True and
-                    traffic_dict['dst'].is_global is False):
-                local_ip = traffic_dict['dst']
-                global_ip = traffic_dict['src']
-            elif (traffic_dict['dst'].is_global is True and
-                  traffic_dict['src'].is_global is False):
-                local_ip = traffic_dict['src']
-                global_ip = traffic_dict['dst']
-            else:
-                # Don't care about this IP
-                continue
-
-            # Make sure we're not dealing w/ a multicast address
-            if global_ip.is_multicast is True:
-                continue
+    @property
+    def traffic_dicts(self):
+        '''The report's traffic rows; when read from the database or once processed, these
+        are built from the columns on first use'''
+        if self._traffic_dicts is None and self.traffic_columns is not None:
+            self._traffic_dicts = self.traffic_columns.to_dicts()
+        return self._traffic_dicts
 
+    @traffic_dicts.setter
+    def traffic_dicts(self, traffic_dicts):
+        self._traffic_dicts = traffic_dicts
+        self.traffic_columns = None
+
+    def process_dicts(self):
+        '''Goes through the traffic report, and deletes local network traffic. Addresses in
+        the site's local networks are local, otherwise addresses are global if they're
+        publicly routable'''
+        # See pull_report_for_time_interval
+        from ndr_server.snort_columns import SnortTrafficColumns
+
+        # Reports built by hand only have dicts
+        traffic_columns = self.traffic_columns
+        if traffic_columns is None:
+            # The traffic_dict can be empty if there's no traffic records for a given period
+            if self._traffic_dicts is None:
+                return False
+            traffic_columns = SnortTrafficColumns.from_dicts(self._traffic_dicts)
+
+        # The index is mapped once per process and stays open. Imported here so only the
+        # tools reporting on SNORT traffic load numpy with it
+        if self.config.geoip_index is not None:
+            from ndr_server.geoip_index import GeoIPRangeIndex
+            geoip_index = GeoIPRangeIndex.open(self.config.geoip_index)
+            traffic_columns.process(geoip_index, self.local_networks)
+        else:
+            geoip_db = geoip2.database.Reader(self.config.geoip_db)
             try:
-                # Run the IP through the database and see what we get
-                geoip_entry = geoip_db.city(global_ip.compressed)
-                traffic_dict['country'] = geoip_entry.country.name
-                traffic_dict['subdivision'] = geoip_entry.subdivisions.most_specific.name
-                traffic_dict['city'] = geoip_entry.city.name
-                traffic_dict['geoip_found'] = True
-                traffic_dict['global_ip'] = global_ip
-                traffic_dict['local_ip'] = local_ip
-                new_traffic_dicts.append(traffic_dict)
-            except geoip2.errors.AddressNotFoundError:
-                # List it as unknown
-                traffic_dict['country'] = "Unknown"
-                traffic_dict['subdivision'] = None
-                traffic_dict['city'] = "Unknown"
-                new_traffic_dicts.append(traffic_dict)
-
-        # And clean up after ourselves
-        self.traffic_dicts = new_traffic_dicts
-        geoip_db.close()
+                traffic_columns.process(geoip_db, self.local_networks)
+            finally:
+                geoip_db.close()
+
+        # The dicts are only rebuilt if someone asks for them
+        self._traffic_dicts = None
+        self.traffic_columns = traffic_columns
 
         # Confirm we ran successfully
         return True
 
     def breakdown_traffic_by_internal_ip(self):
         '''Breaks down traffic by machine and destination'''
-
-        local_machine_dict = {}
-
-        for traffic_dict in self.traffic_dicts:
-            # Skip rows we're not interested in
-            if traffic_dict.get('geoip_found', False) is False:
-                continue
-
-            country_stats_dict_key = traffic_dict['country']
-            local_ip = traffic_dict['local_ip']
-
-            # Create the local_machine dict if we don't have it
-            if traffic_dict['local_ip'] not in local_machine_dict:
-                local_machine_dict[local_ip] = {}
-                local_machine_dict[local_ip]['country'] = {}
-
-            this_machine = local_machine_dict[local_ip]
-
-            if country_stats_dict_key not in this_machine['country']:
-                this_machine['country'][country_stats_dict_key] = {}
-                this_machine['country'][country_stats_dict_key]['rxpackets'] = 0
-                this_machine['country'][country_stats_dict_key]['txpackets'] = 0
-                this_machine['country'][country_stats_dict_key]['remote_ips'] = set()
-
-            this_country = this_machine['country'][country_stats_dict_key]
-            this_country['rxpackets'] += traffic_dict['rxpackets']
-            this_country['txpackets'] += traffic_dict['txpackets']
-            this_country['remote_ips'].add(traffic_dict['global_ip'].compressed)
-
-        return local_machine_dict
+        return self.traffic_columns.breakdown_by_local_ip()
 
     def generate_statistics(self):
         '''Works out the number of unique destinations, the total packet counts, and breakdown
         of percentages'''
 
-        total_rxpackets = 0
-        total_txpackets = 0
-
-        # We'll break traffic down by country, and subdivision, which acts as the primary key
-        statistics_dict = {}
-
-        for traffic_dict in self.traffic_dicts:
-            country_stats_dict_key = traffic_dict['country']
-
-            # Create the dict if it doesn't exist
-            if country_stats_dict_key not in statistics_dict:
-                statistics_dict[country_stats_dict_key] = {}
-                statistics_dict[country_stats_dict_key]['subdivisions'] = {}
-                statistics_dict[country_stats_dict_key]['rxpackets'] = 0
-                statistics_dict[country_stats_dict_key]['txpackets'] = 0
-
-            country_dict = statistics_dict[country_stats_dict_key]
-            subdivision_dict = None
-
-            # If we have a subdivision, add that too
-            if traffic_dict['subdivision'] is not None:
-                subdivision_key = traffic_dict['subdivision']
-
-                if subdivision_key not in country_dict:
-                    country_dict['subdivisions'][subdivision_key] = {}
-                    country_dict['subdivisions'][subdivision_key]['rxpackets'] = 0
-                    country_dict['subdivisions'][subdivision_key]['txpackets'] = 0
-
-                # Set the subdivision dict
-                subdivision_dict = country_dict['subdivisions'][subdivision_key]
-
-            # Get a running total of the packet counts
-
-            # First, add the packet counts to the total
-            total_rxpackets += traffic_dict['rxpackets']
-            total_txpackets += traffic_dict['txpackets']
-
-            # Now to the country, add them there
-            country_dict['rxpackets'] += traffic_dict['rxpackets']
-            country_dict['txpackets'] += traffic_dict['txpackets']
-
-            # and to the subdivision if we have one
-            if subdivision_dict is not None:
-                subdivision_dict['rxpackets'] += traffic_dict['rxpackets']
-                subdivision_dict['txpackets'] += traffic_dict['txpackets']
-
-        # Now work out the percentages per target
-        for _, country_entry in statistics_dict.items():
-            try:
-                country_entry['transmit_percentage'] = (
-                    "{0:.2f}".format(
-                        ((country_entry['txpackets'] / total_txpackets) * 100))
-                )
-                country_entry['receive_percentage'] = (
-                    "{0:.2f}".format(
-                        ((country_entry['rxpackets'] / total_rxpackets) * 100))
-                )
-            except ZeroDivisionError:
-                # If we divide by zero, catch it and handle it
-                country_entry['transmit_percentage'] = "{0:.2f}".format(0)
-                country_entry['receive_percentage'] = "{0:.2f}".format(0)
-                
-            # If we have a subdivision, let's do for them, based on these percentages
-            for _, subdivision_entry in country_entry['subdivisions'].items():
-                try:
-                    subdivision_entry['transmit_percentage'] = (
-                        "{0:.2f}".format(
-                            ((subdivision_entry['txpackets'] / country_entry['txpackets']) * 100))
-                    )
-                    subdivision_entry['receive_percentage'] = (
-                        "{0:.2f}".format(
-                            ((subdivision_entry['rxpackets'] / country_entry['rxpackets']) * 100))
-                    )
-                except ZeroDivisionError:
-                    # It's possible to get a divide by zero here if we've only transmitted or sent
-                    # Zero out the subdivision percentages if that happen
-                    subdivision_entry['transmit_percentage'] = "{0:.2f}".format(0)
-                    subdivision_entry['receive_percentage'] = "{0:.2f}".format(0)
-
         # Save the results to the object
-        self.statistics_dicts = statistics_dict
-        self.total_rxpackets = total_rxpackets
-        self.total_txpackets = total_txpackets
+        (self.statistics_dicts,
+         self.total_rxpackets,
+         self.total_txpackets) = self.traffic_columns.statistics()
 
     def generate_report_emails(self, send=True, db_conn=None):
         '''Generates a report email breaking down traffic by country destination'''
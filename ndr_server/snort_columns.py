@@ -0,0 +1,341 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Column-wise aggregation of consolidated SNORT traffic'''
+
+import array
+import ipaddress
+
+import numpy
+import geoip2.errors
+
+from ndr_server.geoip_index import GeoIPRangeIndex
+
+# Networks that ipaddress' is_global is False for. IPv4 mapped IPv6 addresses are classified
+# by their IPv4 address, as newer Pythons do
+NON_GLOBAL_NETWORKS = [ipaddress.ip_network(network) for network in (
+    '0.0.0.0/8', '10.0.0.0/8', '100.64.0.0/10', '127.0.0.0/8', '169.254.0.0/16',
+    '172.16.0.0/12', '192.0.0.0/29', '192.0.0.170/31', '192.0.2.0/24', '192.168.0.0/16',
+    '198.18.0.0/15', '198.51.100.0/24', '203.0.113.0/24', '240.0.0.0/4', '255.255.255.255/32',
+    '::1/128', '::/128', '100::/64', '2001::/23', '2001:2::/48',
+    '2001:db8::/32', '2001:10::/28', 'fc00::/7', 'fe80::/10'
+)]
+
+MULTICAST_NETWORKS = [ipaddress.ip_network('224.0.0.0/4'), ipaddress.ip_network('ff00::/8')]
+
+MASK_64 = (1 << 64) - 1
+
+class PackedAddresses(object):
+    '''A list of addresses packed into numpy arrays; IPv6 addresses are split into their high
+    and low 64 bits, IPv4 (and IPv4 mapped) addresses live in the low bits with is_v4 set'''
+
+    __slots__ = ('is_v4', 'high', 'low')
+
+    def __init__(self, addresses):
+        count = len(addresses)
+        addresses = [address.ipv4_mapped if address.version == 6 and address.ipv4_mapped else address
+                     for address in addresses]
+        self.is_v4 = numpy.fromiter((address.version == 4 for address in addresses),
+                                    dtype=bool, count=count)
+        integers = [int(address) for address in addresses]
+        self.high = numpy.fromiter((integer >> 64 for integer in integers),
+                                   dtype=numpy.uint64, count=count)
+        self.low = numpy.fromiter((integer & MASK_64 for integer in integers),
+                                  dtype=numpy.uint64, count=count)
+
+    def in_networks(self, networks):
+        '''Returns a boolean array of which addresses are in any of the networks'''
+        matches = numpy.zeros(len(self.is_v4), dtype=bool)
+        for network in networks:
+            network_address = int(network.network_address)
+            netmask = int(network.netmask)
+            in_network = ((self.high & numpy.uint64(netmask >> 64)) == numpy.uint64(network_address >> 64)) & \
+                ((self.low & numpy.uint64(netmask & MASK_64)) == numpy.uint64(network_address & MASK_64))
+            if network.version == 4:
+                in_network &= self.is_v4
+            else:
+                in_network &= ~self.is_v4
+            matches |= in_network
+        return matches
+
+def group_sums(keys, *values):
+    '''Sort-based group by; returns the unique keys and the per key sums of each values array'''
+    if len(keys) == 0:
+        return keys, [value[:0] for value in values]
+
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    return sorted_keys[starts], [numpy.add.reduceat(value[order], starts) for value in values]
+
+def percentage_strings(part_tx, whole_tx, part_rx, whole_rx):
+    '''Formats transmit and receive percentages, both zeroed if either can't be worked out'''
+    try:
+        return ("{0:.2f}".format((part_tx / whole_tx) * 100),
+                "{0:.2f}".format((part_rx / whole_rx) * 100))
+    except ZeroDivisionError:
+        return ("{0:.2f}".format(0), "{0:.2f}".format(0))
+
+class SnortTrafficColumns(object):
+    '''The consolidated traffic of a SNORT report as columns: each row's source and
+    destination are codes into a table of unique addresses, which are parsed, classified and
+    looked up in GeoIP once each, and the group-bys are numpy sorts and reductions'''
+
+    def __init__(self, traffic_rows):
+        '''Builds the columns from (src, dst, rxpackets, txpackets) rows, which are only
+        iterated once so they can come straight off a cursor'''
+
+        # Codes are handed out in first seen order
+        codes = {}
+        src = array.array('q')
+        dst = array.array('q')
+        rxpackets = array.array('q')
+        txpackets = array.array('q')
+        for row_src, row_dst, row_rxpackets, row_txpackets in traffic_rows:
+            src.append(codes.setdefault(row_src, len(codes)))
+            dst.append(codes.setdefault(row_dst, len(codes)))
+            rxpackets.append(row_rxpackets)
+            txpackets.append(row_txpackets)
+
+        self.src = numpy.array(src, dtype=numpy.int64)
+        self.dst = numpy.array(dst, dtype=numpy.int64)
+        self.rxpackets = numpy.array(rxpackets, dtype=numpy.int64)
+        self.txpackets = numpy.array(txpackets, dtype=numpy.int64)
+
+        self.address_texts = [None] * len(codes)
+        for text, code in codes.items():
+            self.address_texts[code] = text
+        self.addresses = [ipaddress.ip_address(text) for text in self.address_texts]
+
+        self.packed = PackedAddresses(self.addresses)
+        self.address_is_global = ~self.packed.in_networks(NON_GLOBAL_NETWORKS)
+        self.address_is_multicast = self.packed.in_networks(MULTICAST_NETWORKS)
+
+        # Filled in by process()
+        self.rows = None
+        self.local_ip = None
+        self.global_ip = None
+        self.countries = []
+        self.subdivisions = []
+        self.subdivision_countries = []
+        self.address_geoip = {}
+        self.country = None
+        self.subdivision = None
+        self.geoip_found = None
+
+    def process(self, geoip_db, local_networks=None):
+        '''Keeps rows with exactly one global, non multicast, end and looks up the GeoIP
+        information of their global addresses, from a geoip2 Reader or GeoIPRangeIndex.
+        Addresses in local_networks (a LocalNetworkIndex) are the site's own, even if
+        they're globally routable'''
+        address_is_global = self.address_is_global
+        if local_networks is not None and len(local_networks) != 0:
+            address_is_local = numpy.fromiter(
+                (local_networks.contains(address) for address in self.addresses),
+                dtype=bool, count=len(self.addresses))
+            address_is_global = address_is_global & ~address_is_local
+
+        src_global = address_is_global[self.src]
+        dst_global = address_is_global[self.dst]
+
+        global_ip = numpy.where(src_global, self.src, self.dst)
+        keep = (src_global != dst_global) & ~self.address_is_multicast[global_ip]
+
+        self.rows = numpy.flatnonzero(keep)
+        self.global_ip = global_ip[keep]
+        self.local_ip = numpy.where(src_global, self.dst, self.src)[keep]
+        self.rxpackets = self.rxpackets[keep]
+        self.txpackets = self.txpackets[keep]
+
+        # Countries and subdivisions become codes too; subdivision -1 is None
+        country_codes = {}
+        subdivision_codes = {}
+        lookups = numpy.unique(self.global_ip)
+        address_country = numpy.zeros(len(self.addresses), dtype=numpy.int64)
+        address_subdivision = numpy.full(len(self.addresses), -1, dtype=numpy.int64)
+        address_found = numpy.zeros(len(self.addresses), dtype=bool)
+
+        for address_code, geoip_info in zip(lookups.tolist(), self._lookup(geoip_db, lookups)):
+            if geoip_info is not None:
+                country, subdivision, city = geoip_info
+                address_found[address_code] = True
+            else:
+                country = "Unknown"
+                subdivision = None
+                city = "Unknown"
+
+            self.address_geoip[address_code] = (country, subdivision, city)
+            address_country[address_code] = country_codes.setdefault(country, len(country_codes))
+            if subdivision is not None:
+                address_subdivision[address_code] = subdivision_codes.setdefault(
+                    (country, subdivision), len(subdivision_codes))
+
+        self.countries = [None] * len(country_codes)
+        for country, code in country_codes.items():
+            self.countries[code] = country
+        self.subdivisions = [None] * len(subdivision_codes)
+        self.subdivision_countries = [None] * len(subdivision_codes)
+        for (country, subdivision), code in subdivision_codes.items():
+            self.subdivisions[code] = subdivision
+            self.subdivision_countries[code] = country
+
+        self.country = address_country[self.global_ip]
+        self.subdivision = address_subdivision[self.global_ip]
+        self.geoip_found = address_found[self.global_ip]
+
+    def _lookup(self, geoip_db, address_codes):
+        '''Returns the (country, subdivision, city) of each address, None for those the
+        database doesn't have. geoip_db is a geoip2 Reader, or a GeoIPRangeIndex which
+        looks them all up at once'''
+        if isinstance(geoip_db, GeoIPRangeIndex):
+            info_ids = geoip_db.lookup_packed(self.packed.is_v4[address_codes],
+                                              self.packed.high[address_codes],
+                                              self.packed.low[address_codes])
+            return [geoip_db.info(info_id) if info_id >= 0 else None
+                    for info_id in info_ids.tolist()]
+
+        geoip_infos = []
+        for address_code in address_codes.tolist():
+            try:
+                geoip_entry = geoip_db.city(self.addresses[address_code].compressed)
+                geoip_infos.append((geoip_entry.country.name,
+                                    geoip_entry.subdivisions.most_specific.name,
+                                    geoip_entry.city.name))
+            except geoip2.errors.AddressNotFoundError:
+                geoip_infos.append(None)
+        return geoip_infos
+
+    @classmethod
+    def from_dicts(cls, traffic_dicts):
+        '''Builds the columns from traffic dicts'''
+        return cls((row['src'], row['dst'], row['rxpackets'], row['txpackets'])
+                   for row in traffic_dicts)
+
+    def __len__(self):
+        return len(self.src)
+
+    def to_dicts(self):
+        '''Returns the rows as traffic dicts; once processed, only the kept rows, filled in
+        as SnortTrafficReport's were'''
+        if self.rows is None:
+            return [{'src': self.address_texts[src],
+                     'dst': self.address_texts[dst],
+                     'rxpackets': rxpackets,
+                     'txpackets': txpackets}
+                    for src, dst, rxpackets, txpackets in zip(
+                        self.src.tolist(), self.dst.tolist(),
+                        self.rxpackets.tolist(), self.txpackets.tolist())]
+
+        traffic_dicts = []
+        for src, dst, rxpackets, txpackets, local_ip, global_ip, found in zip(
+                self.src[self.rows].tolist(), self.dst[self.rows].tolist(),
+                self.rxpackets.tolist(), self.txpackets.tolist(), self.local_ip.tolist(),
+                self.global_ip.tolist(), self.geoip_found.tolist()):
+            traffic_dict = {
+                'src': self.addresses[src],
+                'dst': self.addresses[dst],
+                'rxpackets': rxpackets,
+                'txpackets': txpackets
+            }
+            (traffic_dict['country'],
+             traffic_dict['subdivision'],
+             traffic_dict['city']) = self.address_geoip[global_ip]
+            if found is True:
+                traffic_dict['geoip_found'] = True
+                traffic_dict['global_ip'] = self.addresses[global_ip]
+                traffic_dict['local_ip'] = self.addresses[local_ip]
+            traffic_dicts.append(traffic_dict)
+
+        return traffic_dicts
+
+    def statistics(self):
+        '''Returns the per country and subdivision statistics dict, and the rx and tx totals'''
+        total_rxpackets = int(self.rxpackets.sum())
+        total_txpackets = int(self.txpackets.sum())
+
+        statistics_dict = {}
+        countries, (country_rx, country_tx) = group_sums(
+            self.country, self.rxpackets, self.txpackets)
+        for country, rxpackets, txpackets in zip(countries.tolist(), country_rx.tolist(),
+                                                 country_tx.tolist()):
+            country_entry = {
+                'subdivisions': {},
+                'rxpackets': rxpackets,
+                'txpackets': txpackets
+            }
+            (country_entry['transmit_percentage'],
+             country_entry['receive_percentage']) = percentage_strings(
+                 txpackets, total_txpackets, rxpackets, total_rxpackets)
+            statistics_dict[self.countries[country]] = country_entry
+
+        has_subdivision = self.subdivision != -1
+        subdivisions, (subdivision_rx, subdivision_tx) = group_sums(
+            self.subdivision[has_subdivision],
+            self.rxpackets[has_subdivision], self.txpackets[has_subdivision])
+
+        for subdivision, rxpackets, txpackets in zip(
+                subdivisions.tolist(), subdivision_rx.tolist(), subdivision_tx.tolist()):
+            country_entry = statistics_dict[self.subdivision_countries[subdivision]]
+            subdivision_entry = {
+                'rxpackets': rxpackets,
+                'txpackets': txpackets
+            }
+            (subdivision_entry['transmit_percentage'],
+             subdivision_entry['receive_percentage']) = percentage_strings(
+                 txpackets, country_entry['txpackets'], rxpackets, country_entry['rxpackets'])
+            country_entry['subdivisions'][self.subdivisions[subdivision]] = subdivision_entry
+
+        return statistics_dict, total_rxpackets, total_txpackets
+
+    def breakdown_by_local_ip(self):
+        '''Returns the packet counts and remote IPs of each machine per country, for rows
+        with GeoIP information'''
+        found = self.geoip_found
+        local_ip = self.local_ip[found]
+        country = self.country[found]
+        global_ip = self.global_ip[found]
+
+        # One key per (machine, country)
+        keys = local_ip * max(len(self.countries), 1) + country
+        groups, (group_rx, group_tx) = group_sums(keys, self.rxpackets[found], self.txpackets[found])
+
+        local_machine_dict = {}
+        for key, rxpackets, txpackets in zip(groups.tolist(), group_rx.tolist(), group_tx.tolist()):
+            machine, country_code = divmod(key, max(len(self.countries), 1))
+            this_machine = local_machine_dict.setdefault(self.addresses[machine], {'country': {}})
+            this_machine['country'][self.countries[country_code]] = {
+                'rxpackets': rxpackets,
+                'txpackets': txpackets,
+                'remote_ips': set()
+            }
+
+        # Unique (machine, country, remote address) triples, as one key; sorted, so each
+        # group's remote addresses are one slice
+        if len(keys) != 0:
+            triples = numpy.unique(keys * len(self.addresses) + global_ip)
+            triple_groups, remotes = numpy.divmod(triples, len(self.addresses))
+            starts = numpy.flatnonzero(
+                numpy.concatenate(([True], triple_groups[1:] != triple_groups[:-1])))
+            ends = numpy.concatenate((starts[1:], [len(triples)]))
+
+            compressed = numpy.array([address.compressed for address in self.addresses],
+                                     dtype=object)
+            for key, start, end in zip(triple_groups[starts].tolist(), starts.tolist(),
+                                       ends.tolist()):
+                machine, country_code = divmod(key, max(len(self.countries), 1))
+                local_machine_dict[self.addresses[machine]]['country'][
+                    self.countries[country_code]]['remote_ips'].update(compressed[remotes[start:end]])
+
+        return local_machine_dict
@@ -21,9 +21,8 @@ import datetime
 import string
 import pytz
 
-from terminaltables import AsciiTable
-
 import ndr_server
+from ndr_server.text_table import TextTable
 
 # pylint: disable=line-too-long
 
@@ -234,7 +233,8 @@ $country_breakdown
             else:
                 tx_entry_dict[values['transmit_percentage']] = table_entry
 
-        for key in sorted(tx_entry_dict.keys(), reverse=True):
+        # The percentages are formatted strings, so sort them as numbers
+        for key in sorted(tx_entry_dict.keys(), key=float, reverse=True):
             table_data += tx_entry_dict[key]
 
         # Add a final line with the total
@@ -250,7 +250,7 @@ $country_breakdown
         table_data.append(total)
 
         # Now generate a pretty table and return it
-        table = AsciiTable(table_data)
+        table = TextTable(table_data)
         return table.table
 
     def replace_tokens(self, text):
@@ -272,15 +272,21 @@ class TsharkTrafficReportMessage(BaseTemplate):
                  end_period: datetime.datetime,
                  nss_config,
                  db_conn=None,
-                 csv_output=False):
+                 csv_output=False,
+                 snapshot=None):
         BaseTemplate.__init__(self, organization, site, None, None)
         self.config = nss_config
         self.traffic_report = traffic_report
         self.start_period = start_period
         self.end_period = end_period
         self.db_conn = db_conn
+
+        # Messages for the same site and period can share a snapshot so the data is only
+        # queried and rendered once
+        if snapshot is None:
+            snapshot = traffic_report.snapshot(start_period, end_period, db_conn)
+        self.snapshot = snapshot
         self.csv_output = csv_output
-        self.csv_output_text = None
         self.subject_text = "Daily Traffic Report (v2) For Site $site_name"
         self.message = '''This is a snapshot of internet traffic broken down by destination IP broken down by country, and regional subdivisions for the last 24 hours.
 
@@ -323,18 +329,27 @@ $hostname_table
     def generate_country_breakdown(self):
         '''Generates a breakdown of the traffic'''
 
-        # Grab the general geoip summary and do some preprocessing on it
-        traffic_report = self.traffic_report.retrieve_geoip_breakdown(self.start_period,
-                                                                      self.end_period,
-                                                                      self.db_conn)
-
-        return ndr_server.TsharkTrafficReportManager.generate_table_of_geoip_breakdown(traffic_report, self.csv_output)
+        return self.snapshot.render(
+            ('country_breakdown', self.csv_output),
+            lambda: ndr_server.TsharkTrafficReportManager.generate_table_of_geoip_breakdown(
+                self.snapshot.geoip_breakdown, self.csv_output,
+                max_cell_width=self.config.report_table_max_cell_width))
 
     def generate_machine_breakdown(self):
+        '''Generates the per machine breakdown of the traffic'''
+
+        return self.snapshot.render(('machine_breakdown', self.csv_output),
+                                    self.render_machine_breakdown)
+
+    def render_machine_breakdown(self):
+        '''Renders the per machine breakdown; use generate_machine_breakdown()'''
+        return "".join(self.iter_machine_breakdown())
+
+    def iter_machine_breakdown(self):
+        '''Yields the per machine breakdown one machine at a time'''
+
         # Grab the general geoip summary and do some preprocessing on it
-        traffic_report = self.traffic_report.retrieve_geoip_by_local_ip_breakdown(self.start_period,
-                                                                                  self.end_period,
-                                                                                  self.db_conn)
+        traffic_report = self.snapshot.local_ip_breakdown
 
         # Sort the traffic reports by machine, then generate a seperate table for each
         machine_dict = dict()
@@ -345,9 +360,7 @@ $hostname_table
             machine_dict[report.local_ip].append(report)
 
         # Now we do it for hostnames
-        hostname_report = self.traffic_report.retrieve_internet_host_breakdown(self.start_period,
-                                                                               self.end_period,
-                                                                               self.db_conn)
+        hostname_report = self.snapshot.internet_host_breakdown
 
         # Break this into IPs again, and build the report
         hostname_dict = dict()
@@ -357,8 +370,6 @@ $hostname_table
 
             hostname_dict[report.local_ip].append(report)
 
-        machine_text = ""
-
         if self.csv_output is True:
             machine_output = self.machine_breakdown_csv
         else:
@@ -369,45 +380,38 @@ $hostname_table
             machine_template = string.Template(machine_output)
 
             # See if we have a human name for this
-            bh_hosts = ndr_server.BaselineHost.find_all_by_most_recent_ip(
-                self.config,
-                self.site,
-                machine.compressed,
-                self.db_conn)
-
             machine_name = ""
-            if len(bh_hosts) != 0:
-                # Either got zero or more than one response.
-                # FIXME - we don't handle multiple responses right so this needs a rethink
-                bh_host = bh_hosts.pop()
-                if bh_host.human_name is not None:
-                    machine_name = "(" + bh_host.human_name + ")"
-
-            machine_text += machine_template.substitute(
+            if machine in self.snapshot.machine_names:
+                machine_name = "(" + self.snapshot.machine_names[machine] + ")"
+
+            yield machine_template.substitute(
                 ip_address=machine,
                 host_name=machine_name,
                 geoip_table=ndr_server.TsharkTrafficReportManager.generate_table_of_geoip_breakdown(
-                    machine_dict[machine], self.csv_output
+                    machine_dict[machine], self.csv_output,
+                    max_cell_width=self.config.report_table_max_cell_width
                 ),
                 hostname_table=ndr_server.TsharkTrafficReportManager.generate_table_internet_host_traffic(
-                    hostname_dict[machine], self.csv_output
+                    hostname_dict[machine], self.csv_output, top=self.config.report_internet_host_limit,
+                    max_cell_width=self.config.report_table_max_cell_width
                 )
             )
 
-        return machine_text
+    def write_csv_breakdown(self, output):
+        '''Writes the CSV attachment to the text file output a section at a time, so the whole
+        breakdown never has to be held in memory'''
+        output.write(self.generate_country_breakdown())
+        for machine_text in self.iter_machine_breakdown():
+            output.write(machine_text)
 
     def replace_tokens(self, text):
         '''Does additional token replacement for unknown machines'''
 
         if self.csv_output is True:
+            # The breakdown itself goes in the attachment, see write_csv_breakdown()
             self.message = self.message_csv
             base_template = string.Template(text)
 
-            # Generate the CSV breakdown
-            csv_breakdown = self.generate_country_breakdown() + self.generate_machine_breakdown()
-
-            self.csv_output_text = csv_breakdown
-
             return base_template.substitute(
                 org_name=self.organization.name,
                 site_name=self.site.name,
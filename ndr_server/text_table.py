@@ -0,0 +1,88 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Plain text tables for report emails'''
+
+class TextTable(object):
+    '''Renders rows the way terminaltables' AsciiTable does, with the first row as the
+    heading. Cells are converted with str() once, column widths are worked out in that same
+    pass, and each row is then formatted straight into a list of lines.
+
+    Unlike AsciiTable, newlines in cells are flattened to spaces and widths are counted in
+    characters (not terminal columns). max_rows limits the rows shown under the heading,
+    noting how many were left out, and max_cell_width truncates long cells.'''
+
+    __slots__ = ('rows', 'widths', 'hidden_rows')
+
+    def __init__(self, table_data, max_rows=None, max_cell_width=None):
+        rows = []
+        widths = []
+        self.hidden_rows = 0
+
+        for row_number, row in enumerate(table_data):
+            if max_rows is not None and row_number > max_rows:
+                self.hidden_rows += 1
+                continue
+
+            cells = [self.cell_text(cell, max_cell_width) for cell in row]
+            for column, cell in enumerate(cells):
+                if column == len(widths):
+                    widths.append(len(cell))
+                elif len(cell) > widths[column]:
+                    widths[column] = len(cell)
+            rows.append(cells)
+
+        if self.hidden_rows != 0:
+            note = "... %d more rows" % self.hidden_rows
+            if len(widths) == 0:
+                widths.append(len(note))
+            elif len(note) > widths[0]:
+                widths[0] = len(note)
+            rows.append([note])
+
+        self.rows = rows
+        self.widths = widths
+
+    @staticmethod
+    def cell_text(cell, max_cell_width=None):
+        '''Returns the text of a cell on a single line, truncated to max_cell_width'''
+        text = str(cell)
+        if '\n' in text or '\r' in text:
+            text = ' '.join(text.splitlines())
+        if max_cell_width is not None and len(text) > max_cell_width:
+            text = text[:max(max_cell_width - 3, 0)] + "..."
+        return text
+
+    def lines(self):
+        '''Returns the rendered table as a list of lines'''
+        border = "+" + "+".join(["-" * (width + 2) for width in self.widths]) + "+"
+        row_format = "|" + "|".join([" {:<%d} " % width for width in self.widths]) + "|"
+        empty_row = [""] * len(self.widths)
+
+        lines = [border]
+        for row_number, row in enumerate(self.rows):
+            if len(row) < len(empty_row):
+                row = row + empty_row[len(row):]
+            lines.append(row_format.format(*row))
+            if row_number == 0 and len(self.rows) > 1:
+                lines.append(border)
+        lines.append(border)
+
+        return lines
+
+    @property
+    def table(self):
+        '''The rendered table, like AsciiTable.table'''
+        return "\n".join(self.lines())
@@ -0,0 +1,57 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Compiles the configured GeoIP database into the range index reports look up against.
+Meant to be run whenever the GeoIP database is updated'''
+
+import argparse
+import logging
+import time
+
+import ndr_server
+from ndr_server.geoip_index import build_index
+
+def main():
+    '''Main function for building the GeoIP index'''
+
+    # Do our basic setup work
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger(name=__name__)
+    logger.setLevel(logging.DEBUG)
+
+    parser = argparse.ArgumentParser(
+        description="Compile the GeoIP database into a memory mapped range index")
+    parser.add_argument('-s', '--server-config',
+                        default='/etc/ndr/ndr_server.yml',
+                        help='NDR Server Configuration File')
+    parser.add_argument('-d', '--database',
+                        help='GeoIP2 City database to compile (default: geoip_database)')
+    parser.add_argument('-o', '--output',
+                        help='Index file to write (default: geoip_index)')
+    args = parser.parse_args()
+
+    nsc = ndr_server.Config(logger, args.server_config)
+    database = args.database or nsc.geoip_db
+    output = args.output or nsc.geoip_index
+    if output is None:
+        parser.error("geoip_index isn't set in the configuration; pass --output")
+
+    started = time.perf_counter()
+    v4_ranges, v6_ranges = build_index(database, output)
+    nsc.logger.info("Wrote %s from %s: %d IPv4 and %d IPv6 ranges in %.1f seconds",
+                    output, database, v4_ranges, v6_ranges, time.perf_counter() - started)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Exports a site's traffic reports or syslog entries over a time range to Parquet (or
+compressed NumPy chunks) for offline analysis. With --incremental, each run picks up where
+the last one in the same output directory stopped'''
+
+import argparse
+import datetime
+import logging
+import os
+
+import ndr_server
+from ndr_server.export import EXPORT_DATASETS, ExportWatermark, export_dataset
+
+def parse_timestamp(value):
+    '''Accepts YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'''
+    for timestamp_format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, timestamp_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError("can't parse timestamp %s" % value)
+
+def main():
+    '''Main function for exporting data'''
+
+    # Do our basic setup work
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger(name=__name__)
+    logger.setLevel(logging.DEBUG)
+
+    parser = argparse.ArgumentParser(
+        description="Export a site's traffic reports or syslog entries to columnar files")
+    parser.add_argument('-s', '--server-config',
+                        default='/etc/ndr/ndr_server.yml',
+                        help='NDR Server Configuration File')
+    parser.add_argument('site', help='Site ID or name')
+    parser.add_argument('-d', '--dataset', choices=sorted(EXPORT_DATASETS), default='traffic',
+                        help='What to export')
+    parser.add_argument('-o', '--output', default='.',
+                        help='Directory to write the files (and watermarks) to')
+    parser.add_argument('--start', type=parse_timestamp,
+                        help='Export rows received after this (UTC)')
+    parser.add_argument('--end', type=parse_timestamp,
+                        help='Export rows received before this (UTC)')
+    parser.add_argument('--format', choices=['auto', 'parquet', 'npz'], default='auto',
+                        help='Parquet needs pyarrow; auto falls back to .npz chunks without it')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Start after the newest row of the previous incremental export')
+    parser.add_argument('--settle', type=int, default=300,
+                        help='Skip rows received in the last this many seconds, which may '
+                             'still have late rows committing around them')
+    parser.add_argument('-b', '--batch-size', type=int,
+                        help='Rows fetched and written at a time')
+    args = parser.parse_args()
+
+    nsc = ndr_server.Config(logger, args.server_config)
+    os.makedirs(args.output, exist_ok=True)
+    watermark = ExportWatermark(os.path.join(args.output, "watermarks.json"))
+
+    db_conn = nsc.database.get_connection(read_only=True)
+    try:
+        if args.site.isdigit():
+            site = ndr_server.Site.read_by_id(nsc, int(args.site), db_conn=db_conn)
+        else:
+            site = ndr_server.Site.read_by_name(nsc, args.site, db_conn=db_conn)
+
+        after = args.start
+        if args.incremental:
+            previous = watermark.get(site.pg_id, args.dataset)
+            if previous is not None and (after is None or previous > after):
+                after = previous
+
+        nsc.logger.info("Exporting %s of %s received after %s", args.dataset, site.name,
+                        after if after is not None else "the beginning")
+        result = export_dataset(nsc, site, args.dataset, args.output, db_conn,
+                                after=after, before=args.end, output_format=args.format,
+                                settle_seconds=args.settle, batch_size=args.batch_size)
+        db_conn.commit()
+
+        # Only move the watermark once every file is complete
+        if args.incremental and result.last_received_at is not None:
+            watermark.set(site.pg_id, args.dataset, result.last_received_at)
+
+        nsc.logger.info("Exported %d rows to %d files", result.rows, len(result.files))
+        for filename in result.files:
+            print(filename)
+    finally:
+        nsc.database.return_connection(db_conn)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Refreshes the GeoIP information of outbound traffic after the GeoIP databases are
+updated. Global addresses whose flows were enriched with another database version are
+walked in ID order and re-enriched a chunk at a time, each chunk in its own transaction, so
+the job can be paused, throttled and resumed'''
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+import psycopg2.extensions
+
+import ndr_server
+
+def load_checkpoint(filename, versions):
+    '''Returns the last address ID done and the running totals. A checkpoint taken against
+    other database versions is started over'''
+    checkpoint = {'versions': versions, 'last_ip_address_id': 0, 'addresses': 0, 'flows': 0}
+    if filename is not None and os.path.exists(filename):
+        with open(filename, 'r') as checkpoint_file:
+            saved = json.load(checkpoint_file)
+        if saved['versions'] == versions:
+            checkpoint = saved
+
+    return checkpoint
+
+def write_checkpoint(filename, checkpoint):
+    '''Atomically writes the checkpoint out'''
+    directory = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, temp_name = tempfile.mkstemp(dir=directory, prefix=".checkpoint")
+    with os.fdopen(file_descriptor, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.rename(temp_name, filename)
+
+def reenrich_chunk(nsc, ip_address_ids, retries):
+    '''Re-enriches a chunk of addresses in its own transaction, retrying it if it loses a
+    serialization race with ingest. Returns the flows updated'''
+    for attempt in range(retries + 1):
+        db_conn = nsc.database.get_connection()
+        try:
+            flows = nsc.database.run_procedure_fetchone(
+                "traffic_report.reenrich_geoip_for_addresses", [ip_address_ids],
+                existing_db_conn=db_conn, tuple_cursor=True)[0]
+            db_conn.commit()
+            return flows
+        except psycopg2.extensions.TransactionRollbackError:
+            db_conn.rollback()
+            if attempt == retries:
+                raise
+            nsc.logger.warning("chunk conflicted with another transaction, retrying")
+        finally:
+            nsc.database.return_connection(db_conn)
+
+def main():
+    '''Main function for the GeoIP backfill'''
+
+    # Do our basic setup work
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger(name=__name__)
+    logger.setLevel(logging.DEBUG)
+
+    parser = argparse.ArgumentParser(
+        description="Refresh GeoIP information of traffic enriched with older databases")
+    parser.add_argument('-s', '--server-config',
+                        default='/etc/ndr/ndr_server.yml',
+                        help='NDR Server Configuration File')
+    parser.add_argument('-b', '--chunk-size', type=int, default=500,
+                        help='Global addresses to re-enrich per transaction')
+    parser.add_argument('--pause', type=float, default=0.5,
+                        help='Seconds to wait between chunks, to leave room for ingest')
+    parser.add_argument('--checkpoint',
+                        help='Record progress here, and continue from it when re-run')
+    parser.add_argument('--max-chunks', type=int,
+                        help='Stop after this many chunks (continue later with --checkpoint)')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Times to retry a chunk that conflicts with ingest')
+    args = parser.parse_args()
+
+    nsc = ndr_server.Config(logger, args.server_config)
+
+    db_conn = nsc.database.get_connection(read_only=True)
+    try:
+        versions = dict((str(ip_version), version) for ip_version, version in
+                        nsc.database.run_procedure_fetchall(
+                            "traffic_report.get_geoip_database_versions", [],
+                            existing_db_conn=db_conn, tuple_cursor=True))
+        db_conn.commit()
+
+        checkpoint = load_checkpoint(args.checkpoint, versions)
+        nsc.logger.info("GeoIP databases: IPv4 %s, IPv6 %s; starting after address %d",
+                        versions['4'], versions['6'], checkpoint['last_ip_address_id'])
+
+        chunks = 0
+        started = time.perf_counter()
+        while args.max_chunks is None or chunks < args.max_chunks:
+            rows = nsc.database.run_procedure_fetchall(
+                "traffic_report.get_stale_geoip_addresses",
+                [versions['4'], versions['6'], checkpoint['last_ip_address_id'], args.chunk_size],
+                existing_db_conn=db_conn, tuple_cursor=True, read_only=True)
+            db_conn.commit()
+            if len(rows) == 0:
+                break
+
+            ip_address_ids = [row[0] for row in rows]
+            flows = reenrich_chunk(nsc, ip_address_ids, args.retries)
+
+            chunks += 1
+            checkpoint['last_ip_address_id'] = ip_address_ids[-1]
+            checkpoint['addresses'] += len(ip_address_ids)
+            checkpoint['flows'] += flows
+            if args.checkpoint is not None:
+                write_checkpoint(args.checkpoint, checkpoint)
+
+            elapsed = time.perf_counter() - started
+            nsc.logger.info("Chunk %d: %d addresses, %d flows; %d addresses, %d flows so far "
+                            "(%.0f addresses/s)", chunks, len(ip_address_ids), flows,
+                            checkpoint['addresses'], checkpoint['flows'],
+                            checkpoint['addresses'] / max(elapsed, 0.001))
+
+            if args.pause > 0:
+                time.sleep(args.pause)
+    finally:
+        nsc.database.return_connection(db_conn)
+
+    nsc.logger.info("Backfill stopped after %d chunks, at address %d",
+                    chunks, checkpoint['last_ip_address_id'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+# Original Author: Michael Casadevall <michaelc@them.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Creates upcoming time partitions and drops the ones past their retention period.
+Meant to be run daily from cron'''
+
+import argparse
+import logging
+
+from datetime import datetime, timedelta
+import ndr_server
+
+def main():
+    '''Main function for partition maintenance'''
+
+    # Do our basic setup work
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger(name=__name__)
+    logger.setLevel(logging.DEBUG)
+
+    parser = argparse.ArgumentParser(
+        description="Create upcoming partitions and expire old ones")
+    parser.add_argument('-s', '--server-config',
+                        default='/etc/ndr/ndr_server.yml',
+                        help='NDR Server Configuration File')
+    parser.add_argument('--no-retention', action='store_true',
+                        help="Only create partitions, don't drop anything")
+    args = parser.parse_args()
+
+    nsc = ndr_server.Config(logger, args.server_config)
+    db_conn = nsc.database.get_connection()
+
+    created = nsc.database.run_procedure_fetchone(
+        "admin.create_time_partitions", [], existing_db_conn=db_conn, tuple_cursor=True)[0]
+    nsc.logger.info("Created %d partitions", created)
+
+    if args.no_retention is False:
+        for table, days in nsc.partition_retention_days.items():
+            dropped = nsc.database.run_procedure_fetchone(
+                "admin.drop_time_partitions", [table, datetime.now() - timedelta(days=days)],
+                existing_db_conn=db_conn, tuple_cursor=True)[0]
+            nsc.logger.info("Dropped %d partitions of %s older than %d days",
+                            dropped, table, days)
+
+    db_conn.commit()
+    nsc.database.return_connection(db_conn)
+
+if __name__ == '__main__':
+    main()
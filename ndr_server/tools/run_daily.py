@@ -17,13 +17,119 @@
 '''Does daily processing of NDR server tasks'''
 
 import argparse
+import concurrent.futures
+import json
 import logging
+import os
+import sys
+import tempfile
+import time
 
 from datetime import datetime, timedelta
 import ndr_server
 
+# Config of the worker, set in main() for threads and by init_worker() in each process on
+# its first site
+WORKER_CONFIG = None
+WORKER_PID = None
+
+CHECKPOINT_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def init_worker(server_config):
+    '''Loads the config in a worker process, each process gets its own pool'''
+    global WORKER_CONFIG, WORKER_PID # pylint: disable=global-statement
+    WORKER_CONFIG = ndr_server.Config(logging.getLogger(name=__name__), server_config)
+    WORKER_PID = os.getpid()
+
+def process_site(site_id, start_period, end_period, server_config):
+    '''Generates and sends the reports of one site in its own transaction. Returns the
+    site ID, seconds taken and the error (or None)'''
+
+    # Forked workers inherit the parent's config, but must not share its connections
+    if WORKER_PID != os.getpid():
+        init_worker(server_config)
+    nsc = WORKER_CONFIG
+    started = time.perf_counter()
+
+    # Reports only read, so this can be served from the replica if there is one
+    db_conn = nsc.database.get_connection(read_only=True)
+    try:
+        site = ndr_server.Site.read_by_id(nsc, site_id, db_conn=db_conn)
+        nsc.logger.info("Processing site %s (%d)", site.name, site.pg_id)
+
+        # TShark Reports
+        report_manager = ndr_server.TsharkTrafficReportManager(nsc, site, db_conn)
+        report_manager.generate_report_emails(start_period,
+                                              end_period,
+                                              db_conn=db_conn,
+                                              send=True)
+        db_conn.commit()
+        error = None
+    except Exception as exception: # pylint: disable=broad-except
+        db_conn.rollback()
+        error = "%s: %s" % (type(exception).__name__, exception)
+    finally:
+        nsc.database.return_connection(db_conn)
+
+    return site_id, time.perf_counter() - started, error
+
+def select_sites(nsc, args):
+    '''Returns the IDs of the sites to process, honoring --sites and --org'''
+    db_conn = nsc.database.get_connection(read_only=True)
+    try:
+        sites = ndr_server.Site.retrieve_all(nsc, db_conn)
+
+        if args.org is not None:
+            if args.org.isdigit():
+                org = ndr_server.Organization.read_by_id(nsc, int(args.org), db_conn=db_conn)
+            else:
+                org = ndr_server.Organization.read_by_name(nsc, args.org, db_conn=db_conn)
+            sites = [site for site in sites if site.org_id == org.pg_id]
+
+        db_conn.commit()
+    finally:
+        nsc.database.return_connection(db_conn)
+
+    if args.sites is not None:
+        wanted = set(args.sites)
+        sites = [site for site in sites if str(site.pg_id) in wanted or site.name in wanted]
+
+    return [site.pg_id for site in sites]
+
+def load_checkpoint(filename, start_period, end_period, resume=False):
+    '''Loads the checkpoint of the run being resumed, or starts one for the period. The
+    period is kept in the checkpoint so a resumed run reports on the same period as the run
+    it continues; without resume, a checkpoint left by an earlier run is replaced'''
+    if resume is True and filename is not None and os.path.exists(filename):
+        with open(filename, 'r') as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        checkpoint['completed'] = set(checkpoint['completed'])
+        return checkpoint
+
+    return {
+        'start_period': start_period.strftime(CHECKPOINT_TIME_FORMAT),
+        'end_period': end_period.strftime(CHECKPOINT_TIME_FORMAT),
+        'completed': set()
+    }
+
+def write_checkpoint(filename, checkpoint):
+    '''Atomically writes the checkpoint out'''
+    serialized = dict(checkpoint, completed=sorted(checkpoint['completed']))
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, temp_name = tempfile.mkstemp(dir=directory, prefix=".checkpoint")
+    with os.fdopen(file_descriptor, 'w') as checkpoint_file:
+        json.dump(serialized, checkpoint_file)
+    os.rename(temp_name, filename)
+
+def clear_checkpoint(filename):
+    '''Removes the checkpoint of a run that finished every site'''
+    if os.path.exists(filename):
+        os.remove(filename)
+
 def main():
     '''Main function for handling daily processing tasks'''
+    global WORKER_CONFIG, WORKER_PID # pylint: disable=global-statement
 
     # Do our basic setup work
     logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
@@ -36,31 +142,86 @@ def main():
     parser.add_argument('-s', '--server-config',
                         default='/etc/ndr/ndr_server.yml',
                         help='NDR Server Configuration File')
+    parser.add_argument('--query-stats',
+                        help='Write per procedure query statistics to this file as JSON')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='Number of sites to process in parallel')
+    parser.add_argument('--processes', action='store_true',
+                        help='Use worker processes instead of threads')
+    parser.add_argument('--sites', nargs='+',
+                        help='Only process these sites (IDs or names)')
+    parser.add_argument('--org',
+                        help='Only process the sites of this organization (ID or name)')
+    parser.add_argument('--checkpoint',
+                        help='Record finished sites here; removed once every site is done')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the run recorded in --checkpoint, reporting on its '
+                             'period and skipping the sites it finished')
     args = parser.parse_args()
 
     nsc = ndr_server.Config(logger, args.server_config)
-
-    db_conn = nsc.database.get_connection()
+    WORKER_CONFIG = nsc
+    WORKER_PID = os.getpid()
 
     nsc.logger.info("Generating GeoIP statistics email")
 
-    # Retrieve all sites
-    sites = ndr_server.Site.retrieve_all(nsc, db_conn)
-
-    for site in sites:
-        nsc.logger.info("Processing site %s (%d)", site.name, site.pg_id)
-
-        # TShark Reports
-        report_manager = ndr_server.TsharkTrafficReportManager(nsc,
-                                                               site,
-                                                               db_conn)
-
-        report_manager.generate_report_emails(datetime.now() - timedelta(days=1),
-                                              datetime.now(),
-                                              db_conn=db_conn,
-                                              send=True)
-
-    db_conn.commit()
+    now = datetime.now()
+    checkpoint = load_checkpoint(args.checkpoint, now - timedelta(days=1), now,
+                                 resume=args.resume)
+    if args.checkpoint is not None:
+        write_checkpoint(args.checkpoint, checkpoint)
+    start_period = datetime.strptime(checkpoint['start_period'], CHECKPOINT_TIME_FORMAT)
+    end_period = datetime.strptime(checkpoint['end_period'], CHECKPOINT_TIME_FORMAT)
+
+    site_ids = [site_id for site_id in select_sites(nsc, args)
+                if site_id not in checkpoint['completed']]
+    nsc.logger.info("%d sites to process, %d already done",
+                    len(site_ids), len(checkpoint['completed']))
+
+    if args.processes is True:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
+
+    failed = {}
+    with executor:
+        futures = [executor.submit(process_site, site_id, start_period, end_period,
+                                   args.server_config)
+                   for site_id in site_ids]
+
+        for future in concurrent.futures.as_completed(futures):
+            site_id, elapsed, error = future.result()
+            if error is None:
+                nsc.logger.info("Site %d done in %.1f seconds", site_id, elapsed)
+                checkpoint['completed'].add(site_id)
+                if args.checkpoint is not None:
+                    write_checkpoint(args.checkpoint, checkpoint)
+            else:
+                nsc.logger.error("Site %d failed after %.1f seconds: %s", site_id, elapsed, error)
+                failed[site_id] = error
+
+    nsc.logger.info("%d sites processed, %d failed", len(site_ids) - len(failed), len(failed))
+
+    # The next run starts a new period, so there's nothing left to resume
+    if args.checkpoint is not None and len(failed) == 0:
+        clear_checkpoint(args.checkpoint)
+
+    # Snapshots are only read again when a period's reports are re-sent
+    if nsc.report_snapshot_dir is not None:
+        snapshot_cache = ndr_server.ReportSnapshotCache(nsc, nsc.report_snapshot_dir)
+        nsc.logger.info("Pruned %d old report snapshots",
+                        snapshot_cache.prune(nsc.report_snapshot_max_age))
+
+    # Query statistics only cover this process, so they're incomplete with --processes
+    if nsc.database.tracer is not None:
+        nsc.logger.info("Most expensive procedures:")
+        nsc.database.tracer.log_summary(nsc.logger)
+
+    if args.query_stats is not None:
+        nsc.database.write_stats(args.query_stats)
+
+    if len(failed) != 0:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
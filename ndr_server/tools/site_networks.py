@@ -0,0 +1,71 @@
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Lists, adds and removes the networks internal to a site. Discovery scans add their
+targets on their own; public and IPv6 ranges a site uses internally need adding here'''
+
+import argparse
+import logging
+
+import ndr_server
+
+def main():
+    '''Main function for managing site networks'''
+
+    # Do our basic setup work
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger = logging.getLogger(name=__name__)
+    logger.setLevel(logging.DEBUG)
+
+    parser = argparse.ArgumentParser(
+        description="Manage the networks internal to a site")
+    parser.add_argument('-s', '--server-config',
+                        default='/etc/ndr/ndr_server.yml',
+                        help='NDR Server Configuration File')
+    parser.add_argument('site', help='Site ID or name')
+    parser.add_argument('--add', nargs='+', default=[],
+                        help='Networks (CIDR) to add')
+    parser.add_argument('--remove', nargs='+', default=[],
+                        help='Networks (CIDR) to remove')
+    args = parser.parse_args()
+
+    nsc = ndr_server.Config(logger, args.server_config)
+    db_conn = nsc.database.get_connection()
+
+    try:
+        if args.site.isdigit():
+            site = ndr_server.Site.read_by_id(nsc, int(args.site), db_conn=db_conn)
+        else:
+            site = ndr_server.Site.read_by_name(nsc, args.site, db_conn=db_conn)
+
+        for network in args.add:
+            site.add_local_network(network, db_conn=db_conn)
+            nsc.logger.info("Added %s to %s", network, site.name)
+
+        for network in args.remove:
+            if site.remove_local_network(network, db_conn=db_conn) is False:
+                nsc.logger.warning("%s isn't a network of %s", network, site.name)
+            else:
+                nsc.logger.info("Removed %s from %s", network, site.name)
+
+        for network in site.get_local_networks(db_conn=db_conn).networks:
+            print(network)
+
+        db_conn.commit()
+    finally:
+        nsc.database.return_connection(db_conn)
+
+if __name__ == '__main__':
+    main()
@@ -20,13 +20,77 @@ import ipaddress
 import datetime
 import collections
 import csv
+import heapq
 import io
+import tempfile
 import zipfile
 
-from terminaltables import AsciiTable
-
 import ndr
 import ndr_server
+from ndr_server.report_cache import ReportSnapshotCache, deserialize_records, serialize_records
+from ndr_server.sketches import HostTrafficSketch, HyperLogLog, SpaceSaving, update_host_sketches
+from ndr_server.text_table import TextTable
+
+# rx_bytes and tx_bytes are int columns, merged flows mustn't grow past them
+MAX_FLOW_BYTES = 2**31 - 1
+
+class ConsolidatedFlow(collections.namedtuple('ConsolidatedFlow',
+                                              'protocol src_address src_hostname src_port \
+                                              dst_address dst_hostname dst_port \
+                                              rx_bytes tx_bytes start_timestamp duration \
+                                              flow_count')):
+    '''One or more traffic entries of a message stored as a single traffic report'''
+    __slots__ = ()
+
+    @classmethod
+    def from_entry(cls, entry):
+        '''Wraps a single traffic entry'''
+        return cls(entry.protocol, entry.src_address, entry.src_hostname, entry.src_port,
+                   entry.dst_address, entry.dst_hostname, entry.dst_port,
+                   entry.rx_bytes, entry.tx_bytes, entry.start_timestamp, entry.duration, 1)
+
+    def merge(self, entry):
+        '''Returns this flow with entry folded in. The earliest start time is kept and
+        durations are summed; if the source ports differ, the port is stored as 0'''
+        src_port = self.src_port
+        if entry.src_port != src_port:
+            src_port = 0
+
+        return self._replace(src_port=src_port,
+                             rx_bytes=self.rx_bytes + entry.rx_bytes,
+                             tx_bytes=self.tx_bytes + entry.tx_bytes,
+                             start_timestamp=min(self.start_timestamp, entry.start_timestamp),
+                             duration=self.duration + entry.duration,
+                             flow_count=self.flow_count + 1)
+
+def consolidate_traffic_entries(traffic_entries, bucket_seconds=None):
+    '''Merges the traffic entries of a message that only differ by source port and start
+    time, i.e. the many short connections a machine makes to the same service. Reports only
+    sum bytes by address, hostname, protocol and port so they come out the same.
+
+    With bucket_seconds, only entries starting within the same bucket are merged. Flows are
+    returned in the order they were first seen'''
+
+    flows = []
+    flow_positions = {}
+    for entry in traffic_entries:
+        key = (entry.protocol, entry.src_address, entry.src_hostname,
+               entry.dst_address, entry.dst_hostname, entry.dst_port)
+        if bucket_seconds:
+            key += (int(entry.start_timestamp) // bucket_seconds,)
+
+        position = flow_positions.get(key)
+        if position is not None:
+            flow = flows[position]
+            if (flow.rx_bytes + entry.rx_bytes <= MAX_FLOW_BYTES and
+                    flow.tx_bytes + entry.tx_bytes <= MAX_FLOW_BYTES):
+                flows[position] = flow.merge(entry)
+                continue
+
+        flow_positions[key] = len(flows)
+        flows.append(ConsolidatedFlow.from_entry(entry))
+
+    return flows
 
 class TsharkTrafficReport(object):
     '''Traffic logs are generated by listening programs and summarizing all packets,
@@ -53,22 +117,48 @@ class TsharkTrafficReport(object):
         traffic_log.traffic_log = ingest_log
         traffic_log.pg_id = log_id
 
-        for traffic_entry in ingest_log.traffic_entries:
+        traffic_entries = ingest_log.traffic_entries
+        if config.traffic_consolidate_flows:
+            traffic_entries = consolidate_traffic_entries(traffic_entries,
+                                                          config.traffic_consolidation_bucket)
+        else:
+            traffic_entries = [ConsolidatedFlow.from_entry(entry) for entry in traffic_entries]
+
+        ip_addresses = config.dimensions.ip_addresses
+        hostnames = config.dimensions.hostnames
+        ip_ids = ip_addresses.resolve(
+            [flow.src_address for flow in traffic_entries] +
+            [flow.dst_address for flow in traffic_entries], db_conn)
+        hostname_ids = hostnames.resolve(
+            [flow.src_hostname for flow in traffic_entries] +
+            [flow.dst_hostname for flow in traffic_entries], db_conn)
+
+        for flow in traffic_entries:
             config.database.run_procedure(
-                "traffic_report.create_traffic_report",
+                "traffic_report.insert_traffic_report",
                 [log_id,
-                 traffic_entry.protocol.value,
-                 traffic_entry.src_address.compressed,
-                 traffic_entry.src_hostname,
-                 traffic_entry.src_port,
-                 traffic_entry.dst_address.compressed,
-                 traffic_entry.dst_hostname,
-                 traffic_entry.dst_port,
-                 traffic_entry.rx_bytes,
-                 traffic_entry.tx_bytes,
-                 traffic_entry.start_timestamp,
-                 traffic_entry.duration],
-                existing_db_conn=db_conn)
+                 flow.protocol.value,
+                 ip_addresses.lookup(ip_ids, flow.src_address),
+                 hostnames.lookup(hostname_ids, flow.src_hostname),
+                 flow.src_port,
+                 ip_addresses.lookup(ip_ids, flow.dst_address),
+                 hostnames.lookup(hostname_ids, flow.dst_hostname),
+                 flow.dst_port,
+                 flow.rx_bytes,
+                 flow.tx_bytes,
+                 flow.start_timestamp,
+                 flow.duration,
+                 flow.flow_count],
+                existing_db_conn=db_conn,
+                tuple_cursor=True).close()
+
+        # Fold the whole upload into the hourly rollups the reports read from
+        config.database.run_procedure(
+            "traffic_report.rollup_traffic_for_message", [log_id],
+            existing_db_conn=db_conn, tuple_cursor=True).close()
+
+        if config.traffic_sketches_enabled:
+            update_host_sketches(config, log_id, db_conn)
 
         return traffic_log
 
@@ -83,7 +173,109 @@ FullConnectionGeoIpRecord = collections.namedtuple('FullConnectionGeoIpRecord',
                                                    city_name isp domain \
                                                    total_rx_bytes total_tx_bytes')
 InternetHostRecord = collections.namedtuple('InternetHostRecord',
-                                            'local_ip global_ip global_hostname isp')
+                                            'local_ip global_ip global_hostname isp \
+                                            total_rx_bytes total_tx_bytes')
+
+class TsharkTrafficReportSnapshot(object):
+    '''A site's report data for one period. Each dataset is fetched on first use and the
+    rendered tables are memoized, so every contact is served from a single set of queries.
+
+    With a snapshot cache, the datasets come from it while no late messages arrived for the
+    period, and save() stores freshly fetched ones'''
+
+    # Datasets kept in the snapshot cache, and their records
+    CACHED_DATASETS = {
+        'geoip_breakdown': GeoipSummaryRecord,
+        'local_ip_breakdown': MachineGeoIpRecord,
+        'internet_host_breakdown': InternetHostRecord,
+    }
+
+    def __init__(self, report_manager, start_period, end_period, db_conn):
+        self.report_manager = report_manager
+        self.start_period = start_period
+        self.end_period = end_period
+        self.db_conn = db_conn
+        self._geoip_breakdown = None
+        self._local_ip_breakdown = None
+        self._internet_host_breakdown = None
+        self._machine_names = None
+        self._rendered = {}
+        self._cache_key = None
+        self._cached = False
+
+    def _load_cached(self):
+        '''Fills in the datasets from the snapshot cache the first time any is asked for'''
+        cache = self.report_manager.snapshot_cache
+        if cache is None or self._cache_key is not None:
+            return
+
+        self._cache_key = cache.key(self.report_manager.site, self.start_period,
+                                    self.end_period, self.db_conn)
+        datasets = cache.load(self._cache_key)
+        if datasets is None:
+            return
+
+        for name, record_type in self.CACHED_DATASETS.items():
+            setattr(self, '_' + name, deserialize_records(record_type, datasets[name]))
+        self._cached = True
+
+    def save(self):
+        '''Stores the datasets in the snapshot cache, unless they came from there'''
+        cache = self.report_manager.snapshot_cache
+        if cache is None:
+            return
+
+        self._load_cached()
+        if self._cached is True:
+            return
+
+        datasets = {}
+        for name in self.CACHED_DATASETS:
+            datasets[name] = serialize_records(getattr(self, name))
+        cache.store(self._cache_key, datasets)
+        self._cached = True
+
+    @property
+    def geoip_breakdown(self):
+        '''Traffic by destination country'''
+        self._load_cached()
+        if self._geoip_breakdown is None:
+            self._geoip_breakdown = self.report_manager.retrieve_geoip_breakdown(
+                self.start_period, self.end_period, self.db_conn)
+        return self._geoip_breakdown
+
+    @property
+    def local_ip_breakdown(self):
+        '''Traffic by machine and destination country'''
+        self._load_cached()
+        if self._local_ip_breakdown is None:
+            self._local_ip_breakdown = self.report_manager.retrieve_geoip_by_local_ip_breakdown(
+                self.start_period, self.end_period, self.db_conn)
+        return self._local_ip_breakdown
+
+    @property
+    def internet_host_breakdown(self):
+        '''Internet hosts each machine talked to'''
+        self._load_cached()
+        if self._internet_host_breakdown is None:
+            self._internet_host_breakdown = self.report_manager.retrieve_internet_host_breakdown(
+                self.start_period, self.end_period, self.db_conn)
+        return self._internet_host_breakdown
+
+    @property
+    def machine_names(self):
+        '''Baseline host names of every machine in the report, looked up in one query'''
+        if self._machine_names is None:
+            local_ips = {record.local_ip for record in self.local_ip_breakdown}
+            self._machine_names = ndr_server.BaselineHost.human_names_by_ip(
+                self.report_manager.config, self.report_manager.site, local_ips, self.db_conn)
+        return self._machine_names
+
+    def render(self, key, renderer):
+        '''Returns renderer()'s output, only calling it the first time key is asked for'''
+        if key not in self._rendered:
+            self._rendered[key] = renderer()
+        return self._rendered[key]
 
 class TsharkTrafficReportManager(object):
     '''Handles a summary of traffic report messages from the database'''
@@ -92,6 +284,9 @@ class TsharkTrafficReportManager(object):
         self.config = config
         self.site = site
         self.organization = site.get_organization(db_conn)
+        self.snapshot_cache = None
+        if config.report_snapshot_dir is not None:
+            self.snapshot_cache = ReportSnapshotCache(config, config.report_snapshot_dir)
 
     def retrieve_geoip_breakdown(self,
                                  start_period: datetime.datetime,
@@ -104,7 +299,7 @@ class TsharkTrafficReportManager(object):
             [self.site.pg_id,
              start_period,
              end_period],
-            existing_db_conn=db_conn)
+            existing_db_conn=db_conn, read_only=True)
 
         geoip_records = []
         for record in geoip_results:
@@ -130,7 +325,7 @@ class TsharkTrafficReportManager(object):
             [self.site.pg_id,
              start_period,
              end_period],
-            existing_db_conn=db_conn)
+            existing_db_conn=db_conn, read_only=True)
 
         local_ip_records = []
         for record in local_ip_results:
@@ -157,7 +352,7 @@ class TsharkTrafficReportManager(object):
             [self.site.pg_id,
              start_period,
              end_period],
-            existing_db_conn=db_conn)
+            existing_db_conn=db_conn, read_only=True)
 
         internet_host_records = []
         for record in internet_host_results:
@@ -166,7 +361,9 @@ class TsharkTrafficReportManager(object):
                     local_ip=ipaddress.ip_address(record['local_ip']),
                     global_ip=ipaddress.ip_address(record['global_ip']),
                     global_hostname=record['global_hostname'],
-                    isp=record['isp']
+                    isp=record['isp'],
+                    total_rx_bytes=record['total_rx_bytes'],
+                    total_tx_bytes=record['total_tx_bytes']
                 )
             )
 
@@ -184,7 +381,7 @@ class TsharkTrafficReportManager(object):
             [self.site.pg_id,
              start_period,
              end_period],
-            existing_db_conn=db_conn)
+            existing_db_conn=db_conn, read_only=True)
 
         traffic_breakdown_records = []
         for record in traffic_breakdown_results:
@@ -204,6 +401,144 @@ class TsharkTrafficReportManager(object):
 
         return traffic_breakdown_records
 
+    # Breakdowns that can be streamed, by name: (procedure, record type). The procedures
+    # return their columns in the order of the record's fields
+    BREAKDOWNS = {
+        'geoip': ("traffic_report.report_geoip_breakdown_for_site", GeoipSummaryRecord),
+        'machine': ("traffic_report.report_traffic_breakdown_in_site_by_machine",
+                    MachineGeoIpRecord),
+        'internet_host': ("traffic_report.report_internet_host_breakdown_for_site",
+                          InternetHostRecord),
+        'full_host': ("traffic_report.report_traffic_breakdown_for_site",
+                      FullConnectionGeoIpRecord),
+    }
+
+    def iter_breakdown(self,
+                       breakdown,
+                       start_period: datetime.datetime,
+                       end_period: datetime.datetime,
+                       db_conn,
+                       itersize=None):
+        '''Yields the records of a breakdown (see BREAKDOWNS) as they're fetched from a server
+        side cursor. Unlike the retrieve_* methods, addresses are left as the strings the
+        database returned'''
+        procedure, record_type = self.BREAKDOWNS[breakdown]
+        for row in self.config.database.run_procedure_iter(
+                procedure,
+                [self.site.pg_id,
+                 start_period,
+                 end_period],
+                existing_db_conn=db_conn, itersize=itersize, tuple_cursor=True, read_only=True):
+            yield record_type._make(row)
+
+    def iter_geoip_breakdown(self, start_period, end_period, db_conn, itersize=None):
+        '''Streaming retrieve_geoip_breakdown()'''
+        return self.iter_breakdown('geoip', start_period, end_period, db_conn, itersize)
+
+    def iter_geoip_by_local_ip_breakdown(self, start_period, end_period, db_conn,
+                                         itersize=None):
+        '''Streaming retrieve_geoip_by_local_ip_breakdown()'''
+        return self.iter_breakdown('machine', start_period, end_period, db_conn, itersize)
+
+    def iter_internet_host_breakdown(self, start_period, end_period, db_conn, itersize=None):
+        '''Streaming retrieve_internet_host_breakdown()'''
+        return self.iter_breakdown('internet_host', start_period, end_period, db_conn, itersize)
+
+    def iter_full_host_breakdown(self, start_period, end_period, db_conn, itersize=None):
+        '''Streaming retrieve_full_host_breakdown()'''
+        return self.iter_breakdown('full_host', start_period, end_period, db_conn, itersize)
+
+    def write_breakdown(self,
+                        breakdown,
+                        start_period: datetime.datetime,
+                        end_period: datetime.datetime,
+                        output,
+                        db_conn,
+                        output_format='ndjson',
+                        itersize=None):
+        '''Streams a breakdown to the text file output as ndjson or csv, without holding
+        more than itersize rows in memory. Returns the number of records written'''
+        # Not imported with the module, export pulls in numpy
+        from ndr_server.export import write_csv, write_ndjson
+
+        records = self.iter_breakdown(breakdown, start_period, end_period, db_conn, itersize)
+        try:
+            if output_format == 'ndjson':
+                return write_ndjson(records, output)
+            if output_format == 'csv':
+                return write_csv(records, output, self.BREAKDOWNS[breakdown][1]._fields)
+            raise ValueError("unknown breakdown format %s" % output_format)
+        finally:
+            records.close()
+
+    def retrieve_host_sketches(self,
+                               start_day: datetime.date,
+                               end_day: datetime.date,
+                               db_conn,
+                               local_ip=None):
+        '''Returns each machine's HostTrafficSketch merged over start_day to end_day
+        (inclusive), optionally only for local_ip. Sketches are kept per day, so times are
+        rounded down to their day'''
+
+        if isinstance(start_day, datetime.datetime):
+            start_day = start_day.date()
+        if isinstance(end_day, datetime.datetime):
+            end_day = end_day.date()
+        if local_ip is not None:
+            local_ip = ipaddress.ip_address(local_ip).compressed
+
+        sketch_rows = self.config.database.run_procedure_fetchall(
+            "traffic_report.get_host_sketches_for_site",
+            [self.site.pg_id,
+             start_day,
+             end_day,
+             local_ip],
+            existing_db_conn=db_conn, tuple_cursor=True, read_only=True)
+
+        host_sketches = {}
+        for row_local_ip, _, top_talkers, distinct_destinations in sketch_rows:
+            sketch = HostTrafficSketch(SpaceSaving.from_bytes(top_talkers),
+                                       HyperLogLog.from_bytes(distinct_destinations))
+
+            row_local_ip = ipaddress.ip_address(row_local_ip)
+            if row_local_ip in host_sketches:
+                sketch = host_sketches[row_local_ip].merge(sketch)
+            host_sketches[row_local_ip] = sketch
+
+        return host_sketches
+
+    def retrieve_top_talkers(self,
+                             local_ip,
+                             start_day: datetime.date,
+                             end_day: datetime.date,
+                             db_conn,
+                             count=20):
+        '''Returns the remote hosts a machine exchanged the most bytes with as HeavyHitters.
+        Estimates are never low, and high by at most their error'''
+        sketch = self.retrieve_host_sketches(start_day, end_day, db_conn, local_ip).get(
+            ipaddress.ip_address(local_ip))
+        if sketch is None:
+            return []
+        return sketch.top(count)
+
+    def retrieve_distinct_destinations(self,
+                                       local_ip,
+                                       start_day: datetime.date,
+                                       end_day: datetime.date,
+                                       db_conn):
+        '''Returns the estimated number of distinct remote hosts a machine talked to'''
+        sketch = self.retrieve_host_sketches(start_day, end_day, db_conn, local_ip).get(
+            ipaddress.ip_address(local_ip))
+        if sketch is None:
+            return 0
+        return sketch.distinct_destinations()
+
+    def snapshot(self,
+                 start_period: datetime.datetime,
+                 end_period: datetime.datetime,
+                 db_conn):
+        '''Returns a snapshot of the report data for the period'''
+        return TsharkTrafficReportSnapshot(self, start_period, end_period, db_conn)
 
     def generate_report_emails(self,
                                start_period: datetime.datetime,
@@ -212,50 +547,101 @@ class TsharkTrafficReportManager(object):
                                send=True):
         '''Generates a report email breaking down traffic by country destination'''
 
+        tr_email = None
         if send is True:
             alert_contacts = self.organization.get_contacts(db_conn=db_conn)
 
-            attachment_tuple = None
             current_time = datetime.datetime.today().strftime('%Y-%m-%d')
             filename = "breakdown_" + current_time + ".csv"
             zip_archive = "breakdown_" + current_time + ".zip"
 
-            for contact in alert_contacts:
-                csv_output = True
-                if contact.output_format is ndr_server.OutputFormats.INLINE:
-                    csv_output = False
-
-                tr_email = ndr_server.TsharkTrafficReportMessage(self.organization,
-                                                                 self.site,
-                                                                 self,
-                                                                 start_period,
-                                                                 end_period,
-                                                                 self.config,
-                                                                 db_conn,
-                                                                 csv_output=csv_output)
-
-                subject = tr_email.subject()
-                message = tr_email.prepped_message()
-
-                if contact.output_format is ndr_server.OutputFormats.CSV:
-                    attachment_tuple = [(bytes(tr_email.csv_output_text, 'utf-8'), filename, False)]
-                elif contact.output_format is ndr_server.OutputFormats.ZIP:
-                    # This is annoying to handle and process, make a temporary directory first
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-                        zip_file.writestr(filename, tr_email.csv_output_text)
-                    
-                    attachment_tuple = [(zip_buffer.getvalue(), zip_archive, True)]
-
-                # And send it
-                contact.send_message(
-                    subject, message, attachment_tuple
-                )
+            # Every contact is rendered from the same data, and each output format is only
+            # rendered once
+            snapshot = self.snapshot(start_period, end_period, db_conn)
+            rendered = {}
+            attachments = {}
+            attachment_files = []
+            csv_file = None
+
+            try:
+                for contact in alert_contacts:
+                    csv_output = True
+                    if contact.output_format is ndr_server.OutputFormats.INLINE:
+                        csv_output = False
+
+                    if csv_output not in rendered:
+                        tr_email = ndr_server.TsharkTrafficReportMessage(self.organization,
+                                                                         self.site,
+                                                                         self,
+                                                                         start_period,
+                                                                         end_period,
+                                                                         self.config,
+                                                                         db_conn,
+                                                                         csv_output=csv_output,
+                                                                         snapshot=snapshot)
+                        rendered[csv_output] = (tr_email,
+                                                tr_email.subject(),
+                                                tr_email.prepped_message())
+
+                    tr_email, subject, message = rendered[csv_output]
+
+                    # Before anything is sent, so a re-run after a failed send is cheap
+                    snapshot.save()
+
+                    if contact.output_format not in attachments:
+                        attachment_tuple = None
+                        if contact.output_format is not ndr_server.OutputFormats.INLINE:
+                            # Both the CSV and ZIP attachments are made from the CSV file
+                            if csv_file is None:
+                                csv_file = self.write_csv_attachment(tr_email)
+                                attachment_files.append(csv_file)
+
+                        if contact.output_format is ndr_server.OutputFormats.CSV:
+                            attachment_tuple = [(csv_file, filename, False)]
+                        elif contact.output_format is ndr_server.OutputFormats.ZIP:
+                            zip_file = self.write_zip_attachment(csv_file, filename)
+                            attachment_files.append(zip_file)
+                            attachment_tuple = [(zip_file, zip_archive, True)]
+                        attachments[contact.output_format] = attachment_tuple
+
+                    attachment_tuple = attachments[contact.output_format]
+
+                    # And send it
+                    contact.send_message(
+                        subject, message, attachment_tuple
+                    )
+            finally:
+                for attachment_file in attachment_files:
+                    attachment_file.close()
 
         return tr_email
 
     @staticmethod
-    def generate_table_of_geoip_breakdown(traffic_report, csv_output=False):
+    def write_csv_attachment(tr_email):
+        '''Writes the CSV breakdown of tr_email to a temporary file, returned open at the start'''
+
+        # A real file, so write_zip_attachment() can hand its path to zipfile
+        csv_file = tempfile.NamedTemporaryFile(suffix=".csv")
+        csv_text = io.TextIOWrapper(csv_file.file, encoding='utf-8', newline='')
+        tr_email.write_csv_breakdown(csv_text)
+        csv_text.flush()
+        csv_text.detach()
+
+        csv_file.seek(0)
+        return csv_file
+
+    @staticmethod
+    def write_zip_attachment(csv_file, filename):
+        '''Compresses the CSV file into a spooled temporary ZIP archive'''
+        zip_buffer = tempfile.SpooledTemporaryFile(max_size=ndr_server.contacts.SPOOL_MAX_SIZE)
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED, False) as zip_archive:
+            zip_archive.write(csv_file.name, filename)
+
+        zip_buffer.seek(0)
+        return zip_buffer
+
+    @staticmethod
+    def generate_table_of_geoip_breakdown(traffic_report, csv_output=False, max_cell_width=None):
         '''Generates a table of GeoIP breakdown'''
 
         # We'll sort on transmitted data
@@ -380,7 +766,7 @@ class TsharkTrafficReportManager(object):
             ])
 
             # Now generate a pretty table and return it
-            table = AsciiTable(table_data)
+            table = TextTable(table_data, max_cell_width=max_cell_width)
             return table.table
         else:
             # This is horrible and hacky
@@ -393,47 +779,64 @@ class TsharkTrafficReportManager(object):
             return csv_contents.getvalue()
 
     @staticmethod
-    def generate_table_internet_host_traffic(traffic_report, csv_output=False):
-        '''Generate internet host breakdown'''
-
-        table_data = [
-        ]
-
-        for record in traffic_report:
-            host_field = ""
-            isp_field = ""
-            # If we have a hostname, we'll use that, otherwise use the IP
-            if record.global_hostname is not None:
-                host_field = record.global_hostname
-            else:
+    def internet_host_rows(traffic_report, top=None):
+        '''Yields the unique [host, isp] rows of the internet host breakdown in the order they
+        were first seen. With top, only the top hosts by bytes exchanged are yielded as
+        [host, isp, bytes] rows, biggest first, and the bytes of the rest are summed up in a
+        final "Other" row'''
+
+        def row_key(record):
+            '''Hostname if we have one, otherwise the IP, and the ISP if known'''
+            host_field = record.global_hostname
+            if host_field is None:
                 host_field = record.global_ip
+            return (host_field, record.isp if record.isp is not None else "")
+
+        if top is None:
+            seen = set()
+            for record in traffic_report:
+                key = row_key(record)
+                if key not in seen:
+                    seen.add(key)
+                    yield list(key)
+            return
+
+        host_bytes = collections.OrderedDict()
+        for record in traffic_report:
+            key = row_key(record)
+            host_bytes[key] = host_bytes.get(key, 0) + record.total_rx_bytes + record.total_tx_bytes
 
-            # If we have the ISP, set it
-            if record.isp is not None:
-                isp_field = record.isp
+        # Ties keep first seen order
+        ranked = heapq.nlargest(top, enumerate(host_bytes.items()),
+                                key=lambda entry: (entry[1][1], -entry[0]))
+        shown_bytes = 0
+        for _, (key, total_bytes) in ranked:
+            shown_bytes += total_bytes
+            yield list(key) + [total_bytes]
 
-            table_data.append([
-                host_field,
-                isp_field
-            ])
+        if len(host_bytes) > top:
+            yield ["Other (%d hosts)" % (len(host_bytes) - top), "",
+                   sum(host_bytes.values()) - shown_bytes]
+
+    @staticmethod
+    def generate_table_internet_host_traffic(traffic_report, csv_output=False, top=None,
+                                             max_cell_width=None):
+        '''Generate internet host breakdown'''
 
-        # CAST THY DUPLICATES OUT
-        deduped_table_data = []
-        for row in table_data:
-            if row not in deduped_table_data:
-                deduped_table_data.append(row)
-        
-        table_data = deduped_table_data
+        # With top, the rows carry the bytes exchanged too
+        if top is None:
+            table_data = [["Host", "ISP"]]
+        else:
+            table_data = [["Host", "ISP", "Bytes"]]
+        table_data.extend(TsharkTrafficReportManager.internet_host_rows(traffic_report, top))
 
         if csv_output is False:
-            table = AsciiTable(table_data)
+            table = TextTable(table_data, max_cell_width=max_cell_width)
             return table.table
         else:
             # This is horrible and hacky
             csv_contents = io.StringIO()
             writer = csv.writer(csv_contents)
-
-            for row in table_data:
-                writer.writerow(row)
+            writer.writerows(table_data)
 
             return csv_contents.getvalue()
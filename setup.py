@@ -27,14 +27,23 @@ setup(
         'psycopg2 >= 2.7',
         'pytz',
         'geoip2',
-        'terminaltables'
+        'maxminddb',
+        'numpy'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     entry_points={
         'console_scripts': [
             'ndr-ingest-server = ndr_server.tools.server:main',
             'ndr-process-enlistments = ndr_server.tools.process_enlistment:main',
             'ndr-reboot-recorder = ndr_server.tools.reboot_recorder:main',
-            'ndr-run-daily = ndr_server.tools.run_daily:main'
+            'ndr-partition-maintenance = ndr_server.tools.partition_maintenance:main',
+            'ndr-run-daily = ndr_server.tools.run_daily:main',
+            'ndr-site-networks = ndr_server.tools.site_networks:main',
+            'ndr-build-geoip-index = ndr_server.tools.build_geoip_index:main',
+            'ndr-geoip-backfill = ndr_server.tools.geoip_backfill:main',
+            'ndr-export = ndr_server.tools.export_data:main'
         ]
     },
     test_suite="tests"
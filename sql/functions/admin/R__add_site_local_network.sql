@@ -0,0 +1,11 @@
+-- Adds a prefix internal to a site; source is 'admin' for ranges entered by hand
+
+CREATE OR REPLACE FUNCTION admin.add_site_local_network(_site_id bigint, _network cidr,
+                                                         _source public.local_network_source)
+    RETURNS void
+    LANGUAGE sql SECURITY DEFINER
+    AS $$
+    INSERT INTO public.site_local_networks (site_id, network, source)
+        VALUES (_site_id, _network, _source)
+    ON CONFLICT DO NOTHING;
+$$;
@@ -0,0 +1,54 @@
+-- Creates the partitions for every table in admin.partitioned_tables from the period
+-- containing _from up to premake periods past the current one. Ranges whose rows have
+-- already landed in the default partition are skipped with a warning; those rows stay in
+-- the default partition until they expire.
+--
+-- Returns the number of partitions created
+
+CREATE OR REPLACE FUNCTION admin.create_time_partitions(_from timestamp DEFAULT now())
+    RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    pt record;
+    step interval;
+    range_start timestamp;
+    range_end timestamp;
+    new_partition text;
+    created integer := 0;
+BEGIN
+    FOR pt IN SELECT apt.parent, apt.granularity, apt.premake, n.nspname, c.relname
+              FROM admin.partitioned_tables AS apt
+              JOIN pg_class AS c ON (c.oid=apt.parent)
+              JOIN pg_namespace AS n ON (n.oid=c.relnamespace)
+              ORDER BY apt.creation_order
+    LOOP
+        step := ('1 ' || pt.granularity)::interval;
+        range_start := date_trunc(pt.granularity, _from);
+
+        WHILE range_start < date_trunc(pt.granularity, now()) + step * (pt.premake + 1) LOOP
+            range_end := range_start + step;
+
+            IF NOT EXISTS (SELECT 1 FROM admin.time_partitions AS tp
+                           WHERE tp.parent=pt.parent AND tp.start_at=range_start) THEN
+                new_partition := format('%I.%I', pt.nspname,
+                                        pt.relname || '_p' || to_char(range_start, 'YYYYMMDD'));
+                BEGIN
+                    EXECUTE format('CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                                   new_partition, pt.parent, range_start, range_end);
+                    INSERT INTO admin.time_partitions (partition, parent, start_at, end_at)
+                        VALUES (new_partition::regclass, pt.parent, range_start, range_end);
+                    created := created + 1;
+                EXCEPTION WHEN check_violation THEN
+                    RAISE WARNING 'rows for % from % are in the default partition, not creating %',
+                        pt.parent, range_start, new_partition;
+                END;
+            END IF;
+
+            range_start := range_end;
+        END LOOP;
+    END LOOP;
+
+    RETURN created;
+END
+$$;
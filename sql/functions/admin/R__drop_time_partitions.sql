@@ -0,0 +1,43 @@
+-- Drops every partition of _parent that only holds rows received before _before, and
+-- deletes expired rows from its default partition. Partitioned tables with foreign keys
+-- into _parent are expired first so nothing is left pointing at the dropped rows.
+--
+-- Returns the number of partitions dropped
+
+CREATE OR REPLACE FUNCTION admin.drop_time_partitions(_parent regclass, _before timestamp)
+    RETURNS integer
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    referencing regclass;
+    tp record;
+    default_partition regclass;
+    dropped integer := 0;
+BEGIN
+    FOR referencing IN SELECT DISTINCT con.conrelid::regclass FROM pg_constraint AS con
+                       JOIN admin.partitioned_tables AS apt ON (apt.parent=con.conrelid)
+                       WHERE con.contype='f' AND con.confrelid=_parent AND con.conrelid<>_parent
+    LOOP
+        dropped := dropped + admin.drop_time_partitions(referencing, _before);
+    END LOOP;
+
+    FOR tp IN SELECT * FROM admin.time_partitions
+              WHERE parent=_parent AND end_at <= _before ORDER BY start_at
+    LOOP
+        -- Detaching first drops the foreign key bookkeeping against the partition
+        EXECUTE format('ALTER TABLE %s DETACH PARTITION %s', _parent, tp.partition);
+        EXECUTE format('DROP TABLE %s', tp.partition);
+        DELETE FROM admin.time_partitions WHERE partition=tp.partition;
+        dropped := dropped + 1;
+    END LOOP;
+
+    SELECT c.oid INTO default_partition FROM pg_inherits AS i
+        JOIN pg_class AS c ON (c.oid=i.inhrelid)
+        WHERE i.inhparent=_parent AND pg_get_expr(c.relpartbound, c.oid)='DEFAULT';
+    IF FOUND THEN
+        EXECUTE format('DELETE FROM %s WHERE received_at < %L', default_partition, _before);
+    END IF;
+
+    RETURN dropped;
+END
+$$;
@@ -0,0 +1,42 @@
+-- Streams the syslog entries of a site's recorders received after _after (and before
+-- _before, if given) in received order, for ndr-export. See
+-- traffic_report.export_traffic_for_site for _settle_seconds
+
+CREATE OR REPLACE FUNCTION admin.export_syslog_for_site(_site_id bigint,
+                                                        _after timestamp,
+                                                        _before timestamp,
+                                                        _settle_seconds int)
+    RETURNS TABLE (id bigint,
+                   received_at timestamp,
+                   recorder_message_id bigint,
+                   recorder_id bigint,
+                   logged_at timestamp,
+                   host text,
+                   program text,
+                   pid bigint,
+                   facility text,
+                   priority text,
+                   message text)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT sm.id,
+        sm.received_at,
+        sm.recorder_message_id,
+        sm.recorder_id,
+        sm.logged_at,
+        sm.host::text,
+        sp.syslog_program::text,
+        sm.pid,
+        sm.facility::text,
+        sm.priority::text,
+        sm.message
+    FROM public.syslog_messages AS sm
+    JOIN public.recorders AS r ON (r.id=sm.recorder_id)
+    LEFT JOIN public.syslog_programs AS sp ON (sp.id=sm.program_id)
+    WHERE r.site_id=_site_id
+    -- Kept to plain comparisons so the partitions out of range are pruned
+    AND sm.received_at > COALESCE(_after, '-infinity'::timestamp)
+    AND sm.received_at < COALESCE(_before, 'infinity'::timestamp)
+    AND sm.received_at <= now()::timestamp - make_interval(secs => _settle_seconds)
+    ORDER BY sm.received_at;
+$$;
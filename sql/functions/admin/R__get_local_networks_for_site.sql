@@ -0,0 +1,10 @@
+-- Returns the prefixes internal to a site, whether learned from scans or entered by hand
+
+CREATE OR REPLACE FUNCTION admin.get_local_networks_for_site(_site_id bigint)
+    RETURNS TABLE (network cidr)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT DISTINCT sln.network FROM public.site_local_networks AS sln
+    WHERE sln.site_id=_site_id
+    ORDER BY sln.network;
+$$;
@@ -11,19 +11,12 @@ CREATE OR REPLACE FUNCTION admin.get_recorder_message_ids_recieved_in_period(
     RETURNS bigint[]
     LANGUAGE plpgsql SECURITY DEFINER
     AS $$
-DECLARE
-    recorder_message_id bigint;
-    message_id_array bigint[];
 BEGIN
-    FOR recorder_message_id IN SELECT s.id FROM public.recorder_messages AS s WHERE
+    -- Backed by the (recorder_id, message_type, received_at) index
+    RETURN ARRAY(SELECT s.id FROM public.recorder_messages AS s WHERE
         s.recorder_id = _recorder_id AND
+        s.message_type = _message_type AND
         s.received_at >= _start_timestamp AND
-        s.received_at <= _end_timestamp AND
-        s.message_type=_message_type
-    LOOP
-        message_id_array := array_append(message_id_array, recorder_message_id);
-    END LOOP;
-
-    RETURN message_id_array;
+        s.received_at <= _end_timestamp);
 END
 $$;
@@ -0,0 +1,14 @@
+-- Removes a prefix from a site, whatever it was learned from. Returns the rows deleted
+
+CREATE OR REPLACE FUNCTION admin.remove_site_local_network(_site_id bigint, _network cidr)
+    RETURNS bigint
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+    DECLARE
+        removed bigint;
+    BEGIN
+        DELETE FROM public.site_local_networks WHERE site_id=_site_id AND network=_network;
+        GET DIAGNOSTICS removed = ROW_COUNT;
+        RETURN removed;
+    END;
+$$;
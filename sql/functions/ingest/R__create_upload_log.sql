@@ -26,8 +26,10 @@ DECLARE
         -- way to determine if the DB server is wrong, and we don't want to reject a message
         -- if a recorder thinks it's in the future
         
-        INSERT INTO recorder_messages(recorder_id, message_type, generated_at, received_at) VALUES 
-            (recorder, upload_type, TO_TIMESTAMP(generated_at_unix_ts), NOW()) RETURNING id INTO rec_msg_id;
+        -- site_id is copied from the recorder so reports can select by site directly
+        INSERT INTO recorder_messages(recorder_id, site_id, message_type, generated_at, received_at) VALUES 
+            (recorder, (SELECT r.site_id FROM recorders AS r WHERE r.id=recorder),
+             upload_type, TO_TIMESTAMP(generated_at_unix_ts), NOW()) RETURNING id INTO rec_msg_id;
 
         -- Also update the last seen date for recorders
         UPDATE recorders SET last_seen = NOW() WHERE id = recorder;
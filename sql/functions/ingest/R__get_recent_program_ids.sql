@@ -0,0 +1,11 @@
+-- Returns the most recently added syslog programs, used to warm the ingest dimension caches
+
+CREATE OR REPLACE FUNCTION ingest.get_recent_program_ids(_limit bigint)
+    RETURNS TABLE (value text, value_id bigint)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT syslog_program::text, id FROM public.syslog_programs
+    WHERE syslog_program IS NOT NULL
+    ORDER BY id DESC
+    LIMIT _limit;
+$$;
@@ -11,7 +11,11 @@ BEGIN
     SELECT id INTO program_id FROM syslog_programs WHERE syslog_program=program;
     IF NOT FOUND THEN
         -- syslog programs are automatically added as they're detected and found
-        INSERT INTO syslog_programs(syslog_program) VALUES (program) RETURNING id INTO program_id;
+        INSERT INTO syslog_programs(syslog_program) VALUES (program)
+            ON CONFLICT DO NOTHING RETURNING id INTO program_id;
+        IF program_id IS NULL THEN
+            SELECT id INTO program_id FROM syslog_programs WHERE syslog_program=program;
+        END IF;
     END IF;
 
     RETURN program_id;
@@ -0,0 +1,21 @@
+-- Bulk version of insert_or_select_program_id. See network_scan.get_or_create_ip_addresses
+-- for what is returned
+
+CREATE OR REPLACE FUNCTION ingest.insert_or_select_program_ids(_programs text[])
+    RETURNS TABLE (value_ordinal bigint, value_id bigint, committed boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO public.syslog_programs(syslog_program)
+        SELECT DISTINCT wanted.program FROM unnest(_programs) AS wanted(program)
+        WHERE wanted.program IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM public.syslog_programs AS sp
+            WHERE sp.syslog_program=wanted.program)
+    ON CONFLICT DO NOTHING;
+
+    RETURN QUERY SELECT wanted.ordinal, sp.id,
+        COALESCE(sp.xmin::text <> (txid_current_if_assigned() % 4294967296)::text, true)
+    FROM unnest(_programs) WITH ORDINALITY AS wanted(program, ordinal)
+    JOIN public.syslog_programs AS sp ON (sp.syslog_program=wanted.program);
+END
+$$;
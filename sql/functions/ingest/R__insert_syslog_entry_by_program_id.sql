@@ -0,0 +1,16 @@
+-- Same as insert_syslog_entry, for when the program has already been resolved to its ID
+-- (see the ingest dimension caches). Entries without a program get NULL for the ID, which
+-- is resolved here like insert_syslog_entry does
+
+CREATE OR REPLACE FUNCTION ingest.insert_syslog_entry_by_program_id(upload_log bigint, recorder_id bigint, unix_ts bigint, program_id bigint, priority public.syslog_priority, pid bigint, host character varying, facility public.syslog_facility, syslog_message text) RETURNS void
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+    BEGIN
+        -- See comment in create upload log about timestamps
+        -- Syslog messages are partitioned on the time their upload was received
+        INSERT INTO syslog_messages (recorder_message_id, recorder_id, logged_at, program_id, pid, host, facility, priority, message, received_at)
+            VALUES (upload_log, recorder_id, TO_TIMESTAMP(unix_ts),
+                    COALESCE(program_id, ingest.insert_or_select_program_id(NULL)), pid, host, facility, priority, syslog_message,
+                    COALESCE((SELECT rm.received_at FROM public.recorder_messages AS rm WHERE rm.id=upload_log), now()));
+    END;
+$$;
@@ -0,0 +1,26 @@
+-- Bulk version of get_baseline_host_by_most_recent_ip_address for reports; maps each of
+-- the given IPs to the human name of the baseline host it was most recently seen as.
+-- IPs without a named baseline host aren't returned.
+
+CREATE OR REPLACE FUNCTION network_scan.get_baseline_host_names_for_site(_site_id bigint,
+                                                                         _ip_addresses text[])
+    RETURNS TABLE (ip_address inet, human_name text)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    RETURN QUERY SELECT DISTINCT ON (nsip.ip_address) nsip.ip_address, bh.human_name
+        FROM network_scan.ip_addresses AS nsip
+        CROSS JOIN LATERAL (
+            SELECT nsh.mac_address_id, nsh.reason, nss.scan_type FROM network_scan.hosts AS nsh
+            JOIN network_scan.scans AS nss ON (nss.id=nsh.scan_id)
+            JOIN public.recorder_messages AS rm ON (rm.id=nss.msg_id)
+            WHERE nsh.ip_address_id=nsip.id AND rm.site_id=_site_id
+            ORDER BY nsh.id DESC LIMIT 10) AS ip_hosts
+        JOIN network_scan.baseline_hosts AS bh ON (bh.site_id=_site_id AND bh.scan_type=ip_hosts.scan_type)
+        JOIN network_scan.hosts AS bhh ON (bhh.id=bh.host_id)
+        WHERE nsip.ip_address = ANY(_ip_addresses::inet[]) AND bh.human_name IS NOT NULL
+            AND (bhh.mac_address_id=ip_hosts.mac_address_id
+                 OR (bhh.reason='localhost-response' AND ip_hosts.reason='localhost-response'))
+        ORDER BY nsip.ip_address, bh.id DESC;
+END
+$$;
@@ -9,7 +9,12 @@ DECLARE
 BEGIN
     SELECT id INTO ip_address_id FROM network_scan.ip_addresses WHERE ip_address=_ip_address;
     IF NOT FOUND THEN
-        INSERT INTO network_scan.ip_addresses(ip_address) VALUES (_ip_address) RETURNING id INTO ip_address_id;
+        -- If another session added it first, pick up its row
+        INSERT INTO network_scan.ip_addresses(ip_address) VALUES (_ip_address)
+            ON CONFLICT DO NOTHING RETURNING id INTO ip_address_id;
+        IF ip_address_id IS NULL THEN
+            SELECT id INTO ip_address_id FROM network_scan.ip_addresses WHERE ip_address=_ip_address;
+        END IF;
     END IF;
 
     RETURN ip_address_id;
@@ -0,0 +1,25 @@
+-- Bulk version of get_or_create_ip_address. Addresses are passed as text (psycopg2 sends
+-- lists as text arrays) and the ID of each is returned with its position in the array.
+--
+-- committed is false for rows written by the calling transaction; those disappear if it
+-- rolls back, so callers mustn't cache their IDs yet
+
+CREATE OR REPLACE FUNCTION network_scan.get_or_create_ip_addresses(_ip_addresses text[])
+    RETURNS TABLE (value_ordinal bigint, value_id bigint, committed boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO network_scan.ip_addresses(ip_address)
+        SELECT DISTINCT wanted.ip_address::inet FROM unnest(_ip_addresses) AS wanted(ip_address)
+        WHERE wanted.ip_address IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM network_scan.ip_addresses AS nsip
+            WHERE nsip.ip_address=wanted.ip_address::inet)
+    ON CONFLICT DO NOTHING;
+
+    -- A new statement also sees the rows other sessions added while we were inserting
+    RETURN QUERY SELECT wanted.ordinal, nsip.id,
+        COALESCE(nsip.xmin::text <> (txid_current_if_assigned() % 4294967296)::text, true)
+    FROM unnest(_ip_addresses) WITH ORDINALITY AS wanted(ip_address, ordinal)
+    JOIN network_scan.ip_addresses AS nsip ON (nsip.ip_address=wanted.ip_address::inet);
+END
+$$;
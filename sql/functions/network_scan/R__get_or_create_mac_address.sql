@@ -11,8 +11,14 @@ BEGIN
     SELECT id, vendor INTO mac_addr_id, vendor_str FROM network_scan.mac_addresses WHERE mac_address=_mac_address;
     IF NOT FOUND THEN
         -- MACs are dynamically added as they're seen across scans
-        INSERT INTO network_scan.mac_addresses(mac_address, vendor) VALUES (_mac_address, _vendor) RETURNING id INTO mac_addr_id;
-        RETURN mac_addr_id;
+        INSERT INTO network_scan.mac_addresses(mac_address, vendor) VALUES (_mac_address, _vendor)
+            ON CONFLICT DO NOTHING RETURNING id INTO mac_addr_id;
+        IF mac_addr_id IS NOT NULL THEN
+            RETURN mac_addr_id;
+        END IF;
+
+        -- Another session added it first
+        SELECT id, vendor INTO mac_addr_id, vendor_str FROM network_scan.mac_addresses WHERE mac_address=_mac_address;
     END IF;
 
     -- If the vendor is NOT NULL, and the vendor in the table is, we'll update it
@@ -0,0 +1,21 @@
+-- Bulk version of get_or_create_mac_address, without vendor information. See
+-- get_or_create_ip_addresses for what is returned
+
+CREATE OR REPLACE FUNCTION network_scan.get_or_create_mac_addresses(_mac_addresses text[])
+    RETURNS TABLE (value_ordinal bigint, value_id bigint, committed boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO network_scan.mac_addresses(mac_address)
+        SELECT DISTINCT wanted.mac_address::macaddr FROM unnest(_mac_addresses) AS wanted(mac_address)
+        WHERE wanted.mac_address IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM network_scan.mac_addresses AS nsmac
+            WHERE nsmac.mac_address=wanted.mac_address::macaddr)
+    ON CONFLICT DO NOTHING;
+
+    RETURN QUERY SELECT wanted.ordinal, nsmac.id,
+        COALESCE(nsmac.xmin::text <> (txid_current_if_assigned() % 4294967296)::text, true)
+    FROM unnest(_mac_addresses) WITH ORDINALITY AS wanted(mac_address, ordinal)
+    JOIN network_scan.mac_addresses AS nsmac ON (nsmac.mac_address=wanted.mac_address::macaddr);
+END
+$$;
@@ -0,0 +1,11 @@
+-- Returns the most recently added IP addresses, used to warm the ingest dimension caches
+
+CREATE OR REPLACE FUNCTION network_scan.get_recent_ip_addresses(_limit bigint)
+    RETURNS TABLE (value text, value_id bigint)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT host(ip_address), id FROM network_scan.ip_addresses
+    WHERE ip_address IS NOT NULL
+    ORDER BY id DESC
+    LIMIT _limit;
+$$;
@@ -0,0 +1,11 @@
+-- Returns the most recently added MAC addresses, used to warm the ingest dimension caches
+
+CREATE OR REPLACE FUNCTION network_scan.get_recent_mac_addresses(_limit bigint)
+    RETURNS TABLE (value text, value_id bigint)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT mac_address::text, id FROM network_scan.mac_addresses
+    WHERE mac_address IS NOT NULL
+    ORDER BY id DESC
+    LIMIT _limit;
+$$;
@@ -16,6 +16,16 @@ BEGIN
         (_scan_json->>'scan_target')::cidr
     ) RETURNING id INTO scan_id;
 
+    -- Discovery scans cover the site's own networks, so remember their targets as local
+    IF (_scan_json->>'scan_type') IN ('arp-discovery', 'nd-discovery', 'ipv6-link-local-discovery')
+        AND (_scan_json->>'scan_target') IS NOT NULL THEN
+        INSERT INTO public.site_local_networks (site_id, network, source)
+            SELECT rm.site_id, (_scan_json->>'scan_target')::cidr, 'scan'
+            FROM public.recorder_messages AS rm
+            WHERE rm.id=_msg_id AND rm.site_id IS NOT NULL
+        ON CONFLICT DO NOTHING;
+    END IF;
+
     -- Step 2: Create hosts based on the scan; we'll tie them to the baseline later
     FOR host IN SELECT * FROM json_array_elements((_scan_json->>'hosts')::json)
     LOOP
@@ -14,45 +14,18 @@ CREATE OR REPLACE FUNCTION snort.create_traffic_report(_message_id bigint,
     RETURNS void
     LANGUAGE plpgsql SECURITY DEFINER
     AS $$
-    DECLARE
-        traffic_log_id bigint;
-        src_ip_address_id bigint;
-        dst_ip_address_id bigint;
-        src_mac_address_id bigint;
-        dst_mac_address_id bigint;
     BEGIN
-    
-        -- For the values that are not NULL, get the IDs for them
-        src_ip_address_id := network_scan.get_or_create_ip_address(_src);
-        dst_ip_address_id := network_scan.get_or_create_ip_address(_dst);
-
-        src_mac_address_id := network_scan.get_or_create_mac_address(_ethsrc, NULL);
-        dst_mac_address_id := network_scan.get_or_create_mac_address(_ethdst, NULL);
-
         -- Technically, we could create port identifiers, but for the moment, I'm going to keep these seperate
         -- as the network scan doesn't handle source/destination port information.
-
-        INSERT INTO snort.traffic_reports (
-            msg_id,
-            dst,
-            src,
-            ethsrc_id,
-            ethdst_id,
-            proto,
-            rxpackets,
-            txpackets,
-            firstseen
-        ) VALUES (
+        PERFORM snort.insert_traffic_report(
             _message_id,
-            dst_ip_address_id,
-            src_ip_address_id,
-            src_mac_address_id,
-            dst_mac_address_id,
+            network_scan.get_or_create_ip_address(_src),
+            network_scan.get_or_create_ip_address(_dst),
+            network_scan.get_or_create_mac_address(_ethsrc, NULL),
+            network_scan.get_or_create_mac_address(_ethdst, NULL),
             _proto,
             _rxpackets,
             _txpackets,
-            TO_TIMESTAMP(_firstseen_ts)
-        );
-
+            _firstseen_ts);
     END;
-$$;
\ No newline at end of file
+$$;
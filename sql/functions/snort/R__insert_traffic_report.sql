@@ -0,0 +1,41 @@
+-- Creates a traffic report for SNORT whose addresses have already been resolved to their
+-- IDs (see the ingest dimension caches). MAC address IDs can be NULL
+
+CREATE OR REPLACE FUNCTION snort.insert_traffic_report(_message_id bigint,
+                                                       _src_ip_id bigint,
+                                                       _dst_ip_id bigint,
+                                                       _ethsrc_id bigint,
+                                                       _ethdst_id bigint,
+                                                       _proto network_scan.port_protocol,
+                                                       _rxpackets bigint,
+                                                       _txpackets bigint,
+                                                       _firstseen_ts numeric)
+    RETURNS void
+    LANGUAGE sql SECURITY DEFINER
+    AS $$
+    INSERT INTO snort.traffic_reports (
+        msg_id,
+        dst,
+        src,
+        ethsrc_id,
+        ethdst_id,
+        proto,
+        rxpackets,
+        txpackets,
+        firstseen,
+        received_at,
+        site_id
+    ) SELECT
+        _message_id,
+        _dst_ip_id,
+        _src_ip_id,
+        _ethsrc_id,
+        _ethdst_id,
+        _proto,
+        _rxpackets,
+        _txpackets,
+        TO_TIMESTAMP(_firstseen_ts),
+        rm.received_at,
+        rm.site_id
+    FROM public.recorder_messages AS rm WHERE rm.id=_message_id;
+$$;
@@ -1,6 +1,9 @@
 -- Creates a traffic report from Tshark Reports
 
--- Hostnames can be null
+-- Hostnames can be null. _flow_count is the number of flows merged into this one by ingest
+DROP FUNCTION IF EXISTS traffic_report.create_traffic_report(bigint, network_scan.port_protocol,
+    inet, text, int, inet, text, int, bigint, bigint, bigint, real);
+
 CREATE OR REPLACE FUNCTION traffic_report.create_traffic_report(_message_id bigint,
                                                                 _protocol network_scan.port_protocol,
                                                                 _src inet,
@@ -12,22 +15,15 @@ CREATE OR REPLACE FUNCTION traffic_report.create_traffic_report(_message_id bigi
                                                                 _rx_bytes bigint,
                                                                 _tx_bytes bigint,
                                                                 _start_ts bigint,
-                                                                _duration real)
+                                                                _duration real,
+                                                                _flow_count int DEFAULT 1)
     RETURNS void
     LANGUAGE plpgsql SECURITY DEFINER
     AS $$
     DECLARE
-        traffic_log_id bigint;
-        src_ip_address_id bigint;
-        dst_ip_address_id bigint;
         src_hostname_id bigint := NULL;
         dst_hostname_id bigint := NULL;
     BEGIN
-    
-        -- For the values that are not NULL, get the IDs for them
-        src_ip_address_id := network_scan.get_or_create_ip_address(_src);
-        dst_ip_address_id := network_scan.get_or_create_ip_address(_dst);
-
         -- If we have a hostname, register it and get it's ID
         if _src_hostname IS NOT NULL THEN
             src_hostname_id := traffic_report.get_or_create_tr_hostname(_src_hostname);
@@ -39,36 +35,19 @@ CREATE OR REPLACE FUNCTION traffic_report.create_traffic_report(_message_id bigi
 
         -- Strictly speaking we could tie this to network scan ports, but that doesn't make
         -- THAT much sense I think since srcports can be randomized
-
-        INSERT INTO traffic_report.traffic_reports (
-            msg_id,
-            protocol,
-            src_ip_id,
-            src_hostname_id,
-            src_port,
-            dst_ip_id,
-            dst_hostname_id,
-            dst_port,
-            rx_bytes,
-            tx_bytes,
-            start_timestamp,
-            duration
-        ) VALUES (
+        PERFORM traffic_report.insert_traffic_report(
             _message_id,
             _protocol,
-            src_ip_address_id,
+            network_scan.get_or_create_ip_address(_src),
             src_hostname_id,
             _src_port,
-            dst_ip_address_id,
+            network_scan.get_or_create_ip_address(_dst),
             dst_hostname_id,
             _dst_port,
             _rx_bytes,
             _tx_bytes,
-            TO_TIMESTAMP(_start_ts),
-            _duration
-        ) RETURNING id INTO traffic_log_id;
-
-    -- Pass it off the plPerl script to do the postprocessing
-    PERFORM traffic_report.handle_postprocessing_tr_entry(traffic_log_id);
+            _start_ts,
+            _duration,
+            _flow_count);
     END;
 $$;
@@ -0,0 +1,53 @@
+-- Streams a site's traffic reports received after _after (and before _before, if given) in
+-- received order, for ndr-export. Rows received in the last _settle_seconds are left for the
+-- next export, so messages still being committed aren't skipped by the watermark. Only the
+-- partitions in range are read
+
+CREATE OR REPLACE FUNCTION traffic_report.export_traffic_for_site(_site_id bigint,
+                                                                  _after timestamp,
+                                                                  _before timestamp,
+                                                                  _settle_seconds int)
+    RETURNS TABLE (id bigint,
+                   received_at timestamp,
+                   msg_id bigint,
+                   protocol text,
+                   src_ip text,
+                   src_hostname text,
+                   src_port int,
+                   dst_ip text,
+                   dst_hostname text,
+                   dst_port int,
+                   rx_bytes bigint,
+                   tx_bytes bigint,
+                   start_timestamp timestamp,
+                   duration real,
+                   flow_count int)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT tr.id,
+        tr.received_at,
+        tr.msg_id,
+        tr.protocol::text,
+        host(nsip_src.ip_address),
+        trsn_src.hostname,
+        tr.src_port,
+        host(nsip_dst.ip_address),
+        trsn_dst.hostname,
+        tr.dst_port,
+        tr.rx_bytes::bigint,
+        tr.tx_bytes::bigint,
+        tr.start_timestamp,
+        tr.duration,
+        tr.flow_count
+    FROM traffic_report.traffic_reports AS tr
+    LEFT JOIN network_scan.ip_addresses AS nsip_src ON (tr.src_ip_id=nsip_src.id)
+    LEFT JOIN network_scan.ip_addresses AS nsip_dst ON (tr.dst_ip_id=nsip_dst.id)
+    LEFT JOIN traffic_report.seen_hostnames AS trsn_src ON (tr.src_hostname_id=trsn_src.id)
+    LEFT JOIN traffic_report.seen_hostnames AS trsn_dst ON (tr.dst_hostname_id=trsn_dst.id)
+    WHERE tr.site_id=_site_id
+    -- Kept to plain comparisons so the partitions out of range are pruned
+    AND tr.received_at > COALESCE(_after, '-infinity'::timestamp)
+    AND tr.received_at < COALESCE(_before, 'infinity'::timestamp)
+    AND tr.received_at <= now()::timestamp - make_interval(secs => _settle_seconds)
+    ORDER BY tr.received_at;
+$$;
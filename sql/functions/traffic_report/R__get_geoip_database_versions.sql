@@ -0,0 +1,13 @@
+-- Returns the version of the IP2Location database used for each IP version; any address
+-- will do, as every lookup returns it
+
+CREATE OR REPLACE FUNCTION traffic_report.get_geoip_database_versions()
+    RETURNS TABLE (ip_version integer, geoip_database_version text)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    -- plpgsql so this can be created before lookup_geoip_for_addresses
+    RETURN QUERY SELECT family(lookup.ip_address), lookup.geoip_database_version
+        FROM traffic_report.lookup_geoip_for_addresses(ARRAY['0.0.0.1'::inet, '::1'::inet]) AS lookup;
+END
+$$;
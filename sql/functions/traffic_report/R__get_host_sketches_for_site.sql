@@ -0,0 +1,18 @@
+-- Returns the daily sketches of a site's machines from _start_day to _end_day inclusive,
+-- optionally only those of one machine
+
+CREATE OR REPLACE FUNCTION traffic_report.get_host_sketches_for_site(_site_id bigint,
+                                                                     _start_day date,
+                                                                     _end_day date,
+                                                                     _local_ip inet)
+    RETURNS TABLE (local_ip text, day date, top_talkers bytea, distinct_destinations bytea)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT host(nsip.ip_address), dhs.day, dhs.top_talkers, dhs.distinct_destinations
+    FROM traffic_report.daily_host_sketches AS dhs
+    JOIN network_scan.ip_addresses AS nsip ON (nsip.id=dhs.local_ip_id)
+    WHERE dhs.site_id=_site_id
+    AND dhs.day BETWEEN _start_day AND _end_day
+    AND (_local_ip IS NULL OR nsip.ip_address=_local_ip)
+    ORDER BY dhs.day;
+$$;
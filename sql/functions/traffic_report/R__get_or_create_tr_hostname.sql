@@ -8,7 +8,12 @@ DECLARE
 BEGIN
     SELECT id INTO hostname_id FROM traffic_report.seen_hostnames WHERE hostname=_hostname;
     IF NOT FOUND THEN
-        INSERT INTO traffic_report.seen_hostnames(hostname) VALUES (_hostname) RETURNING id INTO hostname_id;
+        -- If another session added it first, pick up its row
+        INSERT INTO traffic_report.seen_hostnames(hostname) VALUES (_hostname)
+            ON CONFLICT DO NOTHING RETURNING id INTO hostname_id;
+        IF hostname_id IS NULL THEN
+            SELECT id INTO hostname_id FROM traffic_report.seen_hostnames WHERE hostname=_hostname;
+        END IF;
     END IF;
 
     RETURN hostname_id;
@@ -0,0 +1,21 @@
+-- Bulk version of get_or_create_tr_hostname. See network_scan.get_or_create_ip_addresses
+-- for what is returned
+
+CREATE OR REPLACE FUNCTION traffic_report.get_or_create_tr_hostnames(_hostnames text[])
+    RETURNS TABLE (value_ordinal bigint, value_id bigint, committed boolean)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO traffic_report.seen_hostnames(hostname)
+        SELECT DISTINCT wanted.hostname FROM unnest(_hostnames) AS wanted(hostname)
+        WHERE wanted.hostname IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM traffic_report.seen_hostnames AS trsh
+            WHERE trsh.hostname=wanted.hostname)
+    ON CONFLICT DO NOTHING;
+
+    RETURN QUERY SELECT wanted.ordinal, trsh.id,
+        COALESCE(trsh.xmin::text <> (txid_current_if_assigned() % 4294967296)::text, true)
+    FROM unnest(_hostnames) WITH ORDINALITY AS wanted(hostname, ordinal)
+    JOIN traffic_report.seen_hostnames AS trsh ON (trsh.hostname=wanted.hostname);
+END
+$$;
@@ -0,0 +1,19 @@
+-- Returns the bytes each machine exchanged with each remote host in a traffic report
+-- message, by the day the flows started, for updating the daily host sketches
+
+CREATE OR REPLACE FUNCTION traffic_report.get_outbound_traffic_for_message(_message_id bigint)
+    RETURNS TABLE (site_id bigint, local_ip_id bigint, day date, global_ip text, total_bytes bigint)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT trnot.site_id,
+        trnot.local_ip_id,
+        tr.start_timestamp::date,
+        host(nsip.ip_address),
+        SUM(tr.rx_bytes::bigint + tr.tx_bytes)::bigint
+    FROM traffic_report.traffic_reports AS tr
+    JOIN traffic_report.network_outbound_traffic AS trnot ON (trnot.traffic_report_id=tr.id AND trnot.received_at=tr.received_at)
+    JOIN network_scan.ip_addresses AS nsip ON (nsip.id=trnot.global_ip_id)
+    WHERE tr.msg_id=_message_id
+    AND tr.received_at=(SELECT rm.received_at FROM public.recorder_messages AS rm WHERE rm.id=_message_id)
+    GROUP BY 1, 2, 3, 4;
+$$;
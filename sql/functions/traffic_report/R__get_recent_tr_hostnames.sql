@@ -0,0 +1,10 @@
+-- Returns the most recently seen hostnames, used to warm the ingest dimension caches
+
+CREATE OR REPLACE FUNCTION traffic_report.get_recent_tr_hostnames(_limit bigint)
+    RETURNS TABLE (value text, value_id bigint)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT hostname, id FROM traffic_report.seen_hostnames
+    ORDER BY id DESC
+    LIMIT _limit;
+$$;
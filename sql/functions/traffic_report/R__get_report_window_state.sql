@@ -0,0 +1,28 @@
+-- Returns how many traffic report messages a site has received in a period and the newest
+-- one's ID, along with how many times the GeoIP backfill re-enriched flows of the hours the
+-- period touches. Cached report snapshots of the period are stale once any of that changes,
+-- i.e. a late message arrived or the backfill refreshed the flows. Read from the
+-- (site_id, received_at) index of recorder_messages and the (site_id, hour) key of
+-- geoip_reenriched_hours
+
+DROP FUNCTION IF EXISTS traffic_report.get_report_window_state(bigint, timestamp, timestamp);
+CREATE FUNCTION traffic_report.get_report_window_state(_site_id bigint, _start_timestamp timestamp, _end_timestamp timestamp)
+    RETURNS TABLE (message_count bigint,
+                   last_message_id bigint,
+                   geoip_reenrichments bigint)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT messages.message_count, messages.last_message_id, reenriched.geoip_reenrichments
+    FROM (
+        SELECT COUNT(*) AS message_count, COALESCE(MAX(rm.id), 0) AS last_message_id
+        FROM public.recorder_messages AS rm
+        WHERE rm.site_id=_site_id
+        AND rm.received_at >= _start_timestamp AND rm.received_at <= _end_timestamp
+        AND rm.message_type='traffic_report'
+    ) AS messages, (
+        SELECT COALESCE(SUM(grh.reenrichments), 0)::bigint AS geoip_reenrichments
+        FROM traffic_report.geoip_reenriched_hours AS grh
+        WHERE grh.site_id=_site_id
+        AND grh.hour >= date_trunc('hour', _start_timestamp) AND grh.hour <= _end_timestamp
+    ) AS reenriched;
+$$;
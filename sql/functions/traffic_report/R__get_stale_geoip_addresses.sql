@@ -0,0 +1,21 @@
+-- Returns global addresses (after _after_id, in ID order) with flows enriched by a GeoIP
+-- database other than the current one for their IP version
+
+CREATE OR REPLACE FUNCTION traffic_report.get_stale_geoip_addresses(_v4_version text,
+                                                                     _v6_version text,
+                                                                     _after_id bigint,
+                                                                     _limit bigint)
+    RETURNS TABLE (ip_address_id bigint, ip_address inet)
+    LANGUAGE sql STABLE SECURITY DEFINER
+    AS $$
+    SELECT nsip.id, nsip.ip_address FROM network_scan.ip_addresses AS nsip
+    WHERE nsip.id > _after_id
+    AND EXISTS (
+        SELECT 1 FROM traffic_report.network_outbound_traffic AS trnot
+        WHERE trnot.global_ip_id=nsip.id
+        AND trnot.geoip_database_version <>
+            CASE family(nsip.ip_address) WHEN 4 THEN _v4_version ELSE _v6_version END
+    )
+    ORDER BY nsip.id
+    LIMIT _limit;
+$$;
@@ -1,7 +1,11 @@
 -- This handles post-processing routines for handling of a row entry including linking it
 -- to an external address table for quick and easy lookup of information
+--
+-- The received_at of the row is passed along so lookups only touch its partition
 
-CREATE OR REPLACE FUNCTION traffic_report.handle_postprocessing_tr_entry(_tr_row bigint) 
+DROP FUNCTION IF EXISTS traffic_report.handle_postprocessing_tr_entry(bigint);
+
+CREATE OR REPLACE FUNCTION traffic_report.handle_postprocessing_tr_entry(_tr_row bigint, _received_at timestamp) 
     RETURNS void
     LANGUAGE plperlu SECURITY DEFINER
     AS $$
@@ -10,12 +14,13 @@ use strict;
 use warnings;
 
 use Net::IP;
-use Geo::IP2Location;
 
 # First we need to grab the Traffic Report Entry that just got inserted and get it's magic
-my $sth = spi_query("SELECT * FROM traffic_report.flattened_traffic_reports WHERE id=$_[0]");
-my $tr_row = spi_fetchrow($sth);
-spi_cursor_close($sth);
+my $tr_plan = spi_prepare('SELECT * FROM traffic_report.flattened_traffic_reports WHERE id=$1 AND received_at=$2',
+                          'bigint', 'timestamp');
+my $tr_rows = spi_exec_prepared($tr_plan, {limit => 1}, $_[0], $_[1]);
+my $tr_row = $tr_rows->{rows}[0];
+spi_freeplan($tr_plan);
 
 if (! defined $tr_row) {
     elog(ERROR, "unable to find STR row ID $_[0]!");
@@ -24,13 +29,88 @@ if (! defined $tr_row) {
 my $src_ip = new Net::IP($tr_row->{'src_ip'}) || elog(ERROR, "Net::IP died on src_ip $tr_row->{'src'}");
 my $dst_ip = new Net::IP($tr_row->{'dst_ip'})  || elog(ERROR, "Net::IP died on dst_ip $tr_row->{'dst'}");
 
-# We're only interested in PRIVATE->PUBLIC communications. If we get a PUBLIC-PUBLIC result,
-# that means that we're dealing with IPv6, or a non-RFC1918 complaint IPv4 network which we
-# currently will explode for due to the fact that we don't have a record of the recorder's
-# network CIDRs so we can't determine which end is which as of yet
+# The site's internal prefixes (from discovery scans and administrators) as sorted, merged
+# [first, last] address ranges per IP version. They're kept in the backend for a minute so
+# each row doesn't go back to the table
+sub site_local_ranges {
+    my $site_id = shift;
+    my $cached = $_SHARED{'site_local_ranges'}{$site_id};
+    if (defined $cached && time() - $cached->{'loaded_at'} < 60) {
+        return $cached->{'ranges'};
+    }
+
+    my %networks = (4 => [], 6 => []);
+    my $networks_plan = spi_prepare('SELECT network FROM admin.get_local_networks_for_site($1)',
+                                    'bigint');
+    my $networks_rows = spi_exec_prepared($networks_plan, $site_id);
+    spi_freeplan($networks_plan);
+
+    foreach my $row (@{$networks_rows->{rows}}) {
+        my $network = new Net::IP($row->{'network'}) || elog(ERROR, "Net::IP died on network $row->{'network'}");
+        push @{$networks{$network->version()}}, [$network->intip(), $network->last_int()];
+    }
+
+    my %ranges;
+    foreach my $version (4, 6) {
+        my @merged;
+        foreach my $range (sort { $a->[0] <=> $b->[0] } @{$networks{$version}}) {
+            if (@merged && $range->[0] <= $merged[-1][1] + 1) {
+                $merged[-1][1] = $range->[1] if $range->[1] > $merged[-1][1];
+            } else {
+                push @merged, [$range->[0], $range->[1]];
+            }
+        }
+        $ranges{$version} = \@merged;
+    }
+
+    $_SHARED{'site_local_ranges'}{$site_id} = {'loaded_at' => time(), 'ranges' => \%ranges};
+    return \%ranges;
+}
+
+# Binary search of the site's ranges
+sub in_site_ranges {
+    my ($ranges, $ip) = @_;
+    my $version_ranges = $ranges->{$ip->version()};
+    my $address = $ip->intip();
+
+    my ($low, $high) = (0, $#{$version_ranges});
+    while ($low <= $high) {
+        my $middle = int(($low + $high) / 2);
+        if ($address < $version_ranges->[$middle][0]) {
+            $high = $middle - 1;
+        } elsif ($address > $version_ranges->[$middle][1]) {
+            $low = $middle + 1;
+        } else {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+# We're only interested in LOCAL->GLOBAL communications. Addresses in the site's networks
+# are local even if they're public (or IPv6); otherwise private addresses are local and
+# public ones global. A PUBLIC-PUBLIC flow with neither end in the site's networks can't be
+# sorted out, as we don't know which end is the recorder's, so it's skipped rather than
+# failing the rest of the message
+
+my $site_ranges = site_local_ranges($tr_row->{'site_id'});
+
+sub address_class {
+    my ($ranges, $ip) = @_;
+    my $ip_type = $ip->iptype();
 
-my $src_ip_type = $src_ip->iptype();
-my $dst_ip_type = $dst_ip->iptype();
+    if (in_site_ranges($ranges, $ip)) {
+        return 'LOCAL';
+    } elsif ($ip_type eq 'PRIVATE' || $ip_type eq 'UNIQUE-LOCAL-UNICAST') {
+        return 'LOCAL';
+    } elsif ($ip_type eq 'PUBLIC' || $ip_type eq 'GLOBAL-UNICAST') {
+        return 'GLOBAL';
+    }
+    return 'OTHER';
+}
+
+my $src_ip_class = address_class($site_ranges, $src_ip);
+my $dst_ip_class = address_class($site_ranges, $dst_ip);
 
 my $global_ip = undef;
 my $local_ip = undef;
@@ -41,22 +121,24 @@ my $global_hostname_id = undef;
 my $local_ip_id = undef;
 
 # Outbound connections
-if ($src_ip_type eq 'PRIVATE' && $dst_ip_type eq 'PUBLIC') {
+if ($src_ip_class eq 'LOCAL' && $dst_ip_class eq 'GLOBAL') {
     $global_ip = $dst_ip->ip();
     $global_ip_id = $tr_row->{'dst_ip_id'};
     $global_hostname_id = $tr_row->{'dst_hostname_id'};
     $local_ip = $src_ip->ip();
     $local_ip_id = $tr_row->{'src_ip_id'};
     #elog(WARNING, "Outbound connection");
-} elsif ($src_ip_type eq 'PUBLIC' && $dst_ip_type eq 'PRIVATE') {
+} elsif ($src_ip_class eq 'GLOBAL' && $dst_ip_class eq 'LOCAL') {
     $global_ip = $src_ip->ip();
     $global_ip_id = $tr_row->{'src_ip_id'};
     $global_hostname_id = $tr_row->{'src_hostname_id'};
     $local_ip = $dst_ip->ip();
     $local_ip_id = $tr_row->{'dst_ip_id'};
     #elog(WARNING, "Inbound connection");
-} elsif ($src_ip_type eq 'PUBLIC' && $dst_ip_type eq 'PUBLIC') {
-    elog(ERROR, "PUBLIC-PUBLIC connections not supported!");
+} elsif ($src_ip_class eq 'GLOBAL' && $dst_ip_class eq 'GLOBAL') {
+    elog(WARNING, "skipping PUBLIC-PUBLIC connection " . $src_ip->ip() . " <-> " . $dst_ip->ip() .
+                  " outside of the site's local networks");
+    return;
 } else {
     #elog(WARNING, "Non-internet facing connection, nothing to be done");
     return;
@@ -65,73 +147,25 @@ if ($src_ip_type eq 'PRIVATE' && $dst_ip_type eq 'PUBLIC') {
 #elog(INFO, "Global IP: ".$global_ip);
 #elog(INFO, "Local IP: ".$local_ip);
 
-# Load the correct GeoIP database depending on if this a v4 or v6 operation
-my $geodb;
-my $geodb_version;
-
-# HACK - this paths shouldn't be hardcoded
-
-if ($src_ip->version() == '4') {
-    $geodb = Geo::IP2Location->open("/etc/ndr/ip2location/DB7_v4.bin");
-    $geodb_version = $geodb->get_database_version();
-} elsif ($src_ip->version() == '6') {
-    $geodb = Geo::IP2Location->open("/etc/ndr/ip2location/DB7_v6.bin");
-    $geodb_version = $geodb->get_database_version();
-} else {
-    elog(ERROR, "Received impossible IP version");
-}
+# Look the global IP up; the GeoIP databases stay open in the backend between rows
+my $geoip_plan = spi_prepare('SELECT * FROM traffic_report.lookup_geoip_for_addresses(ARRAY[$1::inet])',
+                             'text');
+my $geoip_row = spi_exec_prepared($geoip_plan, $global_ip)->{rows}[0];
+spi_freeplan($geoip_plan);
 
-# Get the GeoIP information from the database
-
-# If we get an unknown response from Geo::IP2Location, replace it with a NULL entry
-sub replace_unknown_with_null {
-    my $value = shift;
-    if ($value eq Geo::IP2Location::UNKNOWN) {
-        return undef;
-    } else {
-        return $value;
-    }
-}
-
-# ARGH!. So when we're using the demo database, shat breaks. Get country() will error out if 
-# we query an IP that it doesn't have. Testing, region, and city will return a string like
-# This is demo DB7 BIN database. Please evaluate IP address from ...
-
-# The string varies depending on which demo databae and if it's v4 or v6 so right now
-# WE MUST EMBRACE THE SUCK. Set the values we care about to undef; that will map to postgrs
-# NULL type, then we see if we can get actual return information safely
-
-my $countryshort = undef;
-my $countrylong = undef;
-my $region = undef;
-my $city = undef;
-my $isp = undef;
-my $domain = undef;
-
-unless ($geodb->get_region($global_ip) =~ "You can evaluate IP address from") {
-    $countryshort = replace_unknown_with_null($geodb->get_country_short($global_ip));
-    $countrylong = replace_unknown_with_null($geodb->get_country_long($global_ip));
-    $region = replace_unknown_with_null($geodb->get_region($global_ip));
-    $city = replace_unknown_with_null($geodb->get_city($global_ip));
-    $isp = replace_unknown_with_null($geodb->get_isp($global_ip));
-    $domain = replace_unknown_with_null($geodb->get_domain($global_ip));
-
-    #elog(INFO, "DB Version ".$geodb_version);
-    #elog(INFO, "Country Short: $countryshort");
-    #elog(INFO, "Country Long: $countrylong");
-    #elog(INFO, "Region: $region");
-    #elog(INFO, "City: $city");
-    #elog(INFO, "ISP: $isp");
-    #elog(INFO, "Domain: $domain");
-} else {
-    elog(WARNING, "Out of range for demo database.");
-}
+my $geodb_version = $geoip_row->{'geoip_database_version'};
+my $countryshort = $geoip_row->{'country_code'};
+my $countrylong = $geoip_row->{'country_name'};
+my $region = $geoip_row->{'region_name'};
+my $city = $geoip_row->{'city_name'};
+my $isp = $geoip_row->{'isp'};
+my $domain = $geoip_row->{'domain'};
 
 # If there was a hostname attached with the global IP, we need to register it
 if (defined $global_hostname_id) {
-    my $register_proc = 'SELECT * FROM traffic_report.register_internet_hostname_from_tr($1, $2, $3)';
-    my $register_sp = spi_prepare($register_proc, 'bigint', 'bigint', 'bigint');
-    spi_exec_prepared($register_sp, $_[0], $global_ip_id, $global_hostname_id);
+    my $register_proc = 'SELECT * FROM traffic_report.register_internet_hostname_from_tr($1, $2, $3, $4)';
+    my $register_sp = spi_prepare($register_proc, 'bigint', 'timestamp', 'bigint', 'bigint');
+    spi_exec_prepared($register_sp, $_[0], $_[1], $global_ip_id, $global_hostname_id);
     spi_freeplan($register_sp);
 }
 
@@ -151,8 +185,10 @@ INSERT INTO traffic_report.network_outbound_traffic
      region_name,
      city_name,
      isp,
-     domain)
-     VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+     domain,
+     received_at,
+     site_id)
+     VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
 EOF
 
 my $noi_insert_plan = spi_prepare($network_outbound_traffic_insert,
@@ -166,7 +202,9 @@ my $noi_insert_plan = spi_prepare($network_outbound_traffic_insert,
                                   'text',
                                   'text',
                                   'text',
-                                  'text');
+                                  'text',
+                                  'timestamp',
+                                  'bigint');
 
 spi_exec_prepared($noi_insert_plan,
                   $tr_row->{'id'},
@@ -179,6 +217,8 @@ spi_exec_prepared($noi_insert_plan,
                   $region,
                   $city,
                   $isp,
-                  $domain);
+                  $domain,
+                  $tr_row->{'received_at'},
+                  $tr_row->{'site_id'});
 spi_freeplan($noi_insert_plan);
 $$
\ No newline at end of file
@@ -0,0 +1,67 @@
+-- Creates a traffic report from Tshark Reports whose addresses and hostnames have already
+-- been resolved to their IDs (see the ingest dimension caches). Hostname IDs can be null
+
+CREATE OR REPLACE FUNCTION traffic_report.insert_traffic_report(_message_id bigint,
+                                                                _protocol network_scan.port_protocol,
+                                                                _src_ip_id bigint,
+                                                                _src_hostname_id bigint,
+                                                                _src_port int,
+                                                                _dst_ip_id bigint,
+                                                                _dst_hostname_id bigint,
+                                                                _dst_port int,
+                                                                _rx_bytes bigint,
+                                                                _tx_bytes bigint,
+                                                                _start_ts bigint,
+                                                                _duration real,
+                                                                _flow_count int DEFAULT 1)
+    RETURNS void
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+    DECLARE
+        traffic_log_id bigint;
+        msg_received_at timestamp;
+        msg_site_id bigint;
+    BEGIN
+        -- Traffic reports are partitioned on the time their message was received, and
+        -- carry the site so reports don't have to go through the messages
+        SELECT received_at, site_id INTO msg_received_at, msg_site_id
+            FROM public.recorder_messages WHERE id=_message_id;
+
+        INSERT INTO traffic_report.traffic_reports (
+            msg_id,
+            protocol,
+            src_ip_id,
+            src_hostname_id,
+            src_port,
+            dst_ip_id,
+            dst_hostname_id,
+            dst_port,
+            rx_bytes,
+            tx_bytes,
+            start_timestamp,
+            duration,
+            received_at,
+            site_id,
+            flow_count
+        ) VALUES (
+            _message_id,
+            _protocol,
+            _src_ip_id,
+            _src_hostname_id,
+            _src_port,
+            _dst_ip_id,
+            _dst_hostname_id,
+            _dst_port,
+            _rx_bytes,
+            _tx_bytes,
+            TO_TIMESTAMP(_start_ts),
+            _duration,
+            msg_received_at,
+            msg_site_id,
+            _flow_count
+        ) RETURNING id INTO traffic_log_id;
+
+    -- Pass it off the plPerl script to do the postprocessing
+    PERFORM traffic_report.handle_postprocessing_tr_entry(traffic_log_id, msg_received_at);
+    END;
+$$;
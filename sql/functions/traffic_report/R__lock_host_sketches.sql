@@ -0,0 +1,21 @@
+-- Returns the daily sketches of a site's machines, locked until the end of the transaction
+-- so concurrent ingests take turns updating them. Missing ones are created empty first
+
+CREATE OR REPLACE FUNCTION traffic_report.lock_host_sketches(_site_id bigint,
+                                                             _day date,
+                                                             _local_ip_ids bigint[])
+    RETURNS TABLE (local_ip_id bigint, top_talkers bytea, distinct_destinations bytea)
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+BEGIN
+    INSERT INTO traffic_report.daily_host_sketches(site_id, local_ip_id, day)
+        SELECT _site_id, wanted.local_ip_id, _day FROM unnest(_local_ip_ids) AS wanted(local_ip_id)
+    ON CONFLICT DO NOTHING;
+
+    RETURN QUERY SELECT dhs.local_ip_id, dhs.top_talkers, dhs.distinct_destinations
+        FROM traffic_report.daily_host_sketches AS dhs
+        WHERE dhs.site_id=_site_id AND dhs.day=_day AND dhs.local_ip_id = ANY(_local_ip_ids)
+        ORDER BY dhs.local_ip_id
+        FOR UPDATE;
+END
+$$;
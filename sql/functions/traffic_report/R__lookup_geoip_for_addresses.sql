@@ -0,0 +1,88 @@
+-- Looks addresses up in the IP2Location databases, returning what handle_postprocessing_tr_entry
+-- stores for each. The databases are opened once per backend (and again if the files are
+-- replaced) rather than once per call
+
+CREATE OR REPLACE FUNCTION traffic_report.lookup_geoip_for_addresses(_ip_addresses inet[])
+    RETURNS TABLE (ip_address inet,
+                   geoip_database_version text,
+                   country_code text,
+                   country_name text,
+                   region_name text,
+                   city_name text,
+                   isp text,
+                   domain text)
+    LANGUAGE plperlu SECURITY DEFINER
+    AS $$
+
+use strict;
+use warnings;
+
+use Geo::IP2Location;
+
+# HACK - this paths shouldn't be hardcoded
+sub open_geodb {
+    my ($ip_version, $path) = @_;
+    my $mtime = (stat($path))[9] // 0;
+
+    my $cached = $_SHARED{'ip2location'}{$ip_version};
+    if (! defined $cached || $cached->{'mtime'} != $mtime) {
+        my $geodb = Geo::IP2Location->open($path) || elog(ERROR, "Unable to open $path");
+        $cached = {
+            'mtime' => $mtime,
+            'geodb' => $geodb,
+            'version' => $geodb->get_database_version()
+        };
+        $_SHARED{'ip2location'}{$ip_version} = $cached;
+    }
+
+    return $cached;
+}
+
+# If we get an unknown response from Geo::IP2Location, replace it with a NULL entry
+sub replace_unknown_with_null {
+    my $value = shift;
+    if ($value eq Geo::IP2Location::UNKNOWN) {
+        return undef;
+    } else {
+        return $value;
+    }
+}
+
+foreach my $ip_address (@{$_[0]}) {
+    my $geodb;
+    if (index($ip_address, ':') == -1) {
+        $geodb = open_geodb(4, "/etc/ndr/ip2location/DB7_v4.bin");
+    } else {
+        $geodb = open_geodb(6, "/etc/ndr/ip2location/DB7_v6.bin");
+    }
+
+    my %result = (
+        'ip_address' => $ip_address,
+        'geoip_database_version' => $geodb->{'version'},
+        'country_code' => undef,
+        'country_name' => undef,
+        'region_name' => undef,
+        'city_name' => undef,
+        'isp' => undef,
+        'domain' => undef
+    );
+
+    # The demo databases answer anything they don't cover with a message in the region
+    # (and die on country()), so those addresses are left NULL
+    my $reader = $geodb->{'geodb'};
+    unless ($reader->get_region($ip_address) =~ "You can evaluate IP address from") {
+        $result{'country_code'} = replace_unknown_with_null($reader->get_country_short($ip_address));
+        $result{'country_name'} = replace_unknown_with_null($reader->get_country_long($ip_address));
+        $result{'region_name'} = replace_unknown_with_null($reader->get_region($ip_address));
+        $result{'city_name'} = replace_unknown_with_null($reader->get_city($ip_address));
+        $result{'isp'} = replace_unknown_with_null($reader->get_isp($ip_address));
+        $result{'domain'} = replace_unknown_with_null($reader->get_domain($ip_address));
+    } else {
+        elog(WARNING, "Out of range for demo database.");
+    }
+
+    return_next(\%result);
+}
+
+return undef;
+$$;
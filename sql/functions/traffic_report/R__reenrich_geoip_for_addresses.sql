@@ -0,0 +1,97 @@
+-- Looks a batch of global addresses up again, and updates their outbound flows that were
+-- enriched with a different GeoIP database in one statement. The hourly rollups are keyed
+-- on the GeoIP fields, so the rollup groups of the updated flows are rebuilt from them, and
+-- the hours are marked in geoip_reenriched_hours for the report snapshot cache.
+-- Returns the flows updated
+
+CREATE OR REPLACE FUNCTION traffic_report.reenrich_geoip_for_addresses(_ip_address_ids bigint[])
+    RETURNS bigint
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    updated bigint;
+BEGIN
+    -- The (site, hour, machine, address) rollup groups whose flows change. Only those are
+    -- rebuilt; rollups of hours whose raw flows have expired are left alone
+    CREATE TEMP TABLE IF NOT EXISTS reenriched_rollup_groups (
+        site_id bigint,
+        hour timestamp,
+        local_ip_id bigint,
+        global_ip_id bigint,
+        flows bigint
+    ) ON COMMIT DROP;
+    TRUNCATE reenriched_rollup_groups;
+
+    WITH lookups AS (
+        SELECT nsip.id AS ip_address_id, lookup.*
+        FROM traffic_report.lookup_geoip_for_addresses(
+            ARRAY(SELECT nsip_in.ip_address FROM network_scan.ip_addresses AS nsip_in
+                  WHERE nsip_in.id = ANY(_ip_address_ids))) AS lookup
+        JOIN network_scan.ip_addresses AS nsip ON (nsip.ip_address=lookup.ip_address)
+        WHERE nsip.id = ANY(_ip_address_ids)
+    ), updated_flows AS (
+        UPDATE traffic_report.network_outbound_traffic AS trnot SET
+            geoip_database_version=lookups.geoip_database_version,
+            country_code=lookups.country_code,
+            country_name=lookups.country_name,
+            region_name=lookups.region_name,
+            city_name=lookups.city_name,
+            isp=lookups.isp,
+            domain=lookups.domain
+        FROM lookups
+        WHERE trnot.global_ip_id=lookups.ip_address_id
+        AND trnot.geoip_database_version <> lookups.geoip_database_version
+        RETURNING trnot.site_id, date_trunc('hour', trnot.received_at) AS hour,
+            trnot.local_ip_id, trnot.global_ip_id
+    )
+    INSERT INTO reenriched_rollup_groups
+        SELECT uf.site_id, uf.hour, uf.local_ip_id, uf.global_ip_id, COUNT(*)
+        FROM updated_flows AS uf
+        GROUP BY 1, 2, 3, 4;
+
+    SELECT COALESCE(SUM(rrg.flows), 0) INTO updated FROM reenriched_rollup_groups AS rrg;
+    IF updated = 0 THEN
+        RETURN 0;
+    END IF;
+
+    INSERT INTO traffic_report.geoip_reenriched_hours AS grh
+        SELECT DISTINCT rrg.site_id, rrg.hour, 1 FROM reenriched_rollup_groups AS rrg
+    ON CONFLICT (site_id, hour)
+    DO UPDATE SET reenrichments = grh.reenrichments + 1;
+
+    DELETE FROM traffic_report.hourly_traffic_rollups AS htr
+        USING reenriched_rollup_groups AS rrg
+        WHERE htr.site_id=rrg.site_id AND htr.hour=rrg.hour
+        AND htr.local_ip_id=rrg.local_ip_id AND htr.global_ip_id=rrg.global_ip_id;
+
+    -- Ingest upserts the same groups; a message committing after the DELETE is already in
+    -- the raw flows summed here, so its rollup row is replaced rather than added to
+    INSERT INTO traffic_report.hourly_traffic_rollups
+        SELECT trnot.site_id,
+            date_trunc('hour', trnot.received_at),
+            trnot.local_ip_id,
+            trnot.global_ip_id,
+            COALESCE(trnot.country_name, 'Unknown'),
+            COALESCE(trnot.region_name, 'Unknown'),
+            COALESCE(trnot.city_name, 'Unknown'),
+            COALESCE(trnot.isp, 'Unknown'),
+            COALESCE(trnot.domain, 'Unknown'),
+            SUM(tr.rx_bytes),
+            SUM(tr.tx_bytes),
+            SUM(tr.flow_count)
+        FROM reenriched_rollup_groups AS rrg
+        JOIN traffic_report.network_outbound_traffic AS trnot ON (
+            trnot.site_id=rrg.site_id AND trnot.local_ip_id=rrg.local_ip_id
+            AND trnot.global_ip_id=rrg.global_ip_id
+            AND trnot.received_at >= rrg.hour AND trnot.received_at < rrg.hour + interval '1 hour')
+        JOIN traffic_report.traffic_reports AS tr ON (tr.id=trnot.traffic_report_id AND tr.received_at=trnot.received_at)
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+    ON CONFLICT (site_id, hour, local_ip_id, global_ip_id, country_name, region_name, city_name, isp, domain)
+    DO UPDATE SET
+        total_rx_bytes = EXCLUDED.total_rx_bytes,
+        total_tx_bytes = EXCLUDED.total_tx_bytes,
+        flows = EXCLUDED.flows;
+
+    RETURN updated;
+END
+$$;
@@ -2,7 +2,10 @@
 -- works on a traffic_report.hostname id, and updates the hostname seen date if it doesn't already
 -- exist
 
+DROP FUNCTION IF EXISTS traffic_report.register_internet_hostname_from_tr(bigint, bigint, bigint);
+
 CREATE OR REPLACE FUNCTION traffic_report.register_internet_hostname_from_tr(_traffic_report_id bigint,
+                                                                            _received_at timestamp,
                                                                             _ip_id bigint,
                                                                             _hostname_id bigint
     ) RETURNS void
@@ -23,7 +26,7 @@ BEGIN
     END IF;
 
     -- Link the domain entry to the traffic report
-    INSERT INTO traffic_report.traffic_report_internet_hostnames (traffic_report_id, internet_hostname_id)
-        VALUES (_traffic_report_id, int_hostname_id);
+    INSERT INTO traffic_report.traffic_report_internet_hostnames (traffic_report_id, internet_hostname_id, received_at)
+        VALUES (_traffic_report_id, int_hostname_id, _received_at);
 END
 $$;
\ No newline at end of file
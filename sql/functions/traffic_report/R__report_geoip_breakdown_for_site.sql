@@ -9,34 +9,15 @@ CREATE OR REPLACE FUNCTION traffic_report.report_geoip_breakdown_for_site(_site_
     )
     LANGUAGE plpgsql SECURITY DEFINER
     AS $$
-DECLARE
-    recorder_ids bigint[];
-    recorder_id bigint;
-    msg_ids bigint[];
 BEGIN
-    -- Retrieve all the recorders in the site
-    recorder_ids := admin.get_all_recorders_ids_in_site(_site_id);
-    FOREACH recorder_id IN ARRAY recorder_ids LOOP
-        msg_ids := array_cat(
-            msg_ids, 
-            admin.get_recorder_message_ids_recieved_in_period(
-                recorder_id,
-                'traffic_report',
-                _start_timestamp,
-                _end_timestamp
-            )
-        );
-    END LOOP;
-
-    RETURN QUERY 
-        SELECT 
-            COALESCE(fot.country_name, 'Unknown'),
-            COALESCE(fot.region_name, 'Unknown'),
-            SUM(tr.rx_bytes) AS rx_bytes_total,
-            SUM(tr.tx_bytes) AS tx_bytes_total
-        FROM traffic_report.full_outbound_traffic AS fot 
-        LEFT JOIN traffic_report.traffic_reports AS tr ON (tr.id=fot.traffic_report_id)
-        WHERE tr.msg_id = ANY(msg_ids)
-        GROUP BY (fot.country_name, fot.region_name);
+    -- Whole hours are read from the rollups, see traffic_totals_for_site
+    RETURN QUERY
+        SELECT
+            tt.country_name,
+            tt.region_name,
+            SUM(tt.total_rx_bytes)::bigint AS rx_bytes_total,
+            SUM(tt.total_tx_bytes)::bigint AS tx_bytes_total
+        FROM traffic_report.traffic_totals_for_site(_site_id, _start_timestamp, _end_timestamp) AS tt
+        GROUP BY (tt.country_name, tt.region_name);
 END;
 $$;
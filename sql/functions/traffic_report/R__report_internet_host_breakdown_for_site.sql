@@ -1,38 +1,30 @@
+-- The bytes exchanged with each host were added so reports can show only the top hosts;
+-- the return type changed, so the old function has to go first
+DROP FUNCTION IF EXISTS traffic_report.report_internet_host_breakdown_for_site(bigint, timestamp, timestamp);
+
 CREATE OR REPLACE FUNCTION traffic_report.report_internet_host_breakdown_for_site(_site_id bigint, _start_timestamp timestamp, _end_timestamp timestamp)
     RETURNS TABLE (
         local_ip inet,
         global_ip inet,
         global_hostname text,
-        isp text
+        isp text,
+        total_rx_bytes bigint,
+        total_tx_bytes bigint
     )
     LANGUAGE plpgsql SECURITY DEFINER
     AS $$
-DECLARE
-    -- Breaks down traffic based by incoming machine and what not
-    recorder_ids bigint[];
-    recorder_id bigint;
-    msg_ids bigint[];
 BEGIN
-    -- Retrieve all the recorders in the site
-    recorder_ids := admin.get_all_recorders_ids_in_site(_site_id);
-    FOREACH recorder_id IN ARRAY recorder_ids LOOP
-        msg_ids := array_cat(
-            msg_ids, 
-            admin.get_recorder_message_ids_recieved_in_period(
-                recorder_id,
-                'traffic_report',
-                _start_timestamp,
-                _end_timestamp
-            )
-        );
-    END LOOP;
-
-    -- Get the message IDs for this period
-
+    -- Breaks down traffic based by incoming machine and what not
     RETURN QUERY 
-        SELECT DISTINCT fot.local_ip, fot.global_ip, fot.global_hostname, fot.isp
+        SELECT fot.local_ip, fot.global_ip, fot.global_hostname, fot.isp,
+            SUM(tr.rx_bytes)::bigint, SUM(tr.tx_bytes)::bigint
         FROM traffic_report.full_outbound_traffic AS fot 
-        LEFT JOIN traffic_report.traffic_reports AS tr ON (tr.id=fot.traffic_report_id)
-        WHERE tr.msg_id = ANY(msg_ids);
+        JOIN traffic_report.traffic_reports AS tr ON (tr.id=fot.traffic_report_id AND tr.received_at=fot.received_at)
+        -- Both sides are range scans on (site_id, received_at) in the period's partitions
+        WHERE fot.site_id = _site_id
+        AND fot.received_at >= _start_timestamp AND fot.received_at <= _end_timestamp
+        AND tr.site_id = _site_id
+        AND tr.received_at >= _start_timestamp AND tr.received_at <= _end_timestamp
+        GROUP BY fot.local_ip, fot.global_ip, fot.global_hostname, fot.isp;
 END;
 $$
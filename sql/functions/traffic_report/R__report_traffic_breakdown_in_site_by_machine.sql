@@ -8,35 +8,17 @@ CREATE OR REPLACE FUNCTION traffic_report.report_traffic_breakdown_in_site_by_ma
     )
     LANGUAGE plpgsql SECURITY DEFINER
     AS $$
-DECLARE
-    recorder_ids bigint[];
-    recorder_id bigint;
-    msg_ids bigint[];
 BEGIN
-    -- Retrieve all the recorders in the site
-    recorder_ids := admin.get_all_recorders_ids_in_site(_site_id);
-    FOREACH recorder_id IN ARRAY recorder_ids LOOP
-        msg_ids := array_cat(
-            msg_ids, 
-            admin.get_recorder_message_ids_recieved_in_period(
-                recorder_id,
-                'traffic_report',
-                _start_timestamp,
-                _end_timestamp
-            )
-        );
-    END LOOP;
-
-    RETURN QUERY 
-        SELECT 
-            fot.local_ip,
-            COALESCE(fot.country_name, 'Unknown'),
-            COALESCE(fot.region_name, 'Unknown'),
-            SUM(tr.rx_bytes) AS rx_bytes_total,
-            SUM(tr.tx_bytes) AS tx_bytes_total
-        FROM traffic_report.full_outbound_traffic AS fot 
-        LEFT JOIN traffic_report.traffic_reports AS tr ON (tr.id=fot.traffic_report_id)
-        WHERE tr.msg_id = ANY(msg_ids)
-        GROUP BY (fot.local_ip, fot.country_name, fot.region_name);
+    -- Whole hours are read from the rollups, see traffic_totals_for_site
+    RETURN QUERY
+        SELECT
+            nsip_local.ip_address,
+            tt.country_name,
+            tt.region_name,
+            SUM(tt.total_rx_bytes)::bigint AS rx_bytes_total,
+            SUM(tt.total_tx_bytes)::bigint AS tx_bytes_total
+        FROM traffic_report.traffic_totals_for_site(_site_id, _start_timestamp, _end_timestamp) AS tt
+        LEFT JOIN network_scan.ip_addresses AS nsip_local ON (nsip_local.id=tt.local_ip_id)
+        GROUP BY (nsip_local.ip_address, tt.country_name, tt.region_name);
 END;
 $$;
\ No newline at end of file
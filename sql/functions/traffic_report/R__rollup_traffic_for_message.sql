@@ -0,0 +1,36 @@
+-- Adds the outbound traffic of a traffic report message to the hourly rollups. Called
+-- once per message after all of its entries have been created
+
+CREATE OR REPLACE FUNCTION traffic_report.rollup_traffic_for_message(_message_id bigint)
+    RETURNS void
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    msg_received_at timestamp;
+BEGIN
+    SELECT received_at INTO msg_received_at FROM public.recorder_messages WHERE id=_message_id;
+
+    INSERT INTO traffic_report.hourly_traffic_rollups AS htr
+        SELECT trnot.site_id,
+            date_trunc('hour', trnot.received_at),
+            trnot.local_ip_id,
+            trnot.global_ip_id,
+            COALESCE(trnot.country_name, 'Unknown'),
+            COALESCE(trnot.region_name, 'Unknown'),
+            COALESCE(trnot.city_name, 'Unknown'),
+            COALESCE(trnot.isp, 'Unknown'),
+            COALESCE(trnot.domain, 'Unknown'),
+            SUM(tr.rx_bytes),
+            SUM(tr.tx_bytes),
+            SUM(tr.flow_count)
+        FROM traffic_report.traffic_reports AS tr
+        JOIN traffic_report.network_outbound_traffic AS trnot ON (trnot.traffic_report_id=tr.id AND trnot.received_at=tr.received_at)
+        WHERE tr.msg_id=_message_id AND tr.received_at=msg_received_at
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+    ON CONFLICT (site_id, hour, local_ip_id, global_ip_id, country_name, region_name, city_name, isp, domain)
+    DO UPDATE SET
+        total_rx_bytes = htr.total_rx_bytes + EXCLUDED.total_rx_bytes,
+        total_tx_bytes = htr.total_tx_bytes + EXCLUDED.total_tx_bytes,
+        flows = htr.flows + EXCLUDED.flows;
+END
+$$;
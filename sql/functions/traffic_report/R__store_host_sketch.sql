@@ -0,0 +1,16 @@
+-- Saves a machine's daily sketches, after lock_host_sketches
+
+CREATE OR REPLACE FUNCTION traffic_report.store_host_sketch(_site_id bigint,
+                                                           _local_ip_id bigint,
+                                                           _day date,
+                                                           _top_talkers bytea,
+                                                           _distinct_destinations bytea)
+    RETURNS void
+    LANGUAGE sql SECURITY DEFINER
+    AS $$
+    UPDATE traffic_report.daily_host_sketches SET
+        top_talkers=_top_talkers,
+        distinct_destinations=_distinct_destinations,
+        updated_at=now()
+    WHERE site_id=_site_id AND day=_day AND local_ip_id=_local_ip_id;
+$$;
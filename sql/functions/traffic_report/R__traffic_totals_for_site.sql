@@ -0,0 +1,63 @@
+-- Returns outbound traffic totals per (local ip, global ip, GeoIP fields) for a site in a
+-- period. Whole hours come from the hourly rollups; the partial hours at either end of the
+-- period are summed from the raw flows
+
+CREATE OR REPLACE FUNCTION traffic_report.traffic_totals_for_site(_site_id bigint, _start_timestamp timestamp, _end_timestamp timestamp)
+    RETURNS TABLE (
+        local_ip_id bigint,
+        global_ip_id bigint,
+        country_name text,
+        region_name text,
+        city_name text,
+        isp text,
+        domain text,
+        total_rx_bytes bigint,
+        total_tx_bytes bigint
+    )
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    rollup_start timestamp;
+    rollup_end timestamp;
+BEGIN
+    -- Hours that lie entirely inside the period
+    rollup_start := date_trunc('hour', _start_timestamp);
+    IF rollup_start < _start_timestamp THEN
+        rollup_start := rollup_start + interval '1 hour';
+    END IF;
+    rollup_end := date_trunc('hour', _end_timestamp);
+
+    -- No whole hours, so everything comes from the raw flows
+    IF rollup_end <= rollup_start THEN
+        rollup_start := _end_timestamp;
+        rollup_end := _end_timestamp;
+    END IF;
+
+    RETURN QUERY
+        SELECT t.local_ip_id, t.global_ip_id, t.country_name, t.region_name, t.city_name,
+            t.isp, t.domain, SUM(t.rx)::bigint, SUM(t.tx)::bigint
+        FROM (
+            SELECT htr.local_ip_id, htr.global_ip_id, htr.country_name, htr.region_name,
+                htr.city_name, htr.isp, htr.domain, htr.total_rx_bytes AS rx, htr.total_tx_bytes AS tx
+            FROM traffic_report.hourly_traffic_rollups AS htr
+            WHERE htr.site_id = _site_id AND htr.hour >= rollup_start AND htr.hour < rollup_end
+            UNION ALL
+            SELECT trnot.local_ip_id, trnot.global_ip_id,
+                COALESCE(trnot.country_name, 'Unknown'),
+                COALESCE(trnot.region_name, 'Unknown'),
+                COALESCE(trnot.city_name, 'Unknown'),
+                COALESCE(trnot.isp, 'Unknown'),
+                COALESCE(trnot.domain, 'Unknown'),
+                tr.rx_bytes::bigint, tr.tx_bytes::bigint
+            FROM traffic_report.network_outbound_traffic AS trnot
+            JOIN traffic_report.traffic_reports AS tr ON (tr.id=trnot.traffic_report_id AND tr.received_at=trnot.received_at)
+            WHERE trnot.site_id = _site_id
+            AND trnot.received_at >= _start_timestamp AND trnot.received_at <= _end_timestamp
+            AND (trnot.received_at < rollup_start OR trnot.received_at >= rollup_end)
+            AND tr.site_id = _site_id
+            AND tr.received_at >= _start_timestamp AND tr.received_at <= _end_timestamp
+        ) AS t
+        GROUP BY t.local_ip_id, t.global_ip_id, t.country_name, t.region_name, t.city_name,
+            t.isp, t.domain;
+END;
+$$;
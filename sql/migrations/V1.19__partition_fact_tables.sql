@@ -0,0 +1,256 @@
+-- Moves the tables that grow with every upload to native range partitioning on received_at,
+-- the time the owning recorder message was accepted. Report queries already select by
+-- received_at, so they only touch the partitions inside their period, and retention can
+-- drop whole partitions instead of running huge DELETEs.
+--
+-- This requires PostgreSQL 12 or later (foreign keys referencing partitioned tables)
+--
+-- Existing rows are copied into weekly partitions covering their range. Views that read
+-- these tables are dropped here and recreated by their repeatable migrations.
+
+-- Tables that are maintained by admin.create_time_partitions() and
+-- admin.drop_time_partitions(); tables referenced by others must be listed first
+CREATE TABLE admin.partitioned_tables (
+    parent regclass NOT NULL PRIMARY KEY,
+    granularity text NOT NULL DEFAULT 'week' CHECK (granularity IN ('day', 'week', 'month')),
+    premake int NOT NULL DEFAULT 4,
+    creation_order int NOT NULL
+);
+
+CREATE TABLE admin.time_partitions (
+    partition regclass NOT NULL PRIMARY KEY,
+    parent regclass NOT NULL REFERENCES admin.partitioned_tables(parent),
+    start_at timestamp without time zone NOT NULL,
+    end_at timestamp without time zone NOT NULL,
+    UNIQUE(parent, start_at)
+);
+
+DROP VIEW traffic_report.full_outbound_traffic;
+DROP VIEW traffic_report.flattened_traffic_reports;
+-- Drops webui.get_syslog_entries_for_recorder() too, which returns the view's rows; both
+-- are recreated at the end
+DROP VIEW public.flattened_syslog_entries CASCADE;
+
+-- Get the old tables out of the way, keeping their sequences for the new ones
+ALTER TABLE traffic_report.traffic_report_internet_hostnames RENAME TO traffic_report_internet_hostnames_unpartitioned;
+ALTER INDEX traffic_report.traffic_report_internet_hostnames_pkey RENAME TO traffic_report_internet_hostnames_unpartitioned_pkey;
+ALTER SEQUENCE traffic_report.traffic_report_internet_hostnames_id_seq OWNED BY NONE;
+
+ALTER TABLE traffic_report.network_outbound_traffic RENAME TO network_outbound_traffic_unpartitioned;
+ALTER INDEX traffic_report.network_outbound_traffic_pkey RENAME TO network_outbound_traffic_unpartitioned_pkey;
+ALTER SEQUENCE traffic_report.network_outbound_traffic_id_seq OWNED BY NONE;
+
+ALTER TABLE traffic_report.traffic_reports RENAME TO traffic_reports_unpartitioned;
+ALTER INDEX traffic_report.traffic_reports_pkey RENAME TO traffic_reports_unpartitioned_pkey;
+ALTER SEQUENCE traffic_report.traffic_reports_id_seq OWNED BY NONE;
+
+ALTER TABLE snort.traffic_reports RENAME TO traffic_reports_unpartitioned;
+ALTER INDEX snort.traffic_reports_pkey RENAME TO traffic_reports_unpartitioned_pkey;
+ALTER SEQUENCE snort.traffic_reports_id_seq OWNED BY NONE;
+
+ALTER TABLE public.syslog_messages RENAME TO syslog_messages_unpartitioned;
+ALTER INDEX public.syslog_events_pkey RENAME TO syslog_events_unpartitioned_pkey;
+ALTER SEQUENCE public.syslog_messages_syslog_id_seq OWNED BY NONE;
+
+-- And create the partitioned replacements
+CREATE TABLE traffic_report.traffic_reports (
+    id bigint NOT NULL DEFAULT nextval('traffic_report.traffic_reports_id_seq'),
+    msg_id bigint NOT NULL REFERENCES public.recorder_messages(id),
+    protocol network_scan.port_protocol NOT NULL,
+    src_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    src_hostname_id bigint REFERENCES traffic_report.seen_hostnames(id),
+    src_port int NOT NULL,
+    dst_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    dst_hostname_id bigint REFERENCES traffic_report.seen_hostnames(id),
+    dst_port int NOT NULL,
+    rx_bytes int NOT NULL,
+    tx_bytes int NOT NULL,
+    start_timestamp timestamp without time zone NOT NULL,
+    duration real NOT NULL,
+    received_at timestamp without time zone NOT NULL,
+    PRIMARY KEY (id, received_at)
+) PARTITION BY RANGE (received_at);
+
+CREATE TABLE traffic_report.traffic_report_internet_hostnames (
+    id bigint NOT NULL DEFAULT nextval('traffic_report.traffic_report_internet_hostnames_id_seq'),
+    traffic_report_id bigint NOT NULL,
+    internet_hostname_id bigint NOT NULL REFERENCES traffic_report.known_internet_hostnames(id),
+    received_at timestamp without time zone NOT NULL,
+    PRIMARY KEY (id, received_at),
+    FOREIGN KEY (traffic_report_id, received_at) REFERENCES traffic_report.traffic_reports(id, received_at),
+    UNIQUE(traffic_report_id, internet_hostname_id, received_at)
+) PARTITION BY RANGE (received_at);
+
+CREATE TABLE traffic_report.network_outbound_traffic (
+    id bigint NOT NULL DEFAULT nextval('traffic_report.network_outbound_traffic_id_seq'),
+    msg_id bigint NOT NULL REFERENCES public.recorder_messages(id),
+    traffic_report_id bigint NOT NULL,
+    local_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    global_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    geoip_database_version text NOT NULL,
+    country_code char(2),
+    country_name text,
+    region_name text,
+    city_name text,
+    isp text,
+    domain text,
+    received_at timestamp without time zone NOT NULL,
+    PRIMARY KEY (id, received_at),
+    FOREIGN KEY (traffic_report_id, received_at) REFERENCES traffic_report.traffic_reports(id, received_at)
+) PARTITION BY RANGE (received_at);
+
+CREATE TABLE snort.traffic_reports (
+    id bigint NOT NULL DEFAULT nextval('snort.traffic_reports_id_seq'),
+    msg_id bigint REFERENCES public.recorder_messages(id),
+    dst bigint REFERENCES network_scan.ip_addresses(id),
+    src bigint REFERENCES network_scan.ip_addresses(id),
+    ethsrc_id bigint REFERENCES network_scan.mac_addresses(id),
+    ethdst_id bigint REFERENCES network_scan.mac_addresses(id),
+    proto network_scan.port_protocol,
+    rxpackets bigint NOT NULL,
+    txpackets bigint NOT NULL,
+    firstseen timestamp without time zone NOT NULL,
+    received_at timestamp without time zone NOT NULL,
+    PRIMARY KEY (id, received_at)
+) PARTITION BY RANGE (received_at);
+
+CREATE TABLE public.syslog_messages (
+    id bigint NOT NULL DEFAULT nextval('public.syslog_messages_syslog_id_seq'),
+    recorder_id bigint NOT NULL REFERENCES public.recorders(id),
+    program_id bigint NOT NULL REFERENCES public.syslog_programs(id),
+    pid bigint,
+    facility public.syslog_facility NOT NULL,
+    priority public.syslog_priority NOT NULL,
+    message text NOT NULL,
+    recorder_message_id bigint REFERENCES public.recorder_messages(id) ON DELETE CASCADE,
+    host character varying,
+    logged_at timestamp without time zone,
+    received_at timestamp without time zone NOT NULL,
+    PRIMARY KEY (id, received_at)
+) PARTITION BY RANGE (received_at);
+
+ALTER SEQUENCE traffic_report.traffic_reports_id_seq OWNED BY traffic_report.traffic_reports.id;
+ALTER SEQUENCE traffic_report.traffic_report_internet_hostnames_id_seq OWNED BY traffic_report.traffic_report_internet_hostnames.id;
+ALTER SEQUENCE traffic_report.network_outbound_traffic_id_seq OWNED BY traffic_report.network_outbound_traffic.id;
+ALTER SEQUENCE snort.traffic_reports_id_seq OWNED BY snort.traffic_reports.id;
+ALTER SEQUENCE public.syslog_messages_syslog_id_seq OWNED BY public.syslog_messages.id;
+
+-- Rows that arrive before their partition exists land in the default partition rather
+-- than failing ingest
+CREATE TABLE traffic_report.traffic_reports_default PARTITION OF traffic_report.traffic_reports DEFAULT;
+CREATE TABLE traffic_report.traffic_report_internet_hostnames_default PARTITION OF traffic_report.traffic_report_internet_hostnames DEFAULT;
+CREATE TABLE traffic_report.network_outbound_traffic_default PARTITION OF traffic_report.network_outbound_traffic DEFAULT;
+CREATE TABLE snort.traffic_reports_default PARTITION OF snort.traffic_reports DEFAULT;
+CREATE TABLE public.syslog_messages_default PARTITION OF public.syslog_messages DEFAULT;
+
+INSERT INTO admin.partitioned_tables (parent, creation_order) VALUES
+    ('traffic_report.traffic_reports', 1),
+    ('traffic_report.traffic_report_internet_hostnames', 2),
+    ('traffic_report.network_outbound_traffic', 3),
+    ('snort.traffic_reports', 4),
+    ('public.syslog_messages', 5);
+
+-- Weekly partitions from the oldest message we hold, up to premake weeks past now. Ongoing
+-- maintenance is done by admin.create_time_partitions() which follows the same naming
+DO $$
+DECLARE
+    pt record;
+    range_start timestamp;
+    range_end timestamp;
+    new_partition text;
+BEGIN
+    FOR pt IN SELECT apt.parent, apt.premake, n.nspname, c.relname
+              FROM admin.partitioned_tables AS apt
+              JOIN pg_class AS c ON (c.oid=apt.parent)
+              JOIN pg_namespace AS n ON (n.oid=c.relnamespace)
+              ORDER BY apt.creation_order
+    LOOP
+        range_start := date_trunc('week', COALESCE(
+            (SELECT min(received_at) FROM public.recorder_messages), now()));
+
+        WHILE range_start < date_trunc('week', now()) + interval '1 week' * (pt.premake + 1) LOOP
+            range_end := range_start + interval '1 week';
+            new_partition := format('%I.%I', pt.nspname, pt.relname || '_p' || to_char(range_start, 'YYYYMMDD'));
+
+            EXECUTE format('CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                           new_partition, pt.parent, range_start, range_end);
+            INSERT INTO admin.time_partitions (partition, parent, start_at, end_at)
+                VALUES (new_partition::regclass, pt.parent, range_start, range_end);
+
+            range_start := range_end;
+        END LOOP;
+    END LOOP;
+END
+$$;
+
+-- Copy the existing rows over, picking received_at up from the owning message
+INSERT INTO traffic_report.traffic_reports
+    SELECT tr.*, rm.received_at FROM traffic_report.traffic_reports_unpartitioned AS tr
+    JOIN public.recorder_messages AS rm ON (rm.id=tr.msg_id);
+
+INSERT INTO traffic_report.traffic_report_internet_hostnames
+    SELECT trih.*, tr.received_at FROM traffic_report.traffic_report_internet_hostnames_unpartitioned AS trih
+    JOIN traffic_report.traffic_reports AS tr ON (tr.id=trih.traffic_report_id);
+
+INSERT INTO traffic_report.network_outbound_traffic
+    SELECT trnot.*, tr.received_at FROM traffic_report.network_outbound_traffic_unpartitioned AS trnot
+    JOIN traffic_report.traffic_reports AS tr ON (tr.id=trnot.traffic_report_id);
+
+INSERT INTO snort.traffic_reports
+    SELECT sntr.*, rm.received_at FROM snort.traffic_reports_unpartitioned AS sntr
+    JOIN public.recorder_messages AS rm ON (rm.id=sntr.msg_id);
+
+-- Syslog entries without a message keep their logged time
+INSERT INTO public.syslog_messages
+    SELECT sm.*, COALESCE(rm.received_at, sm.logged_at, now()) FROM public.syslog_messages_unpartitioned AS sm
+    LEFT JOIN public.recorder_messages AS rm ON (rm.id=sm.recorder_message_id);
+
+DROP TABLE traffic_report.traffic_report_internet_hostnames_unpartitioned;
+DROP TABLE traffic_report.network_outbound_traffic_unpartitioned;
+DROP TABLE traffic_report.traffic_reports_unpartitioned;
+DROP TABLE snort.traffic_reports_unpartitioned;
+DROP TABLE public.syslog_messages_unpartitioned;
+
+-- Indexes on a partitioned table are created on every partition
+CREATE INDEX ON traffic_report.traffic_reports(msg_id);
+CREATE INDEX ON traffic_report.traffic_report_internet_hostnames(traffic_report_id);
+CREATE INDEX ON traffic_report.network_outbound_traffic(traffic_report_id);
+CREATE INDEX ON traffic_report.network_outbound_traffic(country_name);
+CREATE INDEX ON traffic_report.network_outbound_traffic(region_name);
+CREATE INDEX ON snort.traffic_reports(msg_id);
+CREATE INDEX ON public.syslog_messages(recorder_id);
+
+-- The syslog view and the function returning its rows, as their repeatable migrations have
+-- them; the function's migration doesn't change, so Flyway wouldn't run it again
+CREATE VIEW public.flattened_syslog_entries AS
+    SELECT sm.*, sp.syslog_program AS program FROM syslog_messages AS sm
+        LEFT JOIN syslog_programs AS sp ON (sp.id=sm.program_id)
+        ORDER BY sm.id DESC;
+
+CREATE OR REPLACE FUNCTION webui.get_syslog_entries_for_recorder(_recorder_ids bigint[],
+                                                                 _priorities text[],
+                                                                 _offset integer,
+                                                                 _limit integer)
+    RETURNS SETOF public.flattened_syslog_entries
+    LANGUAGE plpgsql SECURITY DEFINER
+    AS $$
+DECLARE
+    priority_text text;
+    actual_priorities public.syslog_priority[];
+BEGIN
+    -- PostgreSQL's enums remain an unfortunate bastard stepchild. There appears to be no
+    -- trivial way get it to take an array of values and treat them as enum values (which
+    -- I suppose makes sense due to how enums are implements). There's an argument to making
+    -- these enums into a trigger function. So go through and convert the incoming values
+    -- from text and build a new array;
+
+    FOREACH priority_text IN ARRAY _priorities
+    LOOP
+        actual_priorities := array_append(actual_priorities, priority_text::public.syslog_priority);
+    END LOOP;
+
+    RETURN QUERY SELECT * FROM public.flattened_syslog_entries WHERE recorder_id = ANY(_recorder_ids)
+                 AND priority = ANY(actual_priorities)
+                 OFFSET _offset LIMIT _limit;
+END
+$$;
@@ -0,0 +1,30 @@
+-- Reports select by site and received time. Carrying site_id on the messages and the
+-- traffic facts turns them into index range scans instead of building arrays of message
+-- IDs per recorder and filtering with = ANY().
+--
+-- site_id is the recorder's site when the message was received
+
+ALTER TABLE public.recorder_messages ADD COLUMN site_id bigint REFERENCES public.sites(id);
+UPDATE public.recorder_messages AS rm SET site_id=r.site_id
+    FROM public.recorders AS r WHERE r.id=rm.recorder_id;
+
+CREATE INDEX ON public.recorder_messages(site_id, received_at);
+CREATE INDEX ON public.recorder_messages(recorder_id, message_type, received_at);
+
+ALTER TABLE traffic_report.traffic_reports ADD COLUMN site_id bigint;
+UPDATE traffic_report.traffic_reports AS tr SET site_id=rm.site_id
+    FROM public.recorder_messages AS rm WHERE rm.id=tr.msg_id;
+ALTER TABLE traffic_report.traffic_reports ALTER COLUMN site_id SET NOT NULL;
+
+ALTER TABLE traffic_report.network_outbound_traffic ADD COLUMN site_id bigint;
+UPDATE traffic_report.network_outbound_traffic AS trnot SET site_id=rm.site_id
+    FROM public.recorder_messages AS rm WHERE rm.id=trnot.msg_id;
+ALTER TABLE traffic_report.network_outbound_traffic ALTER COLUMN site_id SET NOT NULL;
+
+ALTER TABLE snort.traffic_reports ADD COLUMN site_id bigint;
+UPDATE snort.traffic_reports AS sntr SET site_id=rm.site_id
+    FROM public.recorder_messages AS rm WHERE rm.id=sntr.msg_id;
+
+CREATE INDEX ON traffic_report.traffic_reports(site_id, received_at);
+CREATE INDEX ON traffic_report.network_outbound_traffic(site_id, received_at);
+CREATE INDEX ON snort.traffic_reports(site_id, received_at);
@@ -0,0 +1,40 @@
+-- Hourly per site rollups of outbound traffic. Reports read whole hours from here, and
+-- only go to the raw flows for the partial hours at either end of their period, so their
+-- cost follows the number of distinct destinations instead of the number of flows.
+--
+-- Unknown GeoIP fields are stored as 'Unknown' (which is how the reports show them) so
+-- they can be part of the key.
+
+CREATE TABLE traffic_report.hourly_traffic_rollups (
+    site_id bigint NOT NULL REFERENCES public.sites(id),
+    hour timestamp without time zone NOT NULL,
+    local_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    global_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    country_name text NOT NULL,
+    region_name text NOT NULL,
+    city_name text NOT NULL,
+    isp text NOT NULL,
+    domain text NOT NULL,
+    total_rx_bytes bigint NOT NULL,
+    total_tx_bytes bigint NOT NULL,
+    flows bigint NOT NULL,
+    PRIMARY KEY (site_id, hour, local_ip_id, global_ip_id, country_name, region_name,
+                 city_name, isp, domain)
+);
+
+INSERT INTO traffic_report.hourly_traffic_rollups
+    SELECT trnot.site_id,
+        date_trunc('hour', trnot.received_at),
+        trnot.local_ip_id,
+        trnot.global_ip_id,
+        COALESCE(trnot.country_name, 'Unknown'),
+        COALESCE(trnot.region_name, 'Unknown'),
+        COALESCE(trnot.city_name, 'Unknown'),
+        COALESCE(trnot.isp, 'Unknown'),
+        COALESCE(trnot.domain, 'Unknown'),
+        SUM(tr.rx_bytes),
+        SUM(tr.tx_bytes),
+        COUNT(*)
+    FROM traffic_report.network_outbound_traffic AS trnot
+    JOIN traffic_report.traffic_reports AS tr ON (tr.id=trnot.traffic_report_id AND tr.received_at=trnot.received_at)
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9;
@@ -0,0 +1,9 @@
+-- Resolving a report's local IPs to baseline host names walks ip address -> scanned hosts
+-- -> scan -> message (for the site) -> baseline hosts with the same MAC. None of these
+-- columns were indexed, so every lookup scanned the whole scan history.
+
+CREATE INDEX ON network_scan.ip_addresses(ip_address);
+CREATE INDEX ON network_scan.hosts(ip_address_id, id);
+CREATE INDEX ON network_scan.hosts(mac_address_id);
+CREATE INDEX ON network_scan.scans(msg_id);
+CREATE INDEX ON network_scan.baseline_hosts(site_id, scan_type);
@@ -0,0 +1,29 @@
+-- Prefixes internal to each site, used to tell which end of a flow is the site's. They're
+-- learned from the targets of discovery scans, or entered by an administrator, which covers
+-- IPv6 and sites that use public addresses internally
+
+CREATE TYPE public.local_network_source AS ENUM
+(
+    'scan',
+    'admin'
+);
+
+CREATE TABLE public.site_local_networks
+(
+    id bigserial NOT NULL PRIMARY KEY,
+    site_id bigint NOT NULL REFERENCES public.sites(id),
+    network cidr NOT NULL,
+    source public.local_network_source NOT NULL,
+    added_at timestamp without time zone NOT NULL DEFAULT now(),
+    UNIQUE (site_id, network, source)
+);
+
+-- Learn from the discovery scans we already have
+INSERT INTO public.site_local_networks (site_id, network, source)
+    SELECT DISTINCT rm.site_id, nss.scan_target, 'scan'::public.local_network_source
+    FROM network_scan.scans AS nss
+    JOIN public.recorder_messages AS rm ON (rm.id=nss.msg_id)
+    WHERE nss.scan_type IN ('arp-discovery', 'nd-discovery', 'ipv6-link-local-discovery')
+    AND nss.scan_target IS NOT NULL
+    AND rm.site_id IS NOT NULL
+ON CONFLICT DO NOTHING;
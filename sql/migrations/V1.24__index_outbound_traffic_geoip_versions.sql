@@ -0,0 +1,5 @@
+-- The GeoIP backfill looks for global addresses whose flows were enriched with an older
+-- GeoIP database, and rebuilds the rollups of the ones it refreshes
+
+CREATE INDEX ON traffic_report.network_outbound_traffic(global_ip_id, geoip_database_version);
+CREATE INDEX ON traffic_report.hourly_traffic_rollups(global_ip_id);
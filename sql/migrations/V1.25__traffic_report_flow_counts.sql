@@ -0,0 +1,5 @@
+-- Ingest can merge the flows of a message that only differ by source port and start time
+-- into one traffic report; flow_count records how many it stands for so the rollups keep
+-- counting flows. Rows from before are one flow each.
+
+ALTER TABLE traffic_report.traffic_reports ADD COLUMN flow_count int NOT NULL DEFAULT 1;
@@ -0,0 +1,79 @@
+-- The get_or_create functions check for a value and insert it if missing, so two sessions
+-- ingesting the same new address or hostname at once could each create a row. Merge any
+-- such duplicates into the oldest row and make the values unique, which lets values be
+-- resolved in bulk with INSERT ... ON CONFLICT DO NOTHING.
+
+-- Points every foreign key at a duplicate row to the oldest row with the same value, then
+-- removes the duplicates
+CREATE FUNCTION pg_temp.merge_duplicate_dimension_rows(_table regclass, _value_column text)
+    RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    fk record;
+BEGIN
+    EXECUTE format('CREATE TEMPORARY TABLE dimension_duplicates ON COMMIT DROP AS
+        SELECT id AS duplicate_id, first_value(id) OVER (PARTITION BY %1$I ORDER BY id) AS keep_id
+        FROM %2$s WHERE %1$I IS NOT NULL', _value_column, _table);
+    EXECUTE 'DELETE FROM dimension_duplicates WHERE duplicate_id=keep_id';
+
+    -- Foreign keys on partitioned tables are updated through the parent
+    FOR fk IN SELECT con.conrelid::regclass AS referencing_table, att.attname AS referencing_column
+              FROM pg_constraint AS con
+              JOIN pg_attribute AS att ON (att.attrelid=con.conrelid AND att.attnum=con.conkey[1])
+              WHERE con.contype='f' AND con.confrelid=_table AND con.conparentid=0
+    LOOP
+        EXECUTE format('UPDATE %1$s AS referencing SET %2$I=dup.keep_id
+            FROM dimension_duplicates AS dup WHERE referencing.%2$I=dup.duplicate_id',
+            fk.referencing_table, fk.referencing_column);
+    END LOOP;
+
+    EXECUTE format('DELETE FROM %s WHERE id IN (SELECT duplicate_id FROM dimension_duplicates)',
+                   _table);
+    EXECUTE 'DROP TABLE dimension_duplicates';
+END
+$$;
+
+-- The hourly rollups are keyed on the addresses, so repointing them could collide. Drop the
+-- rollups of duplicated addresses and rebuild them from the flows afterwards
+CREATE TEMPORARY TABLE duplicated_addresses ON COMMIT DROP AS
+    SELECT nsip.id FROM network_scan.ip_addresses AS nsip
+    JOIN (SELECT ip_address FROM network_scan.ip_addresses
+          WHERE ip_address IS NOT NULL
+          GROUP BY ip_address HAVING COUNT(*) > 1) AS dup USING (ip_address);
+
+DELETE FROM traffic_report.hourly_traffic_rollups
+    WHERE local_ip_id IN (SELECT id FROM duplicated_addresses)
+    OR global_ip_id IN (SELECT id FROM duplicated_addresses);
+
+SELECT pg_temp.merge_duplicate_dimension_rows('network_scan.ip_addresses', 'ip_address');
+SELECT pg_temp.merge_duplicate_dimension_rows('network_scan.mac_addresses', 'mac_address');
+SELECT pg_temp.merge_duplicate_dimension_rows('traffic_report.seen_hostnames', 'hostname');
+
+INSERT INTO traffic_report.hourly_traffic_rollups
+    SELECT trnot.site_id,
+        date_trunc('hour', trnot.received_at),
+        trnot.local_ip_id,
+        trnot.global_ip_id,
+        COALESCE(trnot.country_name, 'Unknown'),
+        COALESCE(trnot.region_name, 'Unknown'),
+        COALESCE(trnot.city_name, 'Unknown'),
+        COALESCE(trnot.isp, 'Unknown'),
+        COALESCE(trnot.domain, 'Unknown'),
+        SUM(tr.rx_bytes),
+        SUM(tr.tx_bytes),
+        SUM(tr.flow_count)
+    FROM traffic_report.network_outbound_traffic AS trnot
+    JOIN traffic_report.traffic_reports AS tr ON (tr.id=trnot.traffic_report_id AND tr.received_at=trnot.received_at)
+    WHERE trnot.local_ip_id IN (SELECT id FROM duplicated_addresses)
+    OR trnot.global_ip_id IN (SELECT id FROM duplicated_addresses)
+    GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9;
+
+DROP TABLE duplicated_addresses;
+
+-- The unique constraint's index replaces the plain one from V1.22
+ALTER TABLE network_scan.ip_addresses ADD CONSTRAINT ip_addresses_ip_address_key UNIQUE (ip_address);
+DROP INDEX network_scan.ip_addresses_ip_address_idx;
+
+ALTER TABLE network_scan.mac_addresses ADD CONSTRAINT mac_addresses_mac_address_key UNIQUE (mac_address);
+ALTER TABLE traffic_report.seen_hostnames ADD CONSTRAINT seen_hostnames_hostname_key UNIQUE (hostname);
@@ -0,0 +1,14 @@
+-- Per machine, per day summaries of outbound traffic kept up to date at ingest: a
+-- Space-Saving sketch of the remote hosts it exchanged the most bytes with and a HyperLogLog
+-- of the distinct remote hosts it talked to. The formats are in ndr_server/sketches.py; an
+-- empty value is an empty sketch.
+
+CREATE TABLE traffic_report.daily_host_sketches (
+    site_id bigint NOT NULL REFERENCES public.sites(id),
+    local_ip_id bigint NOT NULL REFERENCES network_scan.ip_addresses(id),
+    day date NOT NULL,
+    top_talkers bytea NOT NULL DEFAULT '',
+    distinct_destinations bytea NOT NULL DEFAULT '',
+    updated_at timestamp without time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (site_id, day, local_ip_id)
+);
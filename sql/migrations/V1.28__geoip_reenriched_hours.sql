@@ -0,0 +1,10 @@
+-- Counts, per site and hour, how many times the GeoIP backfill re-enriched flows received
+-- in that hour. Cached report snapshots compare the sum over their period to tell they're
+-- stale, instead of scanning the period's flows
+
+CREATE TABLE traffic_report.geoip_reenriched_hours (
+    site_id bigint NOT NULL REFERENCES public.sites(id),
+    hour timestamp without time zone NOT NULL,
+    reenrichments bigint NOT NULL,
+    PRIMARY KEY (site_id, hour)
+);
@@ -13,10 +13,12 @@ CREATE OR REPLACE VIEW traffic_report.full_outbound_traffic AS
         region_name,
         city_name,
         isp,
-        domain
+        domain,
+        trnot.received_at,
+        trnot.site_id
     FROM traffic_report.network_outbound_traffic AS trnot
     LEFT JOIN network_scan.ip_addresses AS nsip_local ON trnot.local_ip_id = nsip_local.id
     LEFT JOIN network_scan.ip_addresses AS nsip_global ON trnot.global_ip_id = nsip_global.id
-    LEFT JOIN traffic_report.traffic_report_internet_hostnames AS trih ON (trnot.traffic_report_id=trih.traffic_report_id)
+    LEFT JOIN traffic_report.traffic_report_internet_hostnames AS trih ON (trnot.traffic_report_id=trih.traffic_report_id AND trnot.received_at=trih.received_at)
     LEFT JOIN traffic_report.known_internet_hostnames AS trkih ON trkih.id=trih.internet_hostname_id
     LEFT JOIN traffic_report.seen_hostnames AS trsh ON trkih.hostname_id=trsh.id;
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+# Original Author: Michael Casadevall <mcasadevall@them.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the database helper'''
+
+import unittest
+import os
+import logging
+
+import psycopg2
+import psycopg2.pool
+import ndr_server
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CONFIG = THIS_DIR + "/test_config.yml"
+
+class TestDatabase(unittest.TestCase):
+    '''Tests database helper functionality'''
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        self._nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+        self._db_connection = self._nsc.database.get_connection()
+
+        self._test_org = ndr_server.Organization.create(
+            self._nsc, "Database Org", db_conn=self._db_connection)
+        self._test_site = ndr_server.Site.create(
+            self._nsc, self._test_org, "Database Site", db_conn=self._db_connection)
+        self._recorder = ndr_server.Recorder.create(
+            self._nsc, self._test_site, "Database Recorder", "ndr_test_db",
+            db_conn=self._db_connection)
+
+    def tearDown(self):
+        self._db_connection.rollback()
+        self._nsc.database.close()
+
+    def get_prepared_statements(self, db_conn):
+        '''Returns the names of the statements prepared on the connection'''
+        cursor = db_conn.cursor()
+        cursor.execute("SELECT name FROM pg_prepared_statements")
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return names
+
+    def test_prepared_procedure(self):
+        '''Tests that hot procedures are prepared once and then reused'''
+        statement_name = ndr_server.db.PreparedStatementRegistry.statement_name(
+            "ingest.select_recorder_by_hostname", 1)
+
+        first = ndr_server.Recorder.read_by_hostname(
+            self._nsc, "ndr_test_db", db_conn=self._db_connection)
+        second = ndr_server.Recorder.read_by_hostname(
+            self._nsc, "ndr_test_db", db_conn=self._db_connection)
+
+        self.assertEqual(first, self._recorder)
+        self.assertEqual(second, self._recorder)
+        self.assertEqual(
+            self.get_prepared_statements(self._db_connection).count(statement_name), 1)
+
+    def test_reprepare_after_reconnect(self):
+        '''Tests that statements are prepared again on a new session'''
+        self._nsc.database.prepared_procedures = frozenset(["admin.get_all_site_ids"])
+        statement_name = ndr_server.db.PreparedStatementRegistry.statement_name(
+            "admin.get_all_site_ids", 0)
+
+        db_conn = self._nsc.database.get_connection()
+        self._nsc.database.run_procedure_fetchall("admin.get_all_site_ids", [], db_conn)
+        self.assertIn(statement_name, self.get_prepared_statements(db_conn))
+
+        # Throw away the session and pick up a fresh one
+        db_conn.close()
+        self._nsc.database.return_connection(db_conn)
+        db_conn = self._nsc.database.get_connection()
+
+        self._nsc.database.run_procedure_fetchall("admin.get_all_site_ids", [], db_conn)
+        self.assertIn(statement_name, self.get_prepared_statements(db_conn))
+
+        db_conn.rollback()
+        self._nsc.database.return_connection(db_conn)
+
+    def test_tuple_cursor(self):
+        '''Tests that tuple cursors return plain tuples'''
+        row = self._nsc.database.run_procedure_fetchone(
+            "ingest.select_recorder_by_hostname", ["ndr_test_db"],
+            existing_db_conn=self._db_connection, tuple_cursor=True)
+        self.assertIsInstance(row, tuple)
+
+    def test_lazy_pool(self):
+        '''Tests that no connections are opened until one is requested'''
+        nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+        self.assertIsNone(nsc.database.pool_stats())
+
+        db_conn = nsc.database.get_connection()
+        stats = nsc.database.pool_stats()
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['checkouts'], 1)
+
+        nsc.database.return_connection(db_conn)
+        self.assertEqual(nsc.database.pool_stats()['in_use'], 0)
+        nsc.database.close()
+
+    def test_pool_replaces_dead_connections(self):
+        '''Tests that a connection killed behind our back is replaced on checkout'''
+        pool = ndr_server.db.ConnectionPool(self._nsc.get_pg_connect_string(),
+                                            min_size=1, max_size=2, validate_interval=0)
+        db_conn = pool.getconn()
+        backend_pid = db_conn.get_backend_pid()
+        pool.putconn(db_conn)
+
+        # Kill the backend from a different session
+        cursor = self._db_connection.cursor()
+        cursor.execute("SELECT pg_terminate_backend(%s)", [backend_pid])
+        cursor.close()
+
+        db_conn = pool.getconn()
+        self.assertNotEqual(db_conn.get_backend_pid(), backend_pid)
+        self.assertEqual(pool.stats()['reconnects'], 1)
+        pool.putconn(db_conn)
+        pool.closeall()
+
+    def test_pool_saturation(self):
+        '''Tests that a saturated pool times out and counts the wait'''
+        pool = ndr_server.db.ConnectionPool(self._nsc.get_pg_connect_string(),
+                                            min_size=0, max_size=1, checkout_timeout=0.1)
+        db_conn = pool.getconn()
+        self.assertRaises(psycopg2.pool.PoolError, pool.getconn)
+
+        stats = pool.stats()
+        self.assertEqual(stats['saturation'], 1.0)
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['timeouts'], 1)
+
+        pool.putconn(db_conn)
+        pool.closeall()
+
+    def test_procedure_tracing(self):
+        '''Tests that procedure calls are counted and timed'''
+        self._nsc.database.tracer.reset()
+
+        for _ in range(3):
+            ndr_server.Site.read_by_id(self._nsc, self._test_site.pg_id,
+                                       db_conn=self._db_connection)
+
+        stats = self._nsc.database.tracer.snapshot()["admin.select_site_by_id"]
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(sum(stats['histogram'].values()), 3)
+
+        exported = self._nsc.database.export_stats()
+        self.assertIn("admin.select_site_by_id", exported['procedures'])
+        self.assertEqual(exported['pool']['in_use'], 1)
+
+    def test_explain_capture(self):
+        '''Tests capturing plans of slow procedures without repeating their writes'''
+        self._nsc.database.tracer.reset()
+        self._nsc.database.tracer.explain_ms = 0
+
+        ndr_server.Site.create(self._nsc, self._test_org, "Explained Site",
+                               db_conn=self._db_connection)
+
+        plans = self._nsc.database.tracer.snapshot()["admin.insert_site"]['plans']
+        self.assertEqual(len(plans), 1)
+        self.assertIn("Function Scan", plans[0]['plan'])
+
+        # The EXPLAIN ANALYZE must not have created a second site
+        sites = [site for site in ndr_server.Site.retrieve_all(self._nsc, self._db_connection)
+                 if site.name == "Explained Site"]
+        self.assertEqual(len(sites), 1)
+
+    def enable_replica(self):
+        '''Points the replica at the test database itself'''
+        self._nsc.db_replica = {}
+        self._nsc.db_replica_max_staleness = 300
+        self._nsc.db_replica_check_interval = 5
+
+    def test_replica_routing(self):
+        '''Tests that read-only connections send read-only procedures to the replica'''
+        self.enable_replica()
+
+        db_conn = self._nsc.database.get_connection(read_only=True)
+        ndr_server.Site.retrieve_all(self._nsc, db_conn)
+        self.assertEqual(self._nsc.database.replica_pool.stats()['in_use'], 1)
+
+        # Procedures not marked read-only stay on the primary
+        ndr_server.Site.read_by_id(self._nsc, self._test_site.pg_id, db_conn=db_conn)
+        self.assertEqual(self._nsc.database.replica_pool.stats()['checkouts'], 1)
+
+        self._nsc.database.return_connection(db_conn)
+        self.assertEqual(self._nsc.database.replica_pool.stats()['in_use'], 0)
+
+    def test_replica_read_your_writes(self):
+        '''Tests that a transaction with uncommitted writes keeps reading from the primary'''
+        self.enable_replica()
+
+        sites = ndr_server.Site.retrieve_all(self._nsc, self._db_connection)
+        self.assertIn(self._test_site, sites)
+        self.assertIsNone(self._nsc.database._replica_pool)
+
+    def test_replica_staleness(self):
+        '''Tests falling back to the primary when the replica lags too far behind'''
+        self.enable_replica()
+        self._nsc.db_replica_max_staleness = -1
+
+        db_conn = self._nsc.database.get_connection(read_only=True)
+        self.assertIs(self._nsc.database._route_read_only(db_conn), db_conn)
+        self._nsc.database.return_connection(db_conn)
+
+    def test_redact_args(self):
+        '''Tests slow query log argument redaction'''
+        self.assertEqual(ndr_server.query_trace.redact_args([1, "secret", None]),
+                         ['<int>', '<str len=6>', 'NULL'])
+
+if __name__ == '__main__':
+    unittest.main()
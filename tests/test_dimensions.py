@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the ingest dimension caches'''
+
+import unittest
+import ipaddress
+import os
+import logging
+
+import ndr_server
+from ndr_server.dimensions import LRUCache, normalize_mac_address
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CONFIG = THIS_DIR + "/test_config.yml"
+
+class TestDimensionCaches(unittest.TestCase):
+    '''Tests resolving dimension values against the database'''
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        self._nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+        self._db_connection = self._nsc.database.get_connection()
+
+    def tearDown(self):
+        self._db_connection.rollback()
+        self._nsc.database.close()
+
+    def test_resolve_creates(self):
+        '''Tests that new values are created, and only cached once committed elsewhere'''
+        cache = self._nsc.dimensions.hostnames
+        ids = cache.resolve(["new.example.com", "other.example.com", "new.example.com", None],
+                            self._db_connection)
+
+        self.assertEqual(len(ids), 3)
+        self.assertIsNone(cache.lookup(ids, None))
+        self.assertNotEqual(cache.lookup(ids, "new.example.com"),
+                            cache.lookup(ids, "other.example.com"))
+
+        # Created by this transaction, which could still roll back
+        self.assertEqual(len(cache.cache), 0)
+
+        again = cache.resolve(["new.example.com"], self._db_connection)
+        self.assertEqual(cache.lookup(again, "new.example.com"),
+                         cache.lookup(ids, "new.example.com"))
+
+    def test_matches_single_lookup(self):
+        '''Tests that the bulk path agrees with get_or_create_ip_address'''
+        address = ipaddress.ip_address("2001:db8::45")
+        single_id = self._nsc.database.run_procedure_fetchone(
+            "network_scan.get_or_create_ip_address", [address.compressed],
+            existing_db_conn=self._db_connection, tuple_cursor=True)[0]
+
+        cache = self._nsc.dimensions.ip_addresses
+        ids = cache.resolve([address], self._db_connection)
+        self.assertEqual(cache.lookup(ids, address), single_id)
+
+    def test_warm(self):
+        '''Tests loading recent values'''
+        self._nsc.dimensions.ip_addresses.resolve(["192.0.2.10"], self._db_connection)
+        self._nsc.dimensions.warm(self._db_connection)
+        self.assertGreater(len(self._nsc.dimensions.ip_addresses.cache), 0)
+
+class TestLRUCache(unittest.TestCase):
+    '''Tests the bounded cache'''
+
+    def test_evicts_least_recently_used(self):
+        '''Tests that the oldest untouched entry goes first'''
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_normalize_mac_address(self):
+        '''Tests that MAC addresses match however they're written'''
+        self.assertEqual(normalize_mac_address("00-1A-2B-3C-4D-5E"), "00:1a:2b:3c:4d:5e")
+        self.assertEqual(normalize_mac_address("001a.2b3c.4d5e"), "00:1a:2b:3c:4d:5e")
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests exporting data to columnar files'''
+
+import unittest
+import collections
+import io
+import json
+import os
+import logging
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy
+
+import tests.util
+import ndr_server
+from ndr_server.export import (dictionary_encode, export_dataset, ExportWatermark,
+                               NpzChunkWriter, write_csv, write_ndjson)
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CONFIG = THIS_DIR + "/test_config.yml"
+TRAFFIC_REPORT_LOG = THIS_DIR + "/data/ingest/traffic_report.yml"
+SYSLOG_SCAN = THIS_DIR + "/data/ingest/syslog_upload.yml"
+
+class TestExport(unittest.TestCase):
+    '''Tests exporting a site's data'''
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        self._nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+        self._db_connection = self._nsc.database.get_connection()
+
+        self._test_org = ndr_server.Organization.create(
+            self._nsc, "Export Org", db_conn=self._db_connection)
+        self._test_site = ndr_server.Site.create(
+            self._nsc, self._test_org, "Export Site", db_conn=self._db_connection)
+        self._recorder = ndr_server.Recorder.create(
+            self._nsc, self._test_site, "Test Recorder", "ndr_test_export",
+            db_conn=self._db_connection)
+
+        self._output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._output)
+        self._db_connection.rollback()
+        self._nsc.database.close()
+
+    def test_traffic_export(self):
+        '''Tests that the traffic reports come out in bounded chunks and a watermark
+        excludes them from the next export'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        result = export_dataset(self._nsc, self._test_site, 'traffic', self._output,
+                                self._db_connection, output_format='npz',
+                                settle_seconds=0, batch_size=25)
+        self.assertGreater(result.rows, 25)
+        self.assertEqual(len(result.files), (result.rows + 24) // 25)
+
+        chunk = numpy.load(result.files[0])
+        self.assertEqual(len(chunk['id']), 25)
+        src_ips = chunk['src_ip.dictionary'][chunk['src_ip.codes']]
+        self.assertTrue(all(src_ip for src_ip in src_ips))
+
+        watermark = ExportWatermark(os.path.join(self._output, "watermarks.json"))
+        watermark.set(self._test_site.pg_id, 'traffic', result.last_received_at)
+        after = ExportWatermark(watermark.filename).get(self._test_site.pg_id, 'traffic')
+        self.assertEqual(after, result.last_received_at)
+
+        again = export_dataset(self._nsc, self._test_site, 'traffic', self._output,
+                               self._db_connection, after=after, output_format='npz',
+                               settle_seconds=0)
+        self.assertEqual(again.rows, 0)
+        self.assertEqual(again.files, [])
+
+    def test_syslog_export(self):
+        '''Tests exporting syslog entries'''
+        tests.util.ingest_test_file(self, SYSLOG_SCAN)
+
+        result = export_dataset(self._nsc, self._test_site, 'syslog', self._output,
+                                self._db_connection, output_format='npz', settle_seconds=0)
+        self.assertGreater(result.rows, 0)
+
+        rows = sum(len(numpy.load(filename)['id']) for filename in result.files)
+        self.assertEqual(rows, result.rows)
+
+class TestNpzChunks(unittest.TestCase):
+    '''Tests the .npz fallback format'''
+
+    def test_dictionary_encode(self):
+        '''Tests that repeated strings share a code and NULLs are -1'''
+        codes, dictionary = dictionary_encode(["a", "b", None, "a"])
+        self.assertEqual(list(codes), [0, 1, -1, 0])
+        self.assertEqual(list(dictionary), ["a", "b"])
+
+    def test_chunk_round_trip(self):
+        '''Tests that a chunk reads back with its NULLs masked'''
+        output = tempfile.mkdtemp()
+        try:
+            writer = NpzChunkWriter(output, "test", [('id', 'int'), ('at', 'timestamp'),
+                                                     ('name', 'str'), ('duration', 'float')])
+            writer.write([(1, datetime(2017, 1, 1, 12, 0), "a", 1.5),
+                          (2, None, None, None)])
+            writer.close()
+
+            chunk = numpy.load(writer.files[0])
+            self.assertEqual(list(chunk['id']), [1, 2])
+            self.assertNotIn('id.valid', chunk.files)
+            self.assertEqual(list(chunk['at.valid']), [True, False])
+            self.assertEqual(chunk['at'][0], numpy.datetime64('2017-01-01T12:00'))
+            self.assertEqual(list(chunk['name.codes']), [0, -1])
+            self.assertTrue(numpy.isnan(chunk['duration'][1]))
+        finally:
+            shutil.rmtree(output)
+
+class TestRecordWriters(unittest.TestCase):
+    '''Tests writing streams of records'''
+
+    Record = collections.namedtuple('Record', 'local_ip total_bytes')
+
+    def records(self):
+        '''A generator, like the streaming breakdowns'''
+        yield self.Record("192.0.2.1", 10)
+        yield self.Record("2001:db8::1", None)
+
+    def test_ndjson(self):
+        '''Tests that each record becomes a JSON object on its own line'''
+        output = io.StringIO()
+        self.assertEqual(write_ndjson(self.records(), output), 2)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0]), {"local_ip": "192.0.2.1", "total_bytes": 10})
+        self.assertEqual(json.loads(lines[1]), {"local_ip": "2001:db8::1", "total_bytes": None})
+
+    def test_csv(self):
+        '''Tests that the header is written even without records'''
+        output = io.StringIO()
+        self.assertEqual(write_csv(self.records(), output, self.Record._fields), 2)
+        self.assertEqual(output.getvalue().splitlines(),
+                         ["local_ip,total_bytes", "192.0.2.1,10", "2001:db8::1,"])
+
+        output = io.StringIO()
+        self.assertEqual(write_csv(iter([]), output, self.Record._fields), 0)
+        self.assertEqual(output.getvalue().splitlines(), ["local_ip,total_bytes"])
+
+if __name__ == '__main__':
+    unittest.main()
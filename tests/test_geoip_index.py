@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the compiled GeoIP range index against the GeoIP database it's built from'''
+
+import ipaddress
+import logging
+import os
+import random
+import tempfile
+import unittest
+
+import geoip2.database
+import geoip2.errors
+
+import ndr_server
+from ndr_server.geoip_index import GeoIPRangeIndex, build_index
+from ndr_server.snort_columns import PackedAddresses
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CONFIG = THIS_DIR + "/test_config.yml"
+
+def check_if_can_open_geoip_db():
+    nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+    try:
+        geoip2.database.Reader(nsc.geoip_db)
+    except:
+        return False
+
+    return True
+
+@unittest.skipUnless(check_if_can_open_geoip_db(), "no geoip DB")
+class TestGeoIPIndex(unittest.TestCase):
+    '''Builds an index once, and checks lookups match geoip2's'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls._nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+        file_descriptor, cls._index_file = tempfile.mkstemp()
+        os.close(file_descriptor)
+        build_index(cls._nsc.geoip_db, cls._index_file)
+
+        cls._reader = geoip2.database.Reader(cls._nsc.geoip_db)
+        cls._index = GeoIPRangeIndex(cls._index_file)
+
+        generator = random.Random(0)
+        cls._addresses = [ipaddress.ip_address(address) for address in (
+            "45.56.123.192", "2600:3c00::f03c:91ff:fe98:b8fe", "::ffff:45.56.123.192",
+            "8.8.8.8", "192.168.2.2", "0.0.0.0", "255.255.255.255",
+            # 6to4 and Teredo, which the database aliases to IPv4
+            "2002:2d38:7bc0::1", "2002:808:808::1", "2001:0:2d38:7bc0::1")]
+        cls._addresses += [ipaddress.IPv4Address(generator.getrandbits(32)) for _ in range(500)]
+        cls._addresses += [ipaddress.IPv6Address((1 << 125) | generator.getrandbits(125))
+                           for _ in range(500)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._reader.close()
+        cls._index.close()
+        os.remove(cls._index_file)
+
+    def reader_lookup(self, address):
+        '''Looks an address up the way SNORT reports used to'''
+        try:
+            entry = self._reader.city(address.compressed)
+        except geoip2.errors.AddressNotFoundError:
+            return None
+        return (entry.country.name, entry.subdivisions.most_specific.name, entry.city.name)
+
+    def test_lookup(self):
+        '''Tests single lookups match the database'''
+        for address in self._addresses:
+            self.assertEqual(self._index.lookup(address), self.reader_lookup(address),
+                             address)
+
+    def test_lookup_packed(self):
+        '''Tests batch lookups match single ones'''
+        packed = PackedAddresses(self._addresses)
+        info_ids = self._index.lookup_packed(packed.is_v4, packed.high, packed.low)
+
+        for address, info_id in zip(self._addresses, info_ids.tolist()):
+            expected = self._index.lookup(address)
+            if expected is None:
+                self.assertEqual(info_id, -1, address)
+            else:
+                self.assertEqual(self._index.info(info_id), expected, address)
+
+    def test_open_shares_index(self):
+        '''Tests the index is only mapped once per process'''
+        self.assertIs(GeoIPRangeIndex.open(self._index_file),
+                      GeoIPRangeIndex.open(self._index_file))
+
+if __name__ == '__main__':
+    unittest.main()
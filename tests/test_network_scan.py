@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import ipaddress
 import os
 import logging
 import tempfile
@@ -96,6 +97,14 @@ class TestIngests(unittest.TestCase):
         host_objs = net_scan.get_unknown_hosts_from_scan(db_conn=self._db_connection)
         self.assertEqual(len(host_objs), 3)
 
+    def test_learns_local_networks(self):
+        '''Tests that discovery scan targets become the site's local networks'''
+        self.load_network_scan(NMAP_ARP_SCAN)
+
+        local_networks = self._test_site.get_local_networks(db_conn=self._db_connection)
+        self.assertIn(ipaddress.ip_network("192.168.2.0/24"), local_networks.networks)
+        self.assertTrue(local_networks.contains(ipaddress.ip_address("192.168.2.1")))
+
     def test_adding_hosts_to_baseline(self):
         '''This tests the functionality of adding a host to a
            baseline properly removes it from unknown hosts'''
@@ -234,5 +243,28 @@ class TestIngests(unittest.TestCase):
         self.assertNotEqual(bh1.pg_id, bh3.pg_id)
         self.assertNotEqual(bh2.pg_id, bh3.pg_id)
 
+    def test_human_names_by_ip(self):
+        '''Tests resolving many IPs to baseline host names at once'''
+
+        net_scan = self.load_network_scan(NMAP_ARP_SCAN)
+        for host in net_scan.get_unknown_hosts_from_scan(db_conn=self._db_connection):
+            ndr_server.NetworkScan.add_host_to_baseline(self._nsc,
+                                                        host.pg_id,
+                                                        db_conn=self._db_connection)
+
+        named_host = ndr_server.BaselineHost.find_all_by_most_recent_ip(
+            self._nsc, self._test_site, "192.168.2.3", self._db_connection
+        )[0]
+        named_host.set_human_name("Named Host", db_conn=self._db_connection)
+
+        names = ndr_server.BaselineHost.human_names_by_ip(
+            self._nsc, self._test_site,
+            [ipaddress.ip_address("192.168.2.3"), ipaddress.ip_address("192.168.2.1"),
+             ipaddress.ip_address("10.9.9.9")],
+            self._db_connection)
+
+        # Unnamed and unknown hosts are left out
+        self.assertEqual(names, {ipaddress.ip_address("192.168.2.3"): "Named Host"})
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+# Original Author: Michael Casadevall <mcasadevall@them.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests time partition maintenance'''
+
+import unittest
+import os
+import logging
+
+from datetime import datetime, timedelta
+import ndr_server
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CONFIG = THIS_DIR + "/test_config.yml"
+
+class TestPartitions(unittest.TestCase):
+    '''Tests creating and expiring time partitions'''
+
+    def setUp(self):
+        logging.getLogger().addHandler(logging.NullHandler())
+        self._nsc = ndr_server.Config(logging.getLogger(), TEST_CONFIG)
+        self._db_connection = self._nsc.database.get_connection()
+
+    def tearDown(self):
+        self._db_connection.rollback()
+        self._nsc.database.close()
+
+    def partitions_of(self, table):
+        '''Returns (start_at, end_at) for all tracked partitions of a table'''
+        cursor = self._db_connection.cursor()
+        cursor.execute("SELECT start_at, end_at FROM admin.time_partitions WHERE parent=%s::regclass",
+                       [table])
+        ranges = cursor.fetchall()
+        cursor.close()
+        return ranges
+
+    def test_create_partitions_ahead(self):
+        '''Tests that partitions exist for now and are only created once'''
+        self._nsc.database.run_procedure_fetchone(
+            "admin.create_time_partitions", [], existing_db_conn=self._db_connection)
+        created = self._nsc.database.run_procedure_fetchone(
+            "admin.create_time_partitions", [], existing_db_conn=self._db_connection)[0]
+        self.assertEqual(created, 0)
+
+        now = datetime.now()
+        for table in ["traffic_report.traffic_reports", "snort.traffic_reports",
+                      "public.syslog_messages"]:
+            covering = [r for r in self.partitions_of(table) if r[0] <= now < r[1]]
+            self.assertEqual(len(covering), 1)
+
+    def test_drop_expired_partitions(self):
+        '''Tests that retention drops old partitions, including those of referencing tables'''
+        old = datetime.now() - timedelta(days=365)
+        self._nsc.database.run_procedure_fetchone(
+            "admin.create_time_partitions", [old], existing_db_conn=self._db_connection)
+
+        dropped = self._nsc.database.run_procedure_fetchone(
+            "admin.drop_time_partitions",
+            ["traffic_report.traffic_reports", old + timedelta(days=14)],
+            existing_db_conn=self._db_connection)[0]
+        self.assertGreater(dropped, 0)
+
+        for table in ["traffic_report.traffic_reports",
+                      "traffic_report.network_outbound_traffic"]:
+            expired = [r for r in self.partitions_of(table) if r[1] <= old + timedelta(days=14)]
+            self.assertEqual(len(expired), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the report snapshot cache files'''
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+from ndr_server.report_cache import ReportSnapshotCache
+
+class TestReportSnapshotCache(unittest.TestCase):
+    '''Tests storing and pruning snapshots, without the database'''
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._cache = ReportSnapshotCache(None, self._directory)
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def key(self, site_id, start_period):
+        '''A key as ReportSnapshotCache.key() would return it'''
+        return {'version': 1, 'site_id': site_id, 'start_period': start_period,
+                'end_period': start_period, 'message_count': 1, 'last_message_id': 1,
+                'geoip_reenrichments': 0}
+
+    def test_store_and_load(self):
+        '''Tests that a stored entry loads back under the same key only'''
+        key = self.key(1, "2017-06-01T06:00:00")
+        self._cache.store(key, {'geoip': [["Canada", "Ontario", 1, 2]]})
+
+        self.assertEqual(self._cache.load(key), {'geoip': [["Canada", "Ontario", 1, 2]]})
+        self.assertIsNone(self._cache.load(dict(key, geoip_reenrichments=1)))
+        self.assertIsNone(self._cache.load(self.key(2, "2017-06-01T06:00:00")))
+
+    def test_prune(self):
+        '''Tests that only old entries and temporary files are removed'''
+        old_key = self.key(1, "2017-06-01T06:00:00")
+        new_key = self.key(1, "2017-06-02T06:00:00")
+        self._cache.store(old_key, {})
+        self._cache.store(new_key, {})
+
+        leftover = os.path.join(self._directory, ".reportleftover")
+        unrelated = os.path.join(self._directory, "unrelated")
+        for filename in (leftover, unrelated):
+            open(filename, 'w').close()
+
+        week_ago = time.time() - 7 * 86400
+        for filename in (self._cache.filename(old_key), leftover, unrelated):
+            os.utime(filename, (week_ago, week_ago))
+
+        self.assertEqual(self._cache.prune(86400), 2)
+        self.assertEqual(sorted(os.listdir(self._directory)),
+                         sorted([os.path.basename(self._cache.filename(new_key)), "unrelated"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the checkpoints of the daily run'''
+
+import unittest
+import unittest.mock
+import os
+import shutil
+import tempfile
+
+from datetime import datetime, timedelta
+import ndr_server.tools.run_daily as run_daily
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_CONFIG = THIS_DIR + "/test_config.yml"
+
+class TestRunDailyCheckpoints(unittest.TestCase):
+    '''Tests consecutive daily runs sharing a checkpoint file'''
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._checkpoint = os.path.join(self._directory, "checkpoint.json")
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def run_daily(self, now, site_ids, failing, resume=False):
+        '''Runs ndr-run-daily's main() at now over site_ids, with the sites in failing
+        failing. Returns the end of the period reported on, the sites processed and whether
+        the run exited with an error'''
+        processed = []
+        end_periods = set()
+
+        def process_site(site_id, start_period, end_period, server_config):
+            '''Stands in for generating a site's reports'''
+            processed.append(site_id)
+            end_periods.add(end_period)
+            return site_id, 0.0, "Error: failing" if site_id in failing else None
+
+        class FixedDatetime(datetime):
+            '''datetime, with now() at the time of the run'''
+            @classmethod
+            def now(cls, tz=None):
+                return now
+
+        argv = ['ndr-run-daily', '-s', TEST_CONFIG, '--checkpoint', self._checkpoint]
+        if resume is True:
+            argv.append('--resume')
+
+        exited = False
+        with unittest.mock.patch('sys.argv', argv), \
+                unittest.mock.patch.object(run_daily, 'datetime', FixedDatetime), \
+                unittest.mock.patch.object(run_daily, 'select_sites',
+                                           lambda nsc, args: list(site_ids)), \
+                unittest.mock.patch.object(run_daily, 'process_site', process_site):
+            try:
+                run_daily.main()
+            except SystemExit:
+                exited = True
+
+        self.assertLessEqual(len(end_periods), 1)
+        end_period = end_periods.pop() if len(end_periods) != 0 else None
+        return end_period, sorted(processed), exited
+
+    def test_consecutive_runs(self):
+        '''Tests that the next day's run reports on its own period for every site'''
+        today = datetime(2017, 6, 2, 6, 0)
+        tomorrow = today + timedelta(days=1)
+
+        self.assertEqual(self.run_daily(today, [1, 2, 3], failing=[]),
+                         (today, [1, 2, 3], False))
+        self.assertFalse(os.path.exists(self._checkpoint))
+
+        self.assertEqual(self.run_daily(tomorrow, [1, 2, 3], failing=[]),
+                         (tomorrow, [1, 2, 3], False))
+
+    def test_resume_after_failure(self):
+        '''Tests that only --resume continues a failed run, and a new run replaces it'''
+        today = datetime(2017, 6, 2, 6, 0)
+        tomorrow = today + timedelta(days=1)
+
+        self.assertEqual(self.run_daily(today, [1, 2, 3], failing=[2]),
+                         (today, [1, 2, 3], True))
+        self.assertTrue(os.path.exists(self._checkpoint))
+
+        later = today + timedelta(hours=2)
+        self.assertEqual(self.run_daily(later, [1, 2, 3], failing=[], resume=True),
+                         (today, [2], False))
+        self.assertFalse(os.path.exists(self._checkpoint))
+
+        self.run_daily(today, [1, 2, 3], failing=[2])
+        self.assertEqual(self.run_daily(tomorrow, [1, 2, 3], failing=[]),
+                         (tomorrow, [1, 2, 3], False))
+
+if __name__ == '__main__':
+    unittest.main()
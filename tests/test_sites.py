@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import ipaddress
 import os
 import logging
 
@@ -80,5 +81,63 @@ class TestSites(unittest.TestCase):
         self.assertIn(site1, sites)
         self.assertIn(site2, sites)
 
+    def test_row_mapper(self):
+        '''Tests building sites straight from tuples with the row mapper cursor'''
+        site = ndr_server.Site.create(self._nsc, self._test_org, "Test 5", db_conn=self._db_connection)
+
+        cursor = self._nsc.database.run_procedure(
+            "admin.select_site_by_id", [site.pg_id], existing_db_conn=self._db_connection,
+            cursor_factory=self._nsc.database.row_mapper(ndr_server.Site))
+
+        mapped_sites = list(cursor)
+        cursor.close()
+
+        self.assertEqual(len(mapped_sites), 1)
+        self.assertEqual(mapped_sites[0], site)
+        self.assertEqual(mapped_sites[0].name, "Test 5")
+        self.assertEqual(mapped_sites[0].org_id, self._test_org.pg_id)
+        self.assertFalse(hasattr(mapped_sites[0], '__dict__'))
+
+    def test_local_networks(self):
+        '''Tests adding and removing a site's internal networks'''
+        site = ndr_server.Site.create(self._nsc, self._test_org, "Test 6", db_conn=self._db_connection)
+        self.assertEqual(len(site.get_local_networks(db_conn=self._db_connection)), 0)
+
+        site.add_local_network("203.0.113.0/24", db_conn=self._db_connection)
+        site.add_local_network("2001:db8::/32", db_conn=self._db_connection)
+        local_networks = site.get_local_networks(db_conn=self._db_connection)
+        self.assertEqual(len(local_networks), 2)
+        self.assertTrue(local_networks.contains(ipaddress.ip_address("203.0.113.10")))
+        self.assertTrue(local_networks.contains(ipaddress.ip_address("2001:db8::1")))
+        self.assertFalse(local_networks.contains(ipaddress.ip_address("198.51.100.10")))
+
+        self.assertTrue(site.remove_local_network("203.0.113.0/24", db_conn=self._db_connection))
+        self.assertFalse(site.remove_local_network("203.0.113.0/24", db_conn=self._db_connection))
+        local_networks = site.get_local_networks(db_conn=self._db_connection)
+        self.assertFalse(local_networks.contains(ipaddress.ip_address("203.0.113.10")))
+
+class TestLocalNetworkIndex(unittest.TestCase):
+    '''Tests lookups against merged prefixes'''
+
+    def test_contains(self):
+        '''Tests lookups at the edges of overlapping and adjacent prefixes'''
+        index = ndr_server.LocalNetworkIndex([
+            '10.0.0.0/8', '10.1.0.0/16', '192.168.2.0/24', '192.168.3.0/24', '2001:db8:1::/48'
+        ])
+
+        for address in ['10.0.0.0', '10.255.255.255', '192.168.2.0', '192.168.3.255',
+                        '2001:db8:1::1', '::ffff:192.168.2.1']:
+            self.assertTrue(index.contains(ipaddress.ip_address(address)), address)
+
+        for address in ['9.255.255.255', '11.0.0.0', '192.168.4.0', '2001:db8:2::1',
+                        '::ffff:8.8.8.8']:
+            self.assertFalse(index.contains(ipaddress.ip_address(address)), address)
+
+    def test_empty(self):
+        '''Tests that nothing is local without any prefixes'''
+        index = ndr_server.LocalNetworkIndex([])
+        self.assertEqual(len(index), 0)
+        self.assertFalse(index.contains(ipaddress.ip_address('10.0.0.1')))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the traffic sketches'''
+
+import unittest
+import collections
+import ipaddress
+import random
+
+from ndr_server.sketches import SpaceSaving, HyperLogLog, HostTrafficSketch
+
+def address(number):
+    '''Returns the number-th address from 10.0.0.0'''
+    return ipaddress.ip_address(167772160 + number)
+
+class TestSpaceSaving(unittest.TestCase):
+    '''Tests the heavy hitters sketch'''
+
+    def skewed_traffic(self, seed, flows=5000):
+        '''Returns flows (address, bytes) pairs, with a few addresses taking most flows'''
+        generator = random.Random(seed)
+        return [(address(int(generator.paretovariate(1.2)) % 2000), generator.randint(1, 1500))
+                for _ in range(flows)]
+
+    def test_error_bounds(self):
+        '''Tests that estimates bracket the true totals, also after merging'''
+        true_totals = collections.Counter()
+        sketches = []
+        for seed in range(3):
+            sketch = SpaceSaving(32)
+            for remote, total_bytes in self.skewed_traffic(seed):
+                sketch.offer(remote, total_bytes)
+                true_totals[remote] += total_bytes
+            sketches.append(sketch)
+
+        merged = sketches[0].merge(sketches[1]).merge(sketches[2])
+        self.assertEqual(merged.total, sum(true_totals.values()))
+        for heavy_hitter in merged.top(10):
+            self.assertGreaterEqual(heavy_hitter.estimate, true_totals[heavy_hitter.address])
+            self.assertLessEqual(heavy_hitter.estimate - heavy_hitter.error,
+                                 true_totals[heavy_hitter.address])
+
+        self.assertEqual(merged.top(1)[0].address, true_totals.most_common(1)[0][0])
+
+    def test_exact_below_capacity(self):
+        '''Tests that nothing is estimated while every address fits'''
+        sketch = SpaceSaving(8)
+        sketch.offer("192.0.2.1", 100)
+        sketch.offer("192.0.2.2", 50)
+        sketch.offer("192.0.2.1", 25)
+
+        self.assertEqual([(str(hh.address), hh.estimate, hh.error) for hh in sketch.top()],
+                         [("192.0.2.1", 125, 0), ("192.0.2.2", 50, 0)])
+
+    def test_serialization(self):
+        '''Tests that sketches survive a round trip, IPv6 included'''
+        sketch = SpaceSaving(4)
+        for remote, total_bytes in self.skewed_traffic(1, flows=100):
+            sketch.offer(remote, total_bytes)
+        sketch.offer("2001:db8::1", 10)
+
+        restored = SpaceSaving.from_bytes(sketch.to_bytes())
+        self.assertEqual(restored.top(), sketch.top())
+        self.assertEqual(restored.total, sketch.total)
+        self.assertEqual(len(SpaceSaving.from_bytes(b'')), 0)
+
+class TestHyperLogLog(unittest.TestCase):
+    '''Tests the distinct counter'''
+
+    def test_accuracy(self):
+        '''Tests counts stay within a few standard errors'''
+        for distinct in (5, 500, 20000):
+            counter = HyperLogLog()
+            for number in range(distinct):
+                counter.add(address(number))
+                counter.add(address(number))
+            self.assertLess(abs(counter.count() - distinct),
+                            max(1, 4 * counter.relative_error * distinct))
+
+    def test_merge(self):
+        '''Tests that merging counts overlapping addresses once'''
+        first = HyperLogLog()
+        second = HyperLogLog()
+        for number in range(1000):
+            first.add(address(number))
+            second.add(address(number + 500))
+
+        merged = HyperLogLog.from_bytes(first.merge(second).to_bytes())
+        self.assertLess(abs(merged.count() - 1500), 4 * merged.relative_error * 1500)
+        self.assertRaises(ValueError, first.merge, HyperLogLog(precision=10))
+
+class TestHostTrafficSketch(unittest.TestCase):
+    '''Tests the combined per machine sketch'''
+
+    def test_add_and_merge(self):
+        '''Tests that merged days add up the bytes and count each destination once'''
+        monday = HostTrafficSketch()
+        monday.add("192.0.2.1", 1000)
+        monday.add("192.0.2.2", 10)
+        tuesday = HostTrafficSketch()
+        tuesday.add("192.0.2.2", 5000)
+
+        both = monday.merge(tuesday)
+        self.assertEqual(str(both.top(1)[0].address), "192.0.2.2")
+        self.assertEqual(both.top(1)[0].estimate, 5010)
+        self.assertEqual(both.distinct_destinations(), 2)
@@ -23,7 +23,9 @@ import shutil
 import ipaddress
 
 import geoip2
+import numpy
 import ndr_server
+from ndr_server.snort_columns import PackedAddresses, NON_GLOBAL_NETWORKS, group_sums
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_CONFIG = THIS_DIR + "/test_config.yml"
@@ -100,6 +102,22 @@ class TestTrafficReporting(unittest.TestCase):
             self._nsc, self._test_site, LONG_SINCE_PERIOD, db_conn=self._db_connection)
         self.assertEqual(len(traffic_report.traffic_dicts), 3)
 
+    def test_load_in_batches(self):
+        '''Tests reading the report through a server side cursor a row at a time'''
+        self.ingest_file(SNORT_TRAFFIC_LOG)
+
+        batches = list(self._nsc.database.run_procedure_batches(
+            "snort.report_traffic_for_site_within_timeperiod",
+            [self._test_site.pg_id, LONG_SINCE_PERIOD],
+            existing_db_conn=self._db_connection,
+            batch_size=1,
+            tuple_cursor=True))
+
+        self.assertEqual(len(batches), 3)
+        for batch in batches:
+            self.assertEqual(len(batch), 1)
+            self.assertEqual(len(batch[0]), 4)
+
     def test_process_dicts(self):
         '''Tests getting basic JSON information from a report from the database'''
 
@@ -158,4 +176,23 @@ class TestTrafficReporting(unittest.TestCase):
 
         key = ipaddress.ip_address("192.168.2.2")
         self.assertEqual(local_breakdown[key]['country']['United States']['rxpackets'], 18000)
-        self.assertEqual(local_breakdown[key]['country']['United States']['txpackets'], 96)
\ No newline at end of file
+        self.assertEqual(local_breakdown[key]['country']['United States']['txpackets'], 96)
+
+class TestSnortColumns(unittest.TestCase):
+    '''Tests the columnar SNORT aggregation helpers'''
+
+    def test_global_classification(self):
+        '''Tests that the prefix masks agree with ipaddress'''
+        addresses = [ipaddress.ip_address(address) for address in (
+            "192.168.2.2", "10.1.2.3", "100.64.0.1", "8.8.8.8", "45.56.123.192", "224.0.0.5",
+            "255.255.255.255", "fe80::1", "::1", "2001:db8::1", "2600:3c00::f03c:91ff:fe98:b8fe",
+            "fd00::1", "::ffff:192.168.1.1")]
+
+        is_global = ~PackedAddresses(addresses).in_networks(NON_GLOBAL_NETWORKS)
+        self.assertEqual(is_global.tolist(), [address.is_global for address in addresses])
+
+    def test_group_sums(self):
+        '''Tests the sort based group by'''
+        keys, (sums,) = group_sums(numpy.array([3, 1, 3, 2, 1]), numpy.array([1, 2, 3, 4, 5]))
+        self.assertEqual(keys.tolist(), [1, 2, 3])
+        self.assertEqual(sums.tolist(), [7, 4, 4])
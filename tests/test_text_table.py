@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# Copyright (C) 2017  Secured By THEM
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Tests the report table renderer'''
+
+import unittest
+
+from ndr_server.text_table import TextTable
+
+class TestTextTable(unittest.TestCase):
+    '''Tests rendering text tables'''
+
+    def test_render(self):
+        '''Tests the AsciiTable compatible layout, including short rows'''
+        table = TextTable([['Country', 'TX'], [], ['Canada', 12.5, None]])
+        self.assertEqual(table.table, "\n".join([
+            "+---------+------+------+",
+            "| Country | TX   |      |",
+            "+---------+------+------+",
+            "|         |      |      |",
+            "| Canada  | 12.5 | None |",
+            "+---------+------+------+"]))
+
+    def test_heading_only(self):
+        '''Tests that a lone heading has no separator line'''
+        self.assertEqual(TextTable([['a']]).table, "+---+\n| a |\n+---+")
+        self.assertEqual(TextTable([]).table, "++\n++")
+
+    def test_limits(self):
+        '''Tests row limits and cell truncation'''
+        table = TextTable([['Host'], ['a-very-long-hostname.example.com'], ['b'], ['c']],
+                          max_rows=2, max_cell_width=10)
+        self.assertEqual(table.hidden_rows, 1)
+        self.assertEqual(table.lines()[3], "| a-very-...      |")
+        self.assertEqual(table.lines()[-2], "| ... 1 more rows |")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,10 +18,16 @@
 '''Tests functionality related to traffic_reports'''
 
 import unittest
+import collections
+import email
+import io
+import ipaddress
 import os
 import logging
+import shutil
 import tempfile
-from datetime import datetime, timedelta
+import zipfile
+from datetime import date, datetime, timedelta
 
 import tests.util
 import ndr_server
@@ -29,6 +35,7 @@ import ndr_server
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_CONFIG = THIS_DIR + "/test_config.yml"
 TRAFFIC_REPORT_LOG = THIS_DIR + "/data/ingest/traffic_report.yml"
+TRAFFIC_REPORT_IPV6_LOG = THIS_DIR + "/data/ingest/traffic_report_ipv6.yml"
 
 class TestIngests(unittest.TestCase):
     '''Tests various ingest cases'''
@@ -95,6 +102,273 @@ class TestIngests(unittest.TestCase):
 
         self.assertEqual(len(geoip_report), 14)
 
+    def test_streaming_breakdowns(self):
+        '''Tests that the streaming breakdowns match the retrieved ones'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        now = datetime.now()
+        retrieved = report_manager.retrieve_internet_host_breakdown(
+            now - timedelta(days=1), now, self._db_connection)
+        streamed = list(report_manager.iter_internet_host_breakdown(
+            now - timedelta(days=1), now, self._db_connection, itersize=10))
+
+        self.assertGreater(len(streamed), 10)
+        self.assertEqual(
+            sorted(retrieved),
+            sorted(record._replace(local_ip=ipaddress.ip_address(record.local_ip),
+                                   global_ip=ipaddress.ip_address(record.global_ip))
+                   for record in streamed))
+
+        ndjson_output = io.StringIO()
+        self.assertEqual(report_manager.write_breakdown(
+            'geoip', now - timedelta(days=1), now, ndjson_output, self._db_connection), 14)
+        self.assertEqual(len(ndjson_output.getvalue().splitlines()), 14)
+
+        csv_output = io.StringIO()
+        report_manager.write_breakdown('machine', now - timedelta(days=1), now, csv_output,
+                                       self._db_connection, output_format='csv')
+        self.assertTrue(csv_output.getvalue().startswith("local_ip,country_name,"))
+
+    def test_traffic_carries_site(self):
+        '''Tests that ingested traffic is stamped with the recorder's site'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        cursor = self._db_connection.cursor()
+        cursor.execute('''SELECT tr.site_id, rm.site_id FROM traffic_report.traffic_reports AS tr
+                          JOIN public.recorder_messages AS rm ON (rm.id=tr.msg_id)
+                          WHERE rm.recorder_id=%s''', [self._recorder.pg_id])
+        rows = cursor.fetchall()
+        cursor.close()
+
+        self.assertGreater(len(rows), 0)
+        for row in rows:
+            self.assertEqual(row, (self._test_site.pg_id, self._test_site.pg_id))
+
+    def test_ipv6_traffic(self):
+        '''Tests that IPv6 flows are classified, and a global to global flow is skipped
+        without losing the rest of the message'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_IPV6_LOG)
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        internet_hosts = report_manager.retrieve_internet_host_breakdown(
+            datetime.now() - timedelta(days=1), datetime.now(), self._db_connection)
+
+        self.assertEqual(
+            sorted((str(record.local_ip), str(record.global_ip)) for record in internet_hosts),
+            [("192.168.2.2", "74.125.0.60"),
+             ("fd00::2", "2001:4860:4860::8888"),
+             ("fd00::2", "2a00:1450:4001:82a::200e")])
+
+    def test_hourly_rollups(self):
+        '''Tests that periods read from the rollups, the raw flows or both agree'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        # The periods are laid out around the hour the message was received in
+        cursor = self._db_connection.cursor()
+        cursor.execute('''SELECT received_at FROM public.recorder_messages
+                          WHERE site_id=%s AND message_type='traffic_report''',
+                       [self._test_site.pg_id])
+        received_at = cursor.fetchone()[0]
+        cursor.close()
+        hour = received_at.replace(minute=0, second=0, microsecond=0)
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        def full_host_breakdown(start_period, end_period):
+            '''Returns the sorted full host breakdown of a period'''
+            return sorted(report_manager.retrieve_full_host_breakdown(
+                start_period, end_period, self._db_connection))
+
+        # Inside a single hour, so everything comes from the raw flows
+        raw_report = full_host_breakdown(hour, hour + timedelta(hours=1, microseconds=-1))
+        self.assertGreater(len(raw_report), 0)
+
+        # Only whole hours, so everything comes from the rollups
+        self.assertEqual(full_host_breakdown(hour - timedelta(hours=1),
+                                             hour + timedelta(hours=1)), raw_report)
+
+        # A whole hour from the rollups, then the partial hour holding the flows
+        self.assertEqual(full_host_breakdown(hour - timedelta(hours=1, minutes=30),
+                                             received_at), raw_report)
+
+        # The hour holding the flows from the rollups, between partial hours
+        self.assertEqual(full_host_breakdown(hour - timedelta(minutes=30),
+                                             hour + timedelta(hours=1, minutes=30)), raw_report)
+
+        # Nothing before the message was received
+        self.assertEqual(full_host_breakdown(hour - timedelta(hours=2),
+                                             received_at - timedelta(microseconds=1)), [])
+
+    def test_consolidated_ingest(self):
+        '''Tests that merging flows at ingest stores fewer rows with the same reports'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+        plain_site = self._test_site
+
+        self._test_site = ndr_server.Site.create(
+            self._nsc, self._test_org, "Consolidated Site", db_conn=self._db_connection)
+        self._recorder = ndr_server.Recorder.create(
+            self._nsc, self._test_site, "Consolidated Recorder", "ndr_test_consolidated",
+            db_conn=self._db_connection)
+        self._nsc.traffic_consolidate_flows = True
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        cursor = self._db_connection.cursor()
+        counts = {}
+        for site in (plain_site, self._test_site):
+            cursor.execute('''SELECT COUNT(*), SUM(flow_count) FROM traffic_report.traffic_reports
+                              WHERE site_id=%s''', [site.pg_id])
+            counts[site.pg_id] = cursor.fetchone()
+        cursor.close()
+
+        self.assertLess(counts[self._test_site.pg_id][0], counts[plain_site.pg_id][0])
+        self.assertEqual(counts[self._test_site.pg_id][1], counts[plain_site.pg_id][1])
+
+        now = datetime.now()
+        reports = []
+        for site in (plain_site, self._test_site):
+            report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                                   site,
+                                                                   self._db_connection)
+            reports.append((
+                sorted(report_manager.retrieve_full_host_breakdown(
+                    now - timedelta(days=1), now, self._db_connection)),
+                sorted(report_manager.retrieve_internet_host_breakdown(
+                    now - timedelta(days=1), now, self._db_connection))))
+
+        self.assertEqual(reports[0], reports[1])
+
+    def test_host_sketches(self):
+        '''Tests that the sketches kept at ingest agree with the full host breakdown'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        full_breakdown = report_manager.retrieve_full_host_breakdown(
+            datetime.now() - timedelta(days=1), datetime.now(), self._db_connection)
+
+        local_ip = full_breakdown[0].local_ip
+        totals = {}
+        for record in full_breakdown:
+            if record.local_ip == local_ip:
+                totals[record.global_ip] = (totals.get(record.global_ip, 0) +
+                                            record.total_rx_bytes + record.total_tx_bytes)
+
+        # The test traffic is from 2017
+        start_day = date(2017, 1, 1)
+        end_day = date.today()
+        top_talkers = report_manager.retrieve_top_talkers(
+            local_ip, start_day, end_day, self._db_connection, count=5)
+        self.assertGreater(len(top_talkers), 0)
+        self.assertEqual(top_talkers[0].address, max(totals, key=totals.get))
+        for heavy_hitter in top_talkers:
+            self.assertGreaterEqual(heavy_hitter.estimate, totals[heavy_hitter.address])
+            self.assertLessEqual(heavy_hitter.estimate - heavy_hitter.error,
+                                 totals[heavy_hitter.address])
+
+        self.assertEqual(report_manager.retrieve_distinct_destinations(
+            local_ip, start_day, end_day, self._db_connection), len(totals))
+
+    def test_geoip_backfill(self):
+        '''Tests that flows enriched with an older GeoIP database are found and refreshed'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        versions = dict(self._nsc.database.run_procedure_fetchall(
+            "traffic_report.get_geoip_database_versions", [],
+            existing_db_conn=self._db_connection, tuple_cursor=True))
+
+        cursor = self._db_connection.cursor()
+        cursor.execute('''UPDATE traffic_report.network_outbound_traffic
+                          SET geoip_database_version='stale', country_name=NULL
+                          WHERE site_id=%s''', [self._test_site.pg_id])
+        stale_flows = cursor.rowcount
+        cursor.close()
+
+        stale = self._nsc.database.run_procedure_fetchall(
+            "traffic_report.get_stale_geoip_addresses", [versions[4], versions[6], 0, 1000],
+            existing_db_conn=self._db_connection, tuple_cursor=True)
+        self.assertGreater(len(stale), 0)
+
+        updated = self._nsc.database.run_procedure_fetchone(
+            "traffic_report.reenrich_geoip_for_addresses", [[row[0] for row in stale]],
+            existing_db_conn=self._db_connection, tuple_cursor=True)[0]
+        self.assertEqual(updated, stale_flows)
+
+        stale = self._nsc.database.run_procedure_fetchall(
+            "traffic_report.get_stale_geoip_addresses", [versions[4], versions[6], 0, 1000],
+            existing_db_conn=self._db_connection, tuple_cursor=True)
+        self.assertEqual(len(stale), 0)
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        geoip_report = report_manager.retrieve_geoip_breakdown(
+            datetime.now() - timedelta(days=1),
+            datetime.now(),
+            self._db_connection)
+        self.assertEqual(len(geoip_report), 14)
+
+    def test_geoip_backfill_keeps_expired_rollups(self):
+        '''Tests that re-enriching leaves the rollups of hours whose raw flows expired'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        # Expire a year old partition, leaving only the rollups of its hours behind
+        old = datetime.now() - timedelta(days=365)
+        self._nsc.database.run_procedure_fetchone(
+            "admin.create_time_partitions", [old], existing_db_conn=self._db_connection)
+        self._nsc.database.run_procedure_fetchone(
+            "admin.drop_time_partitions",
+            ["traffic_report.traffic_reports", old + timedelta(days=14)],
+            existing_db_conn=self._db_connection)
+
+        cursor = self._db_connection.cursor()
+        cursor.execute('''SELECT local_ip_id, global_ip_id FROM traffic_report.hourly_traffic_rollups
+                          WHERE site_id=%s LIMIT 1''', [self._test_site.pg_id])
+        local_ip_id, global_ip_id = cursor.fetchone()
+        old_hour = old.replace(minute=0, second=0, microsecond=0)
+        cursor.execute('''INSERT INTO traffic_report.hourly_traffic_rollups
+                          VALUES (%s, %s, %s, %s, 'Old Country', 'Unknown', 'Unknown',
+                                  'Unknown', 'Unknown', 100, 200, 3)''',
+                       [self._test_site.pg_id, old_hour, local_ip_id, global_ip_id])
+
+        cursor.execute('''UPDATE traffic_report.network_outbound_traffic
+                          SET geoip_database_version='stale'
+                          WHERE site_id=%s AND global_ip_id=%s''',
+                       [self._test_site.pg_id, global_ip_id])
+        self.assertGreater(cursor.rowcount, 0)
+
+        self._nsc.database.run_procedure_fetchone(
+            "traffic_report.reenrich_geoip_for_addresses", [[global_ip_id]],
+            existing_db_conn=self._db_connection, tuple_cursor=True)
+
+        cursor.execute('''SELECT country_name, total_rx_bytes, total_tx_bytes, flows
+                          FROM traffic_report.hourly_traffic_rollups
+                          WHERE site_id=%s AND hour=%s AND global_ip_id=%s''',
+                       [self._test_site.pg_id, old_hour, global_ip_id])
+        self.assertEqual(cursor.fetchall(), [('Old Country', 100, 200, 3)])
+
+        # The current hour's rollups still agree with the raw flows
+        cursor.execute('''SELECT COUNT(*) FROM traffic_report.hourly_traffic_rollups
+                          WHERE site_id=%s AND hour >= %s AND global_ip_id=%s''',
+                       [self._test_site.pg_id, old_hour + timedelta(days=1), global_ip_id])
+        self.assertGreater(cursor.fetchone()[0], 0)
+        cursor.close()
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        geoip_report = report_manager.retrieve_geoip_breakdown(
+            datetime.now() - timedelta(days=1),
+            datetime.now(),
+            self._db_connection)
+        self.assertEqual(len(geoip_report), 14)
+
     def test_machine_breakdown_reporting(self):
         '''Tests breaking down data by machine'''
         tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
@@ -138,6 +412,36 @@ class TestIngests(unittest.TestCase):
 
         self.assertEqual(len(internet_host_breakdown), 74)
 
+    def test_internet_host_rows(self):
+        '''Tests deduplicating internet hosts and limiting them to the top talkers, under a
+        heading matching the columns'''
+        def record(hostname, isp, total_bytes):
+            return ndr_server.traffic_report.InternetHostRecord(
+                local_ip=None, global_ip="198.51.100.1", global_hostname=hostname, isp=isp,
+                total_rx_bytes=total_bytes, total_tx_bytes=0)
+
+        records = [record("b.example", "ISP", 10), record("a.example", None, 5),
+                   record("b.example", "ISP", 10), record(None, "ISP", 30),
+                   record("c.example", None, 1)]
+        rows = ndr_server.TsharkTrafficReportManager.internet_host_rows
+
+        self.assertEqual(list(rows(records)), [["b.example", "ISP"], ["a.example", ""],
+                                               ["198.51.100.1", "ISP"], ["c.example", ""]])
+        self.assertEqual(list(rows(records, top=2)), [["198.51.100.1", "ISP", 30],
+                                                      ["b.example", "ISP", 20],
+                                                      ["Other (2 hosts)", "", 6]])
+        self.assertEqual(list(rows(records, top=4)), [["198.51.100.1", "ISP", 30],
+                                                      ["b.example", "ISP", 20],
+                                                      ["a.example", "", 5],
+                                                      ["c.example", "", 1]])
+
+        table = ndr_server.TsharkTrafficReportManager.generate_table_internet_host_traffic
+        self.assertEqual(table(records, csv_output=True).splitlines()[:2],
+                         ["Host,ISP", "b.example,ISP"])
+        self.assertEqual(table(records, csv_output=True, top=2).splitlines(),
+                         ["Host,ISP,Bytes", "198.51.100.1,ISP,30", "b.example,ISP,20",
+                          "Other (2 hosts),,6"])
+
     def test_email_report(self):
         '''Tests generation of email reports and such'''
         tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
@@ -177,6 +481,99 @@ class TestIngests(unittest.TestCase):
         with open('/tmp/zip_email.eml', 'w') as f:
             f.write(alert_email)
 
+    def test_email_report_queries_once(self):
+        '''Tests that all contacts are served from a single set of report queries'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+
+        self._nsc.database.tracer.reset()
+        report_manager.generate_report_emails(datetime.now() - timedelta(days=1),
+                                              datetime.now(),
+                                              db_conn=self._db_connection,
+                                              send=True)
+
+        stats = self._nsc.database.tracer.snapshot()
+        for proc in ["traffic_report.report_geoip_breakdown_for_site",
+                     "traffic_report.report_traffic_breakdown_in_site_by_machine",
+                     "traffic_report.report_internet_host_breakdown_for_site"]:
+            self.assertEqual(stats[proc]['calls'], 1)
+
+    def test_email_report_snapshot_cache(self):
+        '''Tests that re-sending a period's reports reuses the cached datasets until a late
+        message arrives'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        self._nsc.report_snapshot_dir = tempfile.mkdtemp()
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        end_period = datetime.now()
+        start_period = end_period - timedelta(days=1)
+        report_procs = ["traffic_report.report_geoip_breakdown_for_site",
+                        "traffic_report.report_traffic_breakdown_in_site_by_machine",
+                        "traffic_report.report_internet_host_breakdown_for_site"]
+
+        try:
+            calls = []
+            for late_message in (False, False, True):
+                if late_message is True:
+                    tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+                self._nsc.database.tracer.reset()
+                report_manager.generate_report_emails(start_period,
+                                                      end_period,
+                                                      db_conn=self._db_connection,
+                                                      send=True)
+                stats = self._nsc.database.tracer.snapshot()
+                calls.append([stats.get(proc, {}).get('calls', 0) for proc in report_procs])
+        finally:
+            shutil.rmtree(self._nsc.report_snapshot_dir)
+
+        self.assertEqual(calls, [[1, 1, 1], [0, 0, 0], [1, 1, 1]])
+
+        with open(self._test_contact_inline, 'r') as inline_file:
+            self.assertIn("This is a snapshot of internet traffic", inline_file.read())
+
+    def test_snapshot_cache_geoip_backfill(self):
+        '''Tests that a cached snapshot goes stale once the GeoIP backfill refreshes the
+        period's flows'''
+        tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
+
+        cursor = self._db_connection.cursor()
+        cursor.execute('''UPDATE traffic_report.network_outbound_traffic
+                          SET geoip_database_version='stale'
+                          WHERE site_id=%s RETURNING global_ip_id''', [self._test_site.pg_id])
+        stale_ip_ids = sorted(set(row[0] for row in cursor.fetchall()))
+        cursor.close()
+
+        self._nsc.report_snapshot_dir = tempfile.mkdtemp()
+        report_manager = ndr_server.TsharkTrafficReportManager(self._nsc,
+                                                               self._test_site,
+                                                               self._db_connection)
+        end_period = datetime.now()
+        start_period = end_period - timedelta(days=1)
+
+        try:
+            cached = []
+            for backfilled in (False, False, True):
+                if backfilled is True:
+                    self._nsc.database.run_procedure_fetchone(
+                        "traffic_report.reenrich_geoip_for_addresses", [stale_ip_ids],
+                        existing_db_conn=self._db_connection, tuple_cursor=True)
+
+                snapshot = report_manager.snapshot(start_period, end_period,
+                                                   self._db_connection)
+                self.assertEqual(len(snapshot.geoip_breakdown), 14)
+                cached.append(snapshot._cached)
+                snapshot.save()
+        finally:
+            shutil.rmtree(self._nsc.report_snapshot_dir)
+
+        self.assertEqual(cached, [False, True, False])
+
     def test_email_report_zip(self):
         '''Tests generation of email reports with CSV in a ZIP and such'''
         tests.util.ingest_test_file(self, TRAFFIC_REPORT_LOG)
@@ -194,3 +591,56 @@ class TestIngests(unittest.TestCase):
             alert_email = f.read()
 
         self.assertIn("Attached to this email is a CSV breakdown of all traffic for the last 24 hours.", alert_email)
+
+        # The streamed attachment must still be a valid archive holding the breakdown
+        with open(self._test_contact_zip, 'rb') as f:
+            mime_msg = email.message_from_binary_file(f)
+        zip_part = mime_msg.get_payload()[1]
+        with zipfile.ZipFile(io.BytesIO(zip_part.get_payload(decode=True))) as zip_archive:
+            csv_name = zip_archive.namelist()[0]
+            self.assertTrue(csv_name.endswith(".csv"))
+            self.assertIn("Country Breakdown For", str(zip_archive.read(csv_name), 'utf-8'))
+
+FakeTrafficEntry = collections.namedtuple('FakeTrafficEntry',
+                                          'protocol src_address src_hostname src_port \
+                                          dst_address dst_hostname dst_port \
+                                          rx_bytes tx_bytes start_timestamp duration')
+
+class TestFlowConsolidation(unittest.TestCase):
+    '''Tests merging of traffic entries at ingest'''
+
+    def entry(self, src_port, start_timestamp, rx_bytes=100, tx_bytes=10, dst_port=443):
+        return FakeTrafficEntry('tcp', ipaddress.ip_address("192.168.2.2"), None, src_port,
+                                ipaddress.ip_address("74.125.0.60"), "example.com", dst_port,
+                                rx_bytes, tx_bytes, start_timestamp, 1.5)
+
+    def test_merges_by_destination(self):
+        '''Tests that entries only differing by source port and time are merged'''
+        flows = ndr_server.consolidate_traffic_entries([
+            self.entry(50000, 1000), self.entry(50001, 900), self.entry(50002, 1100, dst_port=80),
+            self.entry(50000, 1200)])
+
+        self.assertEqual(len(flows), 2)
+        self.assertEqual(flows[0].dst_port, 443)
+        self.assertEqual(flows[0].flow_count, 3)
+        self.assertEqual(flows[0].src_port, 0)
+        self.assertEqual(flows[0].rx_bytes, 300)
+        self.assertEqual(flows[0].tx_bytes, 30)
+        self.assertEqual(flows[0].start_timestamp, 900)
+        self.assertEqual(flows[0].duration, 4.5)
+        self.assertEqual(flows[1].src_port, 50002)
+        self.assertEqual(flows[1].flow_count, 1)
+
+    def test_time_buckets(self):
+        '''Tests that only entries in the same bucket are merged'''
+        flows = ndr_server.consolidate_traffic_entries([
+            self.entry(50000, 1000), self.entry(50001, 1010), self.entry(50002, 1300)],
+                                                       bucket_seconds=300)
+        self.assertEqual([flow.flow_count for flow in flows], [2, 1])
+
+    def test_byte_limit(self):
+        '''Tests that a merged flow never outgrows the byte columns'''
+        flows = ndr_server.consolidate_traffic_entries([
+            self.entry(50000, 1000, rx_bytes=2**30), self.entry(50001, 1010, rx_bytes=2**30),
+            self.entry(50002, 1020, rx_bytes=5)])
+        self.assertEqual([flow.rx_bytes for flow in flows], [2**30, 2**30 + 5])